@@ -0,0 +1,114 @@
+"""Runs the benchmark scenarios on synthetic data and writes the timings as JSON.
+
+    python -m benchmarks.run --size small --output results.json
+    python -m benchmarks.run --size small --compare results.json  # ratios against an earlier run
+
+latools has to be importable (pip install -e . or PYTHONPATH=src)."""
+from dataclasses import asdict, replace
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import matplotlib
+matplotlib.use("Agg") # no windows from the tasks
+import numpy as np
+from .synthetic import PRESETS, GEDS_RAWID_OFFSET, generate, make_channelmap
+from .scenarios import SCENARIOS, Dataset
+
+def run_scenario(name: str, data: Dataset, repeat: int) -> dict:
+    with contextlib.redirect_stdout(io.StringIO()): # tasks are chatty
+        fcn, rows = SCENARIOS[name](data)
+        fcn() # warm-up (imports, caches of lgdo / numba)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fcn()
+            times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": float(np.median(times)), "mean": float(np.mean(times)),
+            "repeat": repeat, "rows": rows, "rows_per_second": rows / min(times) if min(times) > 0 else None}
+
+def environment() -> dict:
+    versions = {}
+    for module in ("numpy", "awkward", "lgdo", "dspeed", "h5py"):
+        try:
+            versions[module] = __import__(module).__version__
+        except (ImportError, AttributeError):
+            versions[module] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "platform": platform.platform(),
+            "machine": platform.machine(), "cpus": os.cpu_count(), "versions": versions,
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints the ratio new/old of the min times; returns the scenarios slower than threshold"""
+    slower = []
+    print(f"{'scenario':<28} {'old [s]':>10} {'new [s]':>10} {'ratio':>7}")
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<28} {'-':>10} {result['min']:>10.4f}")
+            continue
+        ratio = result["min"] / old["min"] if old["min"] > 0 else float("inf")
+        flag = " SLOWER" if ratio > threshold else ""
+        print(f"{name:<28} {old['min']:>10.4f} {result['min']:>10.4f} {ratio:>7.2f}{flag}")
+        if flag:
+            slower.append(name)
+    if results["dataset"] != baseline.get("dataset"):
+        print("Warning: the baseline was run on a different dataset")
+    return slower
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=PRESETS.keys(), default="small")
+    parser.add_argument("--files", type=int, help="override the number of files of the preset")
+    parser.add_argument("--events", type=int, help="override the events per file of the preset")
+    parser.add_argument("--data-dir", help="where to generate the data (reused if present); default: temp dir")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="regex selecting the scenarios")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="with --compare: exit with 1 if a scenario is slower by more than this factor")
+    args = parser.parse_args(argv)
+    warnings.filterwarnings("ignore")
+    config = PRESETS[args.size]
+    if args.files is not None:
+        config = replace(config, n_files=args.files)
+    if args.events is not None:
+        config = replace(config, n_events=args.events)
+    data_dir = args.data_dir or os.path.join(tempfile.gettempdir(), f"latools-benchmark-{args.size}")
+    print(f"Generating / checking data in {data_dir}", file=sys.stderr)
+    files = generate(data_dir, config)
+    data = Dataset(files, make_channelmap(config), config.n_files * config.n_events, GEDS_RAWID_OFFSET)
+    results = {"environment": environment(), "dataset": asdict(config), "results": {}}
+    for name in SCENARIOS:
+        if not re.search(args.filter, name):
+            continue
+        result = run_scenario(name, data, args.repeat)
+        results["results"][name] = result
+        print(f"{name:<28} {result['min']:>10.4f} s  {result['rows_per_second'] or 0:>14.0f} rows/s", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Timing scenarios. Every scenario does its setup and returns the function to be timed,
+and the number of rows (events) the timed function processes."""
+from collections.abc import Callable
+from dataclasses import dataclass
+import subprocess
+import sys
+import numpy as np
+import awkward as ak
+from latools.core import main_loop, compile_arrays
+from latools.histogram import HistogramTask, Histogram2DTask, CategoricalHistogramTask, CategoricalHistogram2DTask
+from latools.counter import CountTask
+from latools.browse import BrowseAnydetTask
+
+@dataclass
+class Dataset:
+    files: list[dict[str, str]]
+    channelmap: dict
+    n_events: int # of all files
+    first_ged: int # rawid
+
+SCENARIOS: dict[str, Callable[[Dataset], tuple[Callable[[], object], int]]] = {}
+
+def scenario(fcn):
+    SCENARIOS[fcn.__name__] = fcn
+    return fcn
+
+class _NoOp:
+    """outDef task doing nothing, so only the loop itself gets timed"""
+    def __call__(self, x, _):
+        return False
+
+@scenario
+def main_loop_iterate(data: Dataset):
+    inputs = [("e", f"ch{data.first_ged}/raw/energy"), ("c", f"ch{data.first_ged}/dsp/cuspEmax"), ("m", "evt/geds/multiplicity")]
+    return lambda: main_loop(inputs, [], [(["e", "c", "m"], _NoOp())], tier_filename_dict=data.files), data.n_events
+
+@scenario
+def main_loop_chunked(data: Dataset):
+    inputs = [("e", f"ch{data.first_ged}/raw/energy"), ("m", "evt/geds/multiplicity")]
+    return lambda: main_loop(inputs, [], [(["e", "m"], _NoOp())], tier_filename_dict=data.files,
+                             chunk_size=10000), data.n_events
+
+@scenario
+def main_loop_pre_reducer(data: Dataset):
+    inputs = [("e", f"ch{data.first_ged}/raw/energy"), ("r", "evt/geds/rawid"), ("m", "evt/geds/multiplicity")]
+    reducer = (["m"], lambda x: x[0] == 1)
+    return lambda: main_loop(inputs, [], [(["e", "r"], _NoOp())], tier_filename_dict=data.files,
+                             pre_reducer=reducer), data.n_events
+
+@scenario
+def main_loop_selective_read(data: Dataset):
+    inputs = [("e", f"ch{data.first_ged}/raw/energy"), ("r", "evt/geds/rawid"), ("m", "evt/geds/multiplicity")]
+    reducer = (["m"], lambda x: x[0] == 1)
+    return lambda: main_loop(inputs, [], [(["e", "r"], _NoOp())], tier_filename_dict=data.files,
+                             pre_reducer=reducer, selective_read=True), data.n_events
+
+@scenario
+def compile_arrays_geds(data: Dataset):
+    inputs = [("r", "evt/geds/rawid"), ("ge", "evt/geds/energy")]
+    gens = [(["ge"], "gsum", lambda x: ak.sum(x[0], axis=-1))]
+    return lambda: compile_arrays(inputs, gens, tier_filename_dict=data.files), data.n_events
+
+def _fill(task, arrays: list[ak.Array]):
+    def run():
+        task.initialize()
+        task(arrays, "ALL_FILES")
+        return task
+    return run
+
+def _evt_arrays(data: Dataset) -> dict[str, ak.Array]:
+    return compile_arrays([("e", f"ch{data.first_ged}/raw/energy"), ("c", f"ch{data.first_ged}/dsp/cuspEmax"),
+                           ("r", "evt/geds/rawid"), ("m", "evt/geds/multiplicity"), ("ge", "evt/geds/energy")], [],
+                          tier_filename_dict=data.files)
+
+@scenario
+def histogram_1d(data: Dataset):
+    arrays = _evt_arrays(data)
+    return _fill(HistogramTask(0, 4000, 4000), [arrays["e"]]), len(arrays["e"])
+
+@scenario
+def histogram_1d_weighted(data: Dataset):
+    arrays = _evt_arrays(data)
+    return _fill(HistogramTask(0, 4000, 4000, weight_fcn=lambda x: x[1]), [arrays["e"], arrays["c"]]), len(arrays["e"])
+
+@scenario
+def histogram_2d(data: Dataset):
+    arrays = _evt_arrays(data)
+    return _fill(Histogram2DTask(0, 4000, 400, 0, 4000, 400), [arrays["e"], arrays["c"]]), len(arrays["e"])
+
+@scenario
+def categorical_1d(data: Dataset):
+    arrays = _evt_arrays(data)
+    return _fill(CategoricalHistogramTask(lambda x: ak.flatten(x[0])), [arrays["r"]]), len(arrays["r"])
+
+@scenario
+def categorical_2d_cartesian(data: Dataset):
+    arrays = _evt_arrays(data)
+    task = CategoricalHistogram2DTask(lambda x: x[0], lambda x: x[1], mode="cartesian")
+    return _fill(task, [arrays["r"], ak.values_astype(arrays["ge"] // 500, np.int64)]), len(arrays["r"])
+
+@scenario
+def count(data: Dataset):
+    arrays = _evt_arrays(data)
+    return _fill(CountTask(lambda x: x[0] > 800), [arrays["e"]]), len(arrays["e"])
+
+@scenario
+def browse_singularize(data: Dataset):
+    task = BrowseAnydetTask(lambda x: x[0], channelmap=data.channelmap, autodraw=False,
+                            oversearch=10**12, cycle=5)
+    task.initialize()
+    for filename_tiers in data.files:
+        arrays = compile_arrays([("r", "evt/geds/rawid")], [], tier_filename_dict=[filename_tiers])
+        task([arrays["r"]], filename_tiers["raw"])
+    def run():
+        task.blacklist = []
+        task._table = None # rebuild the detector table every time
+        for _ in range(task.cycle):
+            detector = task._singularize()[0]
+            task.blacklist.append(detector)
+    return run, data.n_events
+
+# what a batch job imports; none of the heavy backends may come with it
+_BATCH_IMPORT = """
+import sys
+import latools.core, latools.histogram, latools.counter, latools.browse, latools.utils, latools.fileindex
+heavy = [module for module in ("matplotlib", "dspeed", "lgdo") if module in sys.modules]
+sys.exit(f"imported by latools at import time: {heavy}" if heavy else 0)
+"""
+
+@scenario
+def import_batch(data: Dataset):
+    """Startup of a fresh interpreter importing latools (fails if it imports matplotlib, dspeed or lgdo)"""
+    def run():
+        process = subprocess.run([sys.executable, "-c", _BATCH_IMPORT], capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip())
+    return run, 1
@@ -0,0 +1,88 @@
+"""Generator of synthetic raw/dsp/evt LH5 files (LEGEND-like layout) for the benchmarks"""
+from dataclasses import dataclass, asdict
+from types import SimpleNamespace
+import os
+import json
+import numpy as np
+from lgdo import Array, Table, VectorOfVectors, WaveformTable, lh5
+
+GEDS_RAWID_OFFSET = 1104000
+SPMS_RAWID_OFFSET = 1052000
+
+@dataclass(frozen=True)
+class DatasetConfig:
+    n_files: int = 4
+    n_events: int = 20000 # per file
+    n_geds: int = 20
+    n_spms: int = 10
+    mean_multiplicity: float = 1.5 # of the (jagged) evt/geds fields; Poisson distributed
+    waveform_length: int = 0 # samples of raw waveforms (0: no waveforms)
+    seed: int = 0
+
+PRESETS = {
+    "tiny": DatasetConfig(n_files=2, n_events=2000, n_geds=5, n_spms=2),
+    "small": DatasetConfig(),
+    "medium": DatasetConfig(n_files=8, n_events=100000, n_geds=50, n_spms=20),
+    "large": DatasetConfig(n_files=16, n_events=500000, n_geds=100, n_spms=60, mean_multiplicity=2.),
+}
+
+def channel_names(config: DatasetConfig) -> dict[str, int]:
+    """channel name -> rawid"""
+    names = {f"V{i:05d}": GEDS_RAWID_OFFSET + i for i in range(config.n_geds)}
+    names.update({f"S{i:03d}": SPMS_RAWID_OFFSET + i for i in range(config.n_spms)})
+    return names
+
+def make_channelmap(config: DatasetConfig) -> dict[str, SimpleNamespace]:
+    """Minimal stand-in for LegendMetadata.channelmap (channel name -> .daq.rawid)"""
+    return {name: SimpleNamespace(daq=SimpleNamespace(rawid=rawid)) for name, rawid in channel_names(config).items()}
+
+def generate(directory: str, config: DatasetConfig = DatasetConfig(), *, force: bool = False) -> list[dict[str, str]]:
+    """Writes the files of config to directory (unless already there with the same config)
+    and returns them as tier_filename_dict for main_loop / compile_arrays."""
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "dataset.json")
+    if not force and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["config"] == asdict(config) and all(os.path.exists(path) for files in manifest["files"]
+                                                        for path in files.values()):
+            return manifest["files"]
+    rng = np.random.default_rng(config.seed)
+    files = []
+    for i in range(config.n_files):
+        timestamp = f"20230101T{i // 60:02d}{i % 60:02d}00Z"
+        filename_tiers = {tier: os.path.join(directory, f"l200-p03-r000-phy-{timestamp}-tier_{tier}.lh5")
+                          for tier in ("raw", "dsp", "evt")}
+        _write_file(filename_tiers, config, rng)
+        files.append(filename_tiers)
+    with open(manifest_path, "w") as f:
+        json.dump({"config": asdict(config), "files": files}, f, indent=1)
+    return files
+
+# PRIVATE
+
+def _write_file(filename_tiers: dict[str, str], config: DatasetConfig, rng: np.random.Generator):
+    n = config.n_events
+    channels = channel_names(config)
+    for i, (name, rawid) in enumerate(channels.items()):
+        mode = "of" if i == 0 else "a"
+        raw = {"energy": Array(rng.gamma(2., 400., n)),
+               "baseline": Array(rng.normal(15000, 20, n).astype(np.float32)),
+               "timestamp": Array(np.sort(rng.uniform(0, 3600, n)))}
+        if config.waveform_length > 0:
+            waveforms = rng.normal(15000, 20, (n, config.waveform_length)).astype(np.uint16)
+            raw["waveform_presummed" if name[0] == "V" else "waveform_bit_drop"] = \
+                WaveformTable(t0=np.zeros(n), t0_units="ns", dt=np.full(n, 16.), dt_units="ns", values=waveforms)
+        lh5.write(Table(col_dict=raw), f"ch{rawid}/raw", filename_tiers["raw"], wo_mode=mode)
+        dsp = {"cuspEmax": Array(rng.gamma(2., 400., n)), "tp_0": Array(rng.normal(48000, 50, n))}
+        lh5.write(Table(col_dict=dsp), f"ch{rawid}/dsp", filename_tiers["dsp"], wo_mode=mode)
+    geds_rawids = np.array([rawid for name, rawid in channels.items() if name[0] == "V"], dtype=np.int32)
+    multiplicity = rng.poisson(config.mean_multiplicity, n) if len(geds_rawids) > 0 else np.zeros(n, dtype=np.int64)
+    cumulative_length = np.cumsum(multiplicity)
+    total = int(cumulative_length[-1]) if n > 0 else 0
+    evt = {"rawid": VectorOfVectors(flattened_data=Array(rng.choice(geds_rawids, total) if total > 0 else np.zeros(0, np.int32)),
+                                    cumulative_length=Array(cumulative_length)),
+           "energy": VectorOfVectors(flattened_data=Array(rng.gamma(2., 400., total)),
+                                     cumulative_length=Array(cumulative_length)),
+           "multiplicity": Array(multiplicity)}
+    lh5.write(Table(col_dict=evt), "evt/geds", filename_tiers["evt"], wo_mode="of")
@@ -0,0 +1,32 @@
+"""The plotting / waveform browsing backends (matplotlib, dspeed), imported only when something gets drawn,
+so that importing latools stays cheap for batch jobs; and the headless mode, in which nothing gets drawn."""
+import os
+
+_headless = os.environ.get("LATOOLS_HEADLESS", "").lower() not in ("", "0", "false", "no")
+
+def set_headless(headless: bool = True):
+    """In headless mode, the tasks only get filled: finalize() does not draw (and matplotlib / dspeed are never
+    imported). Also switched on by the environment variable LATOOLS_HEADLESS=1."""
+    global _headless
+    _headless = headless
+
+def is_headless() -> bool:
+    return _headless
+
+def pyplot():
+    """matplotlib.pyplot (imported at the first call)"""
+    if _headless:
+        raise RuntimeError("latools is in headless mode; switch it off with set_headless(False) to draw")
+    from matplotlib import pyplot as plt
+    return plt
+
+def log_norm():
+    import matplotlib.colors
+    return matplotlib.colors.LogNorm()
+
+def waveform_browser(*args, **kwargs):
+    """A dspeed WaveformBrowser"""
+    if _headless:
+        raise RuntimeError("latools is in headless mode; switch it off with set_headless(False) to browse")
+    from dspeed.vis.waveform_browser import WaveformBrowser
+    return WaveformBrowser(*args, **kwargs)
@@ -2,14 +2,18 @@
 import os
 import numpy as np
 import awkward as ak
-from dspeed.vis.waveform_browser import WaveformBrowser
-from .utils import get_detector_system_for_channelname, get_key_for_rawid
+from .utils import FileRef, get_detector_system_for_channelname, get_channel_index
+from .waveforms import WaveformCache
+from .backends import waveform_browser, is_headless
 
 class BrowseTask:
     def __init__(self, fcn, detector: str, *, max_entries: int = 7, autodraw = True,
-                 title: str|bool = False, verbosity: int = 0):
+                 title: str|bool = False, verbosity: int = 0, waveform_cache: WaveformCache | None = None,
+                 prefetch: bool = True):
         """fcn has to take a list of input awkward arrays and should return a 1-d bool mask of events to be drawn
         Title: str -> use this; True -> use detector, False -> no title :(
+        waveform_cache: where the waveforms to be drawn are kept (can be shared between tasks)
+        prefetch: read the waveforms of the selected events in the background already during the loop
         """
         self.fcn = fcn
         self.max_entries = max_entries
@@ -18,10 +22,15 @@ class BrowseTask:
         self.max_entries_drawn = self.max_entries
         self.title = title
         self.verbosity = verbosity
+        self.waveform_cache = waveform_cache if waveform_cache is not None else WaveformCache()
+        self.prefetch = prefetch
+        self.browser = None # the last WaveformBrowser drawn; draw_next() shows the next events
     def initialize(self):
         self.files = []
         self.entries = []   # list of entries ak array (one for each file)
         self.nr_entries = 0
+        self._nr_prefetched = 0
+        self._shown = None # what draw() showed last (for draw_next())
     def __call__(self, x, raw):
         bool_mask = self.fcn(x)
         return self._add_events(bool_mask, raw, self.max_entries)
@@ -35,33 +44,63 @@ class BrowseTask:
             return False
         #disabled cropping, since that would be difficult to replicate for deriving classes XXX
         #entries = entries[:(min(len(entries), max_entries-self.nr_entries))] # slice off if we hit goal
-        self.files.append(raw)
-        self.entries.append(entries)
+        if isinstance(raw, FileRef): # rows of the arrays might not be the entries of the file
+            entries = raw.to_file_entries(entries)
+            raw = str(raw)
+        if self.prefetch and self.detector and not is_headless() and self._nr_prefetched < self.max_entries_drawn:
+            wanted = entries[:self.max_entries_drawn - self._nr_prefetched] # only the ones draw() shows
+            self.waveform_cache.prefetch(raw, f"/{self.detector}/raw", _wf_name(self.detector), wanted)
+            self._nr_prefetched += len(wanted)
+        if len(self.files) > 0 and self.files[-1] == raw: # next chunk of the same file
+            self.entries[-1] = np.concatenate([self.entries[-1], entries])
+        else:
+            self.files.append(raw)
+            self.entries.append(entries)
         if self.verbosity >= 1:
             print(f"Wanna draw file {os.path.basename(raw)}, entries {list(entries)}")
         self.nr_entries += len(entries) # disabled cropping XXX
         #self.nr_entries += min(len(entries), max_entries-self.nr_entries)
         return self.nr_entries >= max_entries # break condition for the loop
+    def get_state(self):
+        return {"files": self.files, "entries": self.entries, "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        self.files.extend(state["files"])
+        self.entries.extend(state["entries"])
+        self.nr_entries += state["nr_entries"]
+        return self.nr_entries >= self.max_entries
     def finalize(self):
-        if self.autodraw:
+        if self.autodraw and not is_headless():
             self.draw()
     def draw(self):
         self._draw(self.files, self.entries, self.nr_entries, self.max_entries_drawn, self.detector, self.verbosity, self.title)
-    @staticmethod
-    def _draw(files, entries, nr_entries, max_entries_drawn, detector, verbosity, title:str|bool=False):
+    def draw_next(self):
+        """Draws the next max_entries_drawn events of the last draw()"""
+        if self._shown is None:
+            raise RuntimeError("Nothing drawn yet")
+        files, entries, nr_entries, max_entries_drawn, detector, verbosity, title, start = self._shown
+        if start + max_entries_drawn >= nr_entries:
+            print("No more entries")
+            return
+        self._draw(files, entries, nr_entries, max_entries_drawn, detector, verbosity, title, start + max_entries_drawn)
+    def _draw(self, files, entries, nr_entries, max_entries_drawn, detector, verbosity, title:str|bool=False,
+              start: int = 0):
         if len(files) == 0:
             print("No files found!")
             return
+        self._shown = (files, entries, nr_entries, max_entries_drawn, detector, verbosity, title, start)
+        stop = min(nr_entries, start + max_entries_drawn)
         if verbosity >= 0:
-            print(f"We have {nr_entries} entries; plot {min(nr_entries, max_entries_drawn)} of them")
-        browser = WaveformBrowser(
-            files_in=files,
-            lh5_group=f"/{detector}/raw",
-            entry_list=entries,
-            lines=[get_detector_system_for_channelname(detector).default_display_wf_name],
+            print(f"We have {nr_entries} entries; plot {start}..{stop - 1} of them")
+        # the browser gets the (cached) waveforms of the drawn events only, instead of re-reading the raw files
+        wf_name = _wf_name(detector)
+        shown_files, shown_entries = _entry_range(files, entries, start, stop)
+        browser = waveform_browser(
+            self.waveform_cache.table(shown_files, shown_entries, f"/{detector}/raw", wf_name),
+            lines=[wf_name],
             #lines=["waveform_presummed"],
-            n_drawn=min(nr_entries, max_entries_drawn)
+            n_drawn=stop - start
         )
+        self.browser = browser
         #print(browser.lh5_it.read(0))
         browser.draw_next()#draw_current()
         if title:
@@ -69,53 +108,157 @@ class BrowseTask:
             browser.ax.set_title(the_title)
 
 class BrowseAnydetTask(BrowseTask):
-    def __init__(self, fcn, *, channelmap, max_entries: int = 7, autodraw = True, oversearch: int = 1000, blacklist: list[str] = [], cycle: int = 1):
-        """fcn has to take a list of ak arrays and return a 2-dim ak array of detector rawids to be drawn"""
-        super().__init__(fcn, "", max_entries=(max_entries if oversearch == 0 else oversearch), autodraw=autodraw)
+    def __init__(self, fcn, *, channelmap, max_entries: int = 7, autodraw = True, oversearch: int = 1000, blacklist: list[str] = [], cycle: int = 1,
+                 order: str = "first", waveform_cache: WaveformCache | None = None, prefetch: bool = True):
+        """fcn has to take a list of ak arrays and return a 2-dim ak array of detector rawids to be drawn
+        order: which detectors to draw first. "first": in order of appearance, "frequency": the ones in most events
+        prefetch: read the waveforms of the first max_entries events of the detectors draw() is going to show
+        (the first cycle ones in order, as far as seen) in the background"""
+        super().__init__(fcn, "", max_entries=(max_entries if oversearch == 0 else oversearch), autodraw=autodraw,
+                         waveform_cache=waveform_cache, prefetch=prefetch)
         self.max_entries_drawn = max_entries
         self.channelmap = channelmap # from LegendMetadata.channelmap
+        self.channel_index = get_channel_index(channelmap)
         self.detector_rawids = [] # list (per-file) of 2-dim ak arrays of drawable rawids per event in file
-        self.blacklist = blacklist
+        self.blacklist = list(blacklist)
+        self.drawn = [] # detectors shown by draw() (skipped by the next draw())
         self.cycle = cycle # how many channels we want to have a look at
+        if order not in ("first", "frequency"):
+            raise ValueError(f"Unknown order {order}")
+        self.order = order
+        self._table = None
+    def initialize(self):
+        super().initialize()
+        self.detector_rawids = []
+        self._table = None
+        self._prefetched = {} # detector -> nr of its entries queued for prefetching
+        self._nr_events = {} # detector -> nr of events seen so far (in order of appearance), for _prefetch()
     def __call__(self, x, raw):
         rawid_ak = self.fcn(x) # has to be a 2-dim array (events, rawids)
         if rawid_ak.ndim != 2:
             raise RuntimeError(f"rawid array has to be 2-dim. Got {rawid_ak.ndim}")
         bool_mask = ak.any(rawid_ak, axis = -1)
         if len(rawid_ak[bool_mask]) > 0:   # superclass zero-suppresses so we have to do as well
-            self.detector_rawids.append(rawid_ak[bool_mask])
+            if len(self.files) > 0 and self.files[-1] == str(raw): # superclass merges chunks of the same file
+                self.detector_rawids[-1] = ak.concatenate([self.detector_rawids[-1], rawid_ak[bool_mask]])
+            else:
+                self.detector_rawids.append(rawid_ak[bool_mask])
+            self._table = None
+            if self.prefetch and not is_headless():
+                self._prefetch(rawid_ak[bool_mask], np.flatnonzero(bool_mask), raw)
         return self._add_events(bool_mask, raw, self.max_entries)
+    def _prefetch(self, rawids, rows, raw):
+        """Queues the waveforms of the (first max_entries_drawn) events of the next cycle detectors in order"""
+        entries = raw.to_file_entries(rows) if isinstance(raw, FileRef) else rows
+        per_event = ak.to_numpy(ak.num(rawids, axis=-1))
+        flat_rawids = ak.to_numpy(ak.flatten(rawids, axis=None)).astype(np.int64)
+        flat_entries = np.repeat(entries, per_event)
+        unique_rawids, first = np.unique(flat_rawids, return_index=True)
+        unique_rawids = unique_rawids[np.argsort(first)] # in order of appearance
+        detector_entries = {}
+        for name, rawid in zip(self.channel_index.names_of(unique_rawids), unique_rawids):
+            if name is not None:
+                detector_entries[name] = np.unique(flat_entries[flat_rawids == rawid])
+                self._nr_events[name] = self._nr_events.get(name, 0) + len(detector_entries[name])
+        skip = set(self.blacklist) | set(self.drawn)
+        candidates = [name for name in self._nr_events if name not in skip]
+        if self.order == "frequency":
+            candidates.sort(key=lambda name: -self._nr_events[name]) # stable: ties in order of appearance
+        for name in candidates[:self.cycle]:
+            wanted = self.max_entries_drawn - self._prefetched.get(name, 0)
+            if name not in detector_entries or wanted <= 0:
+                continue
+            self._prefetched[name] = self._prefetched.get(name, 0) + len(detector_entries[name][:wanted])
+            self.waveform_cache.prefetch(str(raw), f"/{name}/raw", _wf_name(name), detector_entries[name][:wanted])
+    def get_state(self):
+        return {**super().get_state(), "detector_rawids": self.detector_rawids}
+    def merge_state(self, state):
+        self.detector_rawids.extend(state["detector_rawids"])
+        self._table = None
+        return super().merge_state(state)
     def draw(self):
         # first we need to find a single drawable detector (WF browser cannot draw
         # different detectors per-event)
         # do that in temporary lists, so we keep the original data
         for _ in range(self.cycle):
-            detector, files, entries, nr_entries, _ = self._singularize()
+            try:
+                detector, files, entries, nr_entries, _ = self._singularize()
+            except RuntimeError as e:
+                print(e)
+                break
             super()._draw(files, entries, nr_entries, self.max_entries_drawn, detector, self.verbosity)
-            self.blacklist.append(detector)
+            self.drawn.append(detector)
+    def detector_counts(self) -> dict[str, int]:
+        """Number of collected events per detector, most frequent first"""
+        table = self._detector_table()
+        return {table.names[i]: int(table.counts[i]) for i in table.by_frequency if table.names[i] is not None}
     def _singularize(self):
-        # let's take the first detetor showing up in our list. This is ofc arbitrary.
-        select_rawid = self._select_rawid(ak.flatten(self.detector_rawids, axis=None))#self.detector_rawids[0][0][0]
-        print("Selected", get_key_for_rawid(self.channelmap, select_rawid))
+        """Picks the next (not blacklisted, not yet drawn) detector and returns its name and the per-file entries
+        (and rawids) of the events it shows up in"""
+        table = self._detector_table()
+        blacklist = set(self.blacklist) | set(self.drawn)
+        candidates = table.by_first if self.order == "first" else table.by_frequency
+        for cand in candidates:
+            if table.names[cand] is not None and table.names[cand] not in blacklist:
+                break
+        else:
+            raise RuntimeError("No (more) detector to draw")
+        print("Selected", table.names[cand])
+        rows = slice(table.starts[cand], table.starts[cand] + table.counts[cand])
+        file_indices, event_indices = table.file_indices[rows], table.event_indices[rows]
+        # sorted by file, then event: split into the files
+        file_starts = np.flatnonzero(np.diff(file_indices, prepend=-1))
         new_files = []
         new_entries = []
         new_rawids = []
-        new_entries_nr = 0
-        #print(select_rawid)
-        for file, entries, rawids in zip(self.files, self.entries, self.detector_rawids):
-            entries = entries[ak.any(rawids == select_rawid, axis=-1)]
-            rawids = rawids[ak.any(rawids == select_rawid, axis=-1)] # just for completeness
-            if len(entries) > 0:
-                new_files.append(file)
-                new_entries.append(entries)
-                new_rawids.append(rawids)
-                new_entries_nr += len(entries)
-        if len(new_files) == 0:
-            raise RuntimeError("reduced to 0...")
-        return get_key_for_rawid(self.channelmap, select_rawid), new_files, new_entries, new_entries_nr, new_rawids 
-    def _select_rawid(self, rawids_array:ak.Array):
-        assert rawids_array.ndim == 1
-        for rawid in rawids_array:
-            detectorname = get_key_for_rawid(self.channelmap, rawid)
-            if detectorname not in self.blacklist:
-                return rawid
\ No newline at end of file
+        for file_index, events in zip(file_indices[file_starts], np.split(event_indices, file_starts[1:])):
+            new_files.append(self.files[file_index])
+            new_entries.append(self.entries[file_index][events])
+            new_rawids.append(self.detector_rawids[file_index][events]) # just for completeness
+        return table.names[cand], new_files, new_entries, len(event_indices), new_rawids
+    def _detector_table(self) -> "_DetectorTable":
+        if self._table is None:
+            self._table = _DetectorTable(self.detector_rawids, self.channel_index)
+        return self._table
+
+class _DetectorTable:
+    """All collected (file, event) pairs grouped by rawid, built in one vectorised pass"""
+    def __init__(self, detector_rawids: list[ak.Array], channel_index):
+        rawids, file_indices, event_indices = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for file_index, rawids_of_file in enumerate(detector_rawids):
+            per_event = ak.to_numpy(ak.num(rawids_of_file, axis=-1))
+            rawids.append(ak.to_numpy(ak.flatten(rawids_of_file, axis=None)).astype(np.int64))
+            event_indices.append(np.repeat(np.arange(len(per_event)), per_event))
+            file_indices.append(np.full(len(rawids[-1]), file_index))
+        rawids = np.concatenate(rawids)
+        file_indices = np.concatenate(file_indices)
+        event_indices = np.concatenate(event_indices)
+        appearance = np.arange(len(rawids)) # position in the order of appearance
+        order = np.lexsort((event_indices, file_indices, rawids))
+        rawids, file_indices, event_indices, appearance = rawids[order], file_indices[order], event_indices[order], appearance[order]
+        # a rawid twice in the same event counts once
+        keep = np.ones(len(rawids), dtype=bool)
+        keep[1:] = (np.diff(rawids) != 0) | (np.diff(file_indices) != 0) | (np.diff(event_indices) != 0)
+        rawids, self.file_indices, self.event_indices, appearance = rawids[keep], file_indices[keep], event_indices[keep], appearance[keep]
+        self.rawids, self.starts, self.counts = np.unique(rawids, return_index=True, return_counts=True)
+        first_appearance = np.minimum.reduceat(appearance, self.starts) if len(rawids) > 0 else appearance
+        self.names = channel_index.names_of(self.rawids)
+        self.by_first = np.argsort(first_appearance, kind="stable")
+        self.by_frequency = np.argsort(-self.counts, kind="stable")
+
+def _entry_range(files: list, entries: list, start: int, stop: int) -> tuple[list, list]:
+    """The files and entries of the events start..stop-1 (counted over all files)"""
+    range_files, range_entries = [], []
+    position = 0
+    for filename, file_entries in zip(files, entries):
+        first, last = max(start - position, 0), min(stop - position, len(file_entries))
+        if first < last:
+            range_files.append(filename)
+            range_entries.append(file_entries[first:last])
+        position += len(file_entries)
+        if position >= stop:
+            break
+    return range_files, range_entries
+
+def _wf_name(detector: str) -> str:
+    return get_detector_system_for_channelname(detector).default_display_wf_name
@@ -0,0 +1,225 @@
+from typing import Any
+import os
+import hashlib
+import logging
+import types
+import numpy as np
+import awkward as ak
+from .utils import atomic_write
+
+_logger = logging.getLogger(__name__)
+
+class ArrayCache:
+    """Persistent on-disk cache of the input and generated arrays of main_loop / compile_arrays.
+    Arrays are stored columnar (awkward buffers in a .npz file per array) under a key, which combines
+    everything the array depends on: file path/mtime/size and spec (and rows) for input arrays,
+    the code of the function and the keys of its inputs for generated arrays.
+    If max_bytes is given, the least recently used arrays get evicted."""
+    def __init__(self, directory: str, max_bytes: int | None = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None # bytes on disk; scanned lazily
+        os.makedirs(directory, exist_ok=True)
+    def input_key(self, spec: str, filename: str, **read_kwargs) -> str:
+        stat = os.stat(filename)
+        parts = [os.path.abspath(filename), stat.st_mtime_ns, stat.st_size, spec]
+        for name, value in sorted(read_kwargs.items()):
+            parts += [name, _digest(value) if _is_array(value) else value]
+        return derived_key("input", *parts)
+    def get(self, key: str) -> ak.Array | None:
+        path = self._path(key)
+        try:
+            with np.load(path) as npz:
+                form = ak.forms.from_json(str(npz["__form__"]))
+                container = {name: npz[name] for name in npz.files if not name.startswith("__")}
+                array = ak.from_buffers(form, int(npz["__length__"]), container)
+            os.utime(path) # mark as recently used
+        except (FileNotFoundError, OSError, ValueError, KeyError): # missing, evicted meanwhile, or broken
+            return None
+        return array
+    def put(self, key: str, array: ak.Array):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        form, length, container = ak.to_buffers(ak.to_packed(array))
+        with atomic_write(path) as f:
+            np.savez(f, __form__=np.array(form.to_json()), __length__=np.array(length), **container)
+        if self.max_bytes is not None:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+    def get_or_compute(self, key: str, compute) -> ak.Array:
+        array = self.get(key)
+        if array is None:
+            array = compute()
+            self.put(key, array)
+        return array
+    def clear(self):
+        for path, _, _ in self._entries():
+            os.remove(path)
+        self._size = 0
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".npz")
+    def _entries(self):
+        """(path, last usage, size) of all cached arrays"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".npz"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+def derived_key(what: str, *parts) -> str:
+    """Key of an array derived from parts (other keys, functions, numbers, ...)"""
+    h = hashlib.sha1(what.encode())
+    for part in parts:
+        h.update(b"\0")
+        if callable(part):
+            h.update(function_hash(part).encode())
+        elif _is_array(part): # by content: the repr of a long array is abbreviated
+            h.update(_digest(part).encode())
+        else:
+            h.update(repr(part).encode())
+    return h.hexdigest()
+
+def function_hash(fcn) -> str:
+    """Hash of the code of fcn, including the values it captures (defaults, closure) and the globals it
+    refers to: functions (recursively), numbers, strings, numpy arrays and containers of these.
+    Changing any of them changes the hash. Other global objects (besides modules and classes) cannot be
+    hashed: a warning is logged, and changing them does not change the hash."""
+    h = hashlib.sha1()
+    _update_hash(h, fcn, set())
+    return h.hexdigest()
+
+# PRIVATE
+
+def _is_array(value) -> bool:
+    return isinstance(value, (np.ndarray, ak.Array))
+
+def _digest(array: np.ndarray | ak.Array) -> str:
+    """Hash of the content of a numpy or awkward array, including its dtype and shape (or form)"""
+    h = hashlib.sha1()
+    if isinstance(array, ak.Array):
+        form, length, buffers = ak.to_buffers(ak.to_packed(array))
+        h.update(f"{form.to_json()}{length}".encode())
+        for name, buffer in sorted(buffers.items()):
+            h.update(name.encode())
+            h.update(np.ascontiguousarray(buffer).tobytes())
+    elif array.dtype == object: # the bytes would be pointers
+        h.update(repr(array.tolist()).encode())
+    else:
+        h.update(f"{array.dtype.str}{array.shape}".encode())
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+_warned: set[tuple[str, str]] = set() # (function, global) pairs already warned about
+
+def _hashable(value) -> bool:
+    """Whether _update_hash() covers everything value is made of"""
+    if isinstance(value, (types.FunctionType, int, float, complex, str, bytes, np.generic)) or value is None \
+            or _is_array(value):
+        return True
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(map(_hashable, value))
+    if isinstance(value, dict):
+        return all(_hashable(key) and _hashable(item) for key, item in value.items())
+    return callable(value) and hasattr(value, "__dict__") # e.g. a task (code and configuration)
+
+def _update_hash(h, obj, seen: set):
+    if id(obj) in seen:
+        return
+    if isinstance(obj, (types.FunctionType, types.MethodType, types.CodeType, types.BuiltinFunctionType)) \
+            or (callable(obj) and not isinstance(obj, type)):
+        seen.add(id(obj))
+    if isinstance(obj, types.MethodType):
+        _update_hash(h, obj.__func__, seen)
+        _update_hash(h, obj.__self__, seen)
+    elif isinstance(obj, types.FunctionType):
+        _update_hash(h, obj.__code__, seen)
+        for value in (obj.__defaults__ or ()):
+            _update_hash(h, value, seen)
+        for cell in (obj.__closure__ or ()):
+            try:
+                _update_hash(h, cell.cell_contents, seen)
+            except ValueError: # empty cell
+                pass
+        for name in obj.__code__.co_names:
+            if name not in obj.__globals__: # a builtin or an attribute name
+                continue
+            value = obj.__globals__[name]
+            if isinstance(value, (types.ModuleType, type, types.BuiltinFunctionType)):
+                continue
+            h.update(name.encode())
+            if _hashable(value):
+                _update_hash(h, value, seen)
+            elif (obj.__qualname__, name) not in _warned:
+                _warned.add((obj.__qualname__, name))
+                _logger.warning(f"{obj.__qualname__} uses global {name} of type {type(value).__name__}, which "
+                                "cannot be hashed: cached results will not notice when it changes")
+    elif isinstance(obj, types.CodeType):
+        h.update(obj.co_code)
+        h.update(repr(obj.co_names).encode())
+        for const in obj.co_consts:
+            _update_hash(h, const, seen)
+    elif _is_array(obj):
+        h.update(_digest(obj).encode())
+    elif isinstance(obj, (list, tuple)):
+        h.update(type(obj).__name__.encode())
+        for item in obj:
+            _update_hash(h, item, seen)
+    elif isinstance(obj, dict):
+        h.update(b"dict")
+        for key, value in obj.items():
+            _update_hash(h, key, seen)
+            _update_hash(h, value, seen)
+    elif isinstance(obj, (set, frozenset)): # iteration order of str items changes between runs
+        h.update(repr(sorted(map(repr, obj))).encode())
+    elif callable(obj) and not isinstance(obj, (type, types.BuiltinFunctionType)) and hasattr(obj, "__dict__"):
+        # callable object (e.g. a task): its class' code and its configuration
+        h.update(type(obj).__qualname__.encode())
+        _update_hash(h, type(obj).__call__, seen)
+        for name, value in _configuration(obj):
+            h.update(name.encode())
+            _update_hash(h, value, seen)
+    elif isinstance(obj, types.ModuleType):
+        h.update(obj.__name__.encode())
+    else:
+        text = repr(obj)
+        if " at 0x" in text: # default repr with an address: not stable between runs
+            text = f"{type(obj).__module__}.{type(obj).__qualname__}.{getattr(obj, '__qualname__', '')}"
+        h.update(text.encode())
+
+def _configuration(obj) -> list[tuple[str, Any]]:
+    """The attributes of a callable object which define what it computes. A task (with initialize()) fills
+    attributes while running (histograms, entries, ...): only the ones named like a parameter of its (or a base
+    class') __init__ count, or the items of its get_config() if it has one. Other objects: all attributes."""
+    if hasattr(obj, "get_config"):
+        return sorted(obj.get_config().items())
+    attributes = vars(obj)
+    if not hasattr(obj, "initialize"):
+        return sorted(attributes.items())
+    names = set()
+    for cls in type(obj).__mro__:
+        init = cls.__dict__.get("__init__")
+        if isinstance(init, types.FunctionType):
+            code = init.__code__
+            names.update(code.co_varnames[1:code.co_argcount + code.co_kwonlyargcount])
+    return sorted((name, attributes[name]) for name in names if name in attributes)
@@ -0,0 +1,91 @@
+from typing import Any
+import os
+import json
+import time
+import pickle
+from .utils import atomic_write
+
+class Checkpoint:
+    """Periodic snapshot of a main_loop run: the states of the outDef objects (get_state()) and the files
+    processed (or skipped) so far. Written every `every` files and / or `every_seconds` seconds
+    (and at the end), always at a file boundary, so a resumed run neither loses nor double counts a file.
+    definition (set by main_loop) identifies the analysis; restoring a checkpoint of another one fails.
+    With retry_skipped, files skipped as unreadable (before any of their rows got processed) do not count
+    as processed, so a later run tries them again."""
+    VERSION = 2
+    def __init__(self, path: str, *, every: int | None = 100, every_seconds: float | None = None, 
+                 retry_skipped: bool = False):
+        self.path = path
+        self.every = every
+        self.every_seconds = every_seconds
+        self.retry_skipped = retry_skipped
+        self.definition: str | None = None
+        self.done: set[str] = set() # file_key() of the processed files
+        self.skipped: list[dict[str, Any]] = []
+        self.stopped = False # the saved run stopped early (all outDef objects were done)
+        self._outDef = None
+        self._since_save = 0
+        self._last_save = time.monotonic()
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+    def load(self) -> dict[str, Any]:
+        with open(self.path, "rb") as f:
+            content = pickle.load(f)
+        if content.get("version") != self.VERSION:
+            raise RuntimeError(f"Checkpoint {self.path} has version {content.get('version')}, expected {self.VERSION}")
+        return content
+    def matches(self) -> bool:
+        """Whether the saved checkpoint was written for the same definition"""
+        return self.definition is None or self.load()["definition"] == self.definition
+    def restore(self, outDef) -> bool:
+        """Merges the saved states into the (initialized) outDef objects and remembers the processed files.
+        Returns whether the saved run was complete."""
+        content = self.load()
+        if self.definition is not None and content["definition"] != self.definition:
+            raise RuntimeError(f"Checkpoint {self.path} was written for a different analysis definition")
+        tasks = [_task_type(fcn) for _, fcn in outDef]
+        if content["tasks"] != tasks:
+            raise RuntimeError(f"Checkpoint {self.path} was written for outDef {content['tasks']}, not {tasks}")
+        for (_, fcn), state in zip(outDef, content["states"]):
+            if state is not None:
+                fcn.merge_state(state)
+        self.done = set(content["done"])
+        self.skipped = content["skipped"]
+        self.stopped = content.get("stopped", False)
+        return content["complete"]
+    def start(self, outDef):
+        for _, fcn in outDef:
+            if hasattr(fcn, "initialize") and not (hasattr(fcn, "get_state") and hasattr(fcn, "merge_state")):
+                raise TypeError(f"{type(fcn).__name__} has no get_state()/merge_state(); cannot checkpoint it")
+        self._outDef = outDef
+        self._last_save = time.monotonic()
+    def pending(self, tier_filename_dict) -> list[dict[str, str]]:
+        """The files not processed yet"""
+        return [filename_tiers for filename_tiers in tier_filename_dict if file_key(filename_tiers) not in self.done]
+    def files_done(self, files: list[dict[str, str]], skipped: list[dict[str, Any]] = ()):
+        """Call after files (and everything before) went into the states of the outDef objects"""
+        retry = {file_key(skip["files"]) for skip in skipped if not skip["partial"]} if self.retry_skipped else set()
+        self.done.update(key for key in map(file_key, files) if key not in retry)
+        self.skipped.extend(skipped)
+        self._since_save += len(files)
+        if (self.every is not None and self._since_save >= self.every) or \
+                (self.every_seconds is not None and time.monotonic() - self._last_save >= self.every_seconds):
+            self.save()
+    def save(self, complete: bool = False, stopped: bool = False):
+        content = {"version": self.VERSION, "definition": self.definition, 
+                   "tasks": [_task_type(fcn) for _, fcn in self._outDef],
+                   "states": [fcn.get_state() if hasattr(fcn, "get_state") else None for _, fcn in self._outDef],
+                   "done": sorted(self.done), "skipped": self.skipped, "complete": complete,
+                   "stopped": stopped}
+        with atomic_write(self.path) as f:
+            pickle.dump(content, f)
+        self._since_save = 0
+        self._last_save = time.monotonic()
+
+def file_key(filename_tiers: dict[str, str]) -> str:
+    return json.dumps(filename_tiers, sort_keys=True)
+
+# PRIVATE
+
+def _task_type(fcn) -> str:
+    return f"{type(fcn).__module__}.{type(fcn).__qualname__}"
@@ -1,17 +1,34 @@
 
-from typing import Any
-from collections.abc import Collection, Callable
-from collections import defaultdict
+from typing import Any, NamedTuple
+from collections.abc import Collection, Callable, Iterable, Iterator, Sequence
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
 from inspect import signature
+import logging
+import numpy as np
 import awkward as ak
-from lgdo.lh5 import read_as
+from .utils import FileRef
+from .cache import ArrayCache, derived_key
+from .scheduler import ArrayGraph
+from .profiling import Profiler, stage
+from .checkpoint import Checkpoint
+from .lazy import ChunkStore, LazyArray
+from .reader import FilePool, SpecReader
+from .executor import Executor, ForkExecutor
+
+_logger = logging.getLogger(__name__)
 
 def main_loop(inputArraysDef:list[tuple[str, str]], 
               genArrayDef:list[tuple[list[str],str,Callable[[list[ak.Array]],ak.Array]]], 
               outDef:list[tuple[list[str],Any]], # Callable[[list[ak.Array],str],bool]|
               *, tier_filename_dict: Collection[dict[str,str]], 
               pre_reducer:tuple[list[str],Callable[[list[ak.Array]],ak.Array]]|None = None, 
-              crop:bool=False):
+              crop:bool=False, workers:int=1, prefetch:int=0, prefetch_max_bytes:int|None=None,
+              selective_read:bool=False, chunk_size:int|None=None, cache:ArrayCache|None=None,
+              gen_threads:int=1, profiler:Profiler|None=None, checkpoint:str|Checkpoint|None=None,
+              resume:bool=False, on_error:str|Callable[[dict[str,str],Exception],Any]="raise",
+              join_on:str|None=None, incremental:str|Checkpoint|None=None, executor:Executor|None=None):
     """
     Runs the main analysis loop, doing a single pass through the data, file-by-file.
     tier_filename_dict 
@@ -27,6 +44,8 @@ def main_loop(inputArraysDef:list[tuple[str, str]],
         output functions/objects. A list of tuples of (1): list of shortnames existing (loaded in inputArraysDef of 
         generated in genArrayDef) arrays and (2) a function taking the list of arrays. The function might return a bool:
         True -> task done; no need to loop any more and False -> need to go on (None is "don't care").
+        A function which returned True is not called any more, and the arrays only it needed are not read / generated
+        any more (with workers > 1: within the group of files of a worker).
         The function (then object) can define initialize / finalize functions, which get called before/after the loop.
     tier_filename_dict
         collection yielding dicts of the kind {"raw": <raw_filename>, "dsp": <dsp_filename>, "evt": evt_filename}
@@ -37,38 +56,112 @@ def main_loop(inputArraysDef:list[tuple[str, str]],
         before further processing
     crop
         make all input array the same number of rows by cropping to the shortest one. USE WITH CARE!
+        The row counts come from the file metadata, so only the rows kept are read.
+    workers
+        number of worker processes. If > 1, groups of files are processed in a (fork-based) process pool.
+        Each worker fills its own copies of the outDef objects; their states are collected with get_state()
+        and combined into the original objects with merge_state(), whose return value has the same meaning
+        as the one of the call. Objects defining initialize() have to implement get_state() / merge_state().
+    prefetch
+        number of files to read ahead in a background thread while the current file is processed (0: off)
+    prefetch_max_bytes
+        do not read further ahead while the prefetched (and not yet processed) arrays hold this many bytes.
+        At least the next file is always read ahead.
+    selective_read
+        only with pre_reducer: read the pre_reducer inputs first and all other input arrays only at the selected
+        entries. The arrays are then compacted instead of None-masked; the file passed to the outDef functions is
+        a FileRef, whose entries attribute maps the rows back to the file entries.
+    chunk_size
+        if given, every file is streamed in chunks of this many rows (all steps, including the outDef functions,
+        are then run per chunk), so the memory needed is set by the chunk size and not by the file size.
+    cache
+        ArrayCache to load the input and generated arrays from (or store them to), instead of 
+        reading / computing them again in every run.
+    gen_threads
+        if > 1, independent genArrayDef functions run concurrently in this many threads.
+    profiler
+        Profiler recording time, rows and bytes of every read, crop, pre_reducer, genArrayDef and outDef step
+        per file (see its report()), optionally printing a progress line.
+    checkpoint
+        path (or Checkpoint) to periodically save the states of the outDef objects and the processed files to.
+        Objects defining initialize() have to implement get_state() / merge_state() (as for workers > 1).
+    resume
+        with checkpoint: if it exists, restore the states from it and skip the files processed already.
+    on_error
+        what to do if a file cannot be read: "raise", "skip" (log a warning and go on with the next file) or a 
+        function called with the filename dict and the exception (then the file is skipped as well; 
+        with workers > 1 it runs in the worker process).
+        Errors of the genArrayDef / outDef functions are always raised.
+    incremental
+        path (or Checkpoint) of the results of earlier runs over (a part of) the same files, e.g. while a 
+        period keeps growing: the stored states are merged into the outDef objects, only the files not 
+        processed yet are read, and the updated states are stored again (as with checkpoint). Files are 
+        identified by their names; unreadable files are tried again in the next run. If the analysis definition 
+        changed (inputArraysDef, genArrayDef, outDef objects / functions or their code, pre_reducer, crop, 
+        selective_read, join_on), the stored results are discarded and all files get processed. If the stored 
+        run stopped early (all outDef objects done), the stored results are final: no file gets processed.
+        Not together with checkpoint.
+    executor
+        runs groups of files in the worker processes of an Executor, e.g. a SocketExecutor whose workers may 
+        run on several nodes; the analysis definition (inputArraysDef, genArrayDef, outDef, ...) is shipped 
+        to them, as for workers > 1 (which is short for ForkExecutor(workers)). The caller closes it.
+    join_on
+        shortname of an input array holding, for every row of its tier (e.g. evt), the entry of that row in the 
+        files of the other tiers (e.g. raw / dsp): the arrays of the other tiers are read at these entries, so all 
+        rows belong to the same event (instead of aligning the tiers by cropping). The file passed to the outDef 
+        functions is then a FileRef whose entries are these entries. Not together with crop or selective_read.
+
+    Only the input arrays and genArrayDef entries needed by outDef (or pre_reducer) are read / computed, 
+    and every array is dropped as soon as its last user has run.
     """
-    def read_spec(spec: str, filename_tiers: dict[str, str]):
-        spec_split = spec.strip("/").split("/")
-        try:
-            if (tier := spec_split[0]) in filename_tiers.keys():
-                return read_as(spec, filename_tiers[tier], "ak")
-            if (tier := spec_split[1]) in filename_tiers.keys():
-                return read_as(spec, filename_tiers[tier], "ak")
-        except KeyError as e:
-            raise KeyError(f"Cannot find {spec} in file.") from e
-        raise RuntimeError(f"Cannot identify tier name in spec {spec}")
-    
+    if on_error not in ("raise", "skip") and not callable(on_error):
+        raise ValueError(f"Unknown on_error {on_error}")
+    _check_join(inputArraysDef, join_on, crop, selective_read and pre_reducer is not None)
+    if incremental is not None:
+        if checkpoint is not None:
+            raise ValueError("checkpoint and incremental exclude each other")
+        checkpoint = incremental if isinstance(incremental, Checkpoint) else Checkpoint(incremental, retry_skipped=True)
+        resume = True
+    if isinstance(checkpoint, str):
+        checkpoint = Checkpoint(checkpoint)
+    if checkpoint is not None: # before initialize(): the configuration of the objects, not their results
+        checkpoint.definition = _definition_key(inputArraysDef, genArrayDef, outDef, pre_reducer, crop, 
+                                                selective_read, join_on)
     for _, fcn in outDef:
         if hasattr(fcn, "initialize"):
             fcn.initialize()
-    for filename_tiers in tier_filename_dict:
-        arrays = {}
-        for short, spec in inputArraysDef:
-            arrays[short] = read_spec(spec, filename_tiers) # read_as(spec, evt, "ak")
-        if crop:
-            _do_crop(arrays)
-        if pre_reducer is not None:
-            mask = pre_reducer[1](_compile_input_arrays(pre_reducer[0], arrays))
-            for key in arrays.keys():
-                arrays[key] = ak.mask(arrays[key], mask)
-        for inputs, output, fcn in genArrayDef:
-            arrays[output] = fcn(_compile_input_arrays(inputs, arrays))
-        flags = []  # output flags of functions. True -> I'm done now, False -> I'm not done yet, None -> I don't care
-        for inputs, fcn in outDef:
-            flags.append(fcn(_compile_input_arrays(inputs, arrays), filename_tiers["raw"]))
-        if any(flag == True for flag in flags) and all(flag != False for flag in flags):
-            break
+    loop_def = _LoopDef(inputArraysDef, genArrayDef, outDef, pre_reducer, crop, prefetch, prefetch_max_bytes, 
+                        selective_read, chunk_size, cache, gen_threads, profiler=profiler, on_error=on_error, 
+                        join_on=join_on)
+    complete = False
+    if checkpoint is not None:
+        checkpoint.start(outDef)
+        if incremental is not None and checkpoint.exists() and not checkpoint.matches():
+            _logger.warning(f"Analysis definition changed since {checkpoint.path} was written; processing all files")
+        elif resume and checkpoint.exists():
+            complete = checkpoint.restore(outDef)
+            if incremental is not None: # new files might be there, unless the saved run stopped early
+                complete = complete and checkpoint.stopped
+            tier_filename_dict = checkpoint.pending(tier_filename_dict)
+    _validate_specs(loop_def, tier_filename_dict)
+    if profiler is not None:
+        profiler.start(len(tier_filename_dict) if hasattr(tier_filename_dict, "__len__") else None)
+    flags = []
+    try:
+        if complete:
+            pass # everything is in the restored states
+        elif executor is not None:
+            flags = _parallel_loop(loop_def, tier_filename_dict, executor, checkpoint)
+        elif workers > 1:
+            flags = _parallel_loop(loop_def, tier_filename_dict, ForkExecutor(workers), checkpoint)
+        else:
+            flags = _serial_loop(loop_def, tier_filename_dict, checkpoint)
+    finally:
+        loop_def.reader.close()
+        if profiler is not None:
+            profiler.finish()
+    if checkpoint is not None:
+        checkpoint.save(complete=True, stopped=(complete and checkpoint.stopped) or _loop_done(flags))
     for _, fcn in outDef:
         if hasattr(fcn, "finalize"):
             fcn.finalize()
@@ -78,12 +171,17 @@ def compile_arrays(inputArraysDef: list[tuple[str, str]],
                     *,
                     tier_filename_dict: Collection[dict[str, str]],
                     pre_reducer: tuple[list[str], Callable[[list[ak.Array]], ak.Array]] | None = None,
-                    crop: bool = False) -> dict[str, ak.Array]:
+                    crop: bool = False, selective_read: bool = False, 
+                    chunk_size: int | None = None, cache: ArrayCache | None = None, 
+                    gen_threads: int = 1, lazy: bool = False, 
+                    lazy_cache_bytes: int = 1 << 30, join_on: str | None = None, 
+                    executor: Executor | None = None) -> dict[str, ak.Array] | dict[str, LazyArray]:
     """
     Pulls all LH5 objects from inputArraysDef, does calculations on them as defined in genArrayDef
     and stores all output arrays in a dictionary, which is returned.
 
     Similar to main_loop(), but not memory-efficient and does not do the final jobs.
+    For a memory-efficient version, see iter_compiled_arrays().
 
     Parameters
     ----------
@@ -101,23 +199,66 @@ def compile_arrays(inputArraysDef: list[tuple[str, str]],
         before further processing
     crop
         make all input array the same number of rows by cropping to the shortest one. USE WITH CARE!
+    selective_read, cache, gen_threads, join_on
+        see main_loop()
+    chunk_size
+        if given (or with selective_read, cache or gen_threads), the arrays are compiled chunk-by-chunk (or file-by-file) with 
+        iter_compiled_arrays() and concatenated. Then crop acts per file, not on the concatenated arrays.
+    lazy
+        return LazyArrays instead: nothing is read up front (except the row counts); every access reads and 
+        generates only the chunks (of chunk_size rows, default 100000) holding the accessed rows, and only 
+        for the accessed array. The genArrayDef functions and the pre_reducer (masking, as usual) then run 
+        per chunk, so they have to work row by row. Not together with selective_read.
+    lazy_cache_bytes
+        memory for the LRU cache of read / generated chunks (shared by all arrays)
+    executor
+        compile the arrays of groups of files in the worker processes of an Executor (see main_loop()); 
+        they are concatenated in file order (crop then acts per file, as with chunk_size). Not together with lazy.
     """
-    def read_spec(spec: str, filenames_tiers: dict[str, list[str]]):
+    _check_join(inputArraysDef, join_on, crop, selective_read and pre_reducer is not None)
+    if executor is not None:
+        if lazy:
+            raise ValueError("lazy arrays cannot be compiled by an executor")
+        loop_def = _LoopDef(inputArraysDef, genArrayDef, [], pre_reducer, crop, selective_read=selective_read, 
+                            chunk_size=chunk_size, cache=cache, gen_threads=gen_threads, prune=False, join_on=join_on)
+        groups = _split_groups(list(tier_filename_dict), 4 * executor.workers)
+        return _concatenate_chunks([chunk for chunk in executor.map(_compile_group, loop_def, groups) if chunk])
+    if lazy:
+        return _lazy_arrays(inputArraysDef, genArrayDef, tier_filename_dict, pre_reducer, crop, selective_read,
+                            chunk_size or 100000, cache, lazy_cache_bytes, join_on)
+    if chunk_size is not None or (selective_read and pre_reducer is not None) or cache is not None or gen_threads > 1 \
+            or join_on is not None:
+        chunks = list(iter_compiled_arrays(inputArraysDef, genArrayDef, tier_filename_dict=tier_filename_dict,
+                                           pre_reducer=pre_reducer, crop=crop, selective_read=selective_read,
+                                           chunk_size=chunk_size, cache=cache, gen_threads=gen_threads, 
+                                           join_on=join_on))
+        return _concatenate_chunks(chunks)
+    from lgdo.lh5 import read_as # slow to import: only when reading
+    def read_spec(spec: str, filenames_tiers: dict[str, list[str]], **kwargs):
         spec_split = spec.strip("/").split("/")
         if (tier := spec_split[0]) in filenames_tiers.keys():
-            return read_as(spec, filenames_tiers[tier], "ak")
+            return read_as(spec, filenames_tiers[tier], "ak", **kwargs)
         if (tier := spec_split[1]) in filenames_tiers.keys():
-            return read_as(spec, filenames_tiers[tier], "ak")
+            return read_as(spec, filenames_tiers[tier], "ak", **kwargs)
         raise RuntimeError(f"Cannot identify tier name in spec {spec}")
     filenames_tiers = defaultdict(list)
     for filename_tiers in tier_filename_dict:
         for tier, filename in filename_tiers.items():
             filenames_tiers[tier].append(filename)
+    read_kwargs = {}
+    if crop: # read only the rows of the shortest array (summed over the files)
+        reader = SpecReader(inputArraysDef)
+        try:
+            nr_rows = {short: sum(reader.n_rows(short, filename_tiers) for filename_tiers in tier_filename_dict)
+                       for short, _ in inputArraysDef}
+        finally:
+            reader.close()
+        min_length = min(nr_rows.values(), default=0)
+        _crop_warnings(nr_rows, min_length)
+        read_kwargs = {"n_rows": min_length}
     arrays = {}
     for short, spec in inputArraysDef:
-        arrays[short] = read_spec(spec, filenames_tiers) # read_as(spec, evt, "ak")
-    if crop:
-        _do_crop(arrays)
+        arrays[short] = read_spec(spec, filenames_tiers, **read_kwargs) # read_as(spec, evt, "ak")
     if pre_reducer is not None:
         mask = pre_reducer[1](_compile_input_arrays(pre_reducer[0], arrays))
         for key in arrays.keys():
@@ -126,6 +267,58 @@ def compile_arrays(inputArraysDef: list[tuple[str, str]],
         arrays[output] = fcn(_compile_input_arrays(inputs, arrays))
     return arrays
 
+def _lazy_arrays(inputArraysDef, genArrayDef, tier_filename_dict, pre_reducer, crop, selective_read, 
+                 chunk_size, cache, cache_bytes, join_on) -> dict[str, LazyArray]:
+    if selective_read and pre_reducer is not None:
+        raise ValueError("lazy arrays need all rows; selective_read is not possible")
+    files = list(tier_filename_dict)
+    file_pool = FilePool() # shared by the loop definitions of all arrays
+    reader = SpecReader(inputArraysDef, file_pool)
+    nr_rows = [{spec: reader.n_rows(short, filename_tiers) for short, spec in inputArraysDef} 
+               for filename_tiers in files]
+    store = ChunkStore(cache_bytes)
+    arrays = {}
+    for short in [short for short, _ in inputArraysDef] + [output for _, output, _ in genArrayDef]:
+        # a loop definition "consuming" only this array: reads / generates nothing else
+        loop_def = _LoopDef(inputArraysDef, genArrayDef, [([short], None)], pre_reducer, crop, 
+                            chunk_size=chunk_size, cache=cache, file_pool=file_pool, join_on=join_on)
+        if join_on is not None: # the rows of the join_on tier
+            specs = [dict(inputArraysDef)[join_on]]
+        else:
+            specs = [spec for _, spec in (inputArraysDef if crop else loop_def.graph.inputArraysDef)]
+        file_lengths = [(min if crop else max)(file_nr_rows[spec] for spec in specs) for file_nr_rows in nr_rows]
+        def compute(file_index: int, start: int, stop: int, loop_def=loop_def, short=short) -> ak.Array:
+            file_arrays = _read_file_arrays(loop_def, files[file_index], _Rows(start, stop, nr_rows[file_index]))
+            _reduce_and_generate(loop_def, file_arrays)
+            return file_arrays.arrays[short]
+        arrays[short] = LazyArray(short, file_lengths, chunk_size, compute, store)
+    return arrays
+
+def iter_compiled_arrays(inputArraysDef: list[tuple[str, str]], 
+                         genArrayDef: list[tuple[list[str], str, Callable[[list[ak.Array]], ak.Array]]], 
+                         *,
+                         tier_filename_dict: Collection[dict[str, str]],
+                         pre_reducer: tuple[list[str], Callable[[list[ak.Array]], ak.Array]] | None = None,
+                         crop: bool = False, selective_read: bool = False, 
+                         chunk_size: int | None = None, cache: ArrayCache | None = None,
+                         gen_threads: int = 1, join_on: str | None = None) -> Iterator[dict[str, ak.Array]]:
+    """
+    Streaming version of compile_arrays(): yields the dictionary of all (input and generated) arrays 
+    for every file, or for every chunk of chunk_size rows if given. Parameters as in main_loop().
+    """
+    _check_join(inputArraysDef, join_on, crop, selective_read and pre_reducer is not None)
+    loop_def = _LoopDef(inputArraysDef, genArrayDef, [], pre_reducer, crop, selective_read=selective_read, 
+                        chunk_size=chunk_size, cache=cache, gen_threads=gen_threads, prune=False, join_on=join_on)
+    _validate_specs(loop_def, tier_filename_dict)
+    file_arrays = _iter_file_arrays(loop_def, tier_filename_dict)
+    try:
+        for one_file_arrays in file_arrays:
+            _reduce_and_generate(loop_def, one_file_arrays)
+            yield one_file_arrays.arrays
+    finally:
+        file_arrays.close()
+        loop_def.reader.close()
+
 def oneshot(arrays:list[ak.Array], fcn:Any) -> Any:
     """
     Runs a function on the given arrays, which are expected to be in a dictionary with short names as keys.
@@ -158,14 +351,481 @@ def oneshot(arrays:list[ak.Array], fcn:Any) -> Any:
 
 # PRIVATE
 
+def _definition_key(inputArraysDef, genArrayDef, outDef, pre_reducer, crop, selective_read, join_on) -> str:
+    """Hash of everything the results of main_loop depend on (besides the files)"""
+    parts = [crop, selective_read, join_on, *inputArraysDef]
+    for inputs, output, fcn in genArrayDef:
+        parts += [inputs, output, fcn]
+    for inputs, fcn in outDef:
+        parts += [inputs, fcn]
+    if pre_reducer is not None:
+        parts += [pre_reducer[0], pre_reducer[1]]
+    return derived_key("definition", *parts)
+
+def _validate_specs(loop_def: "_LoopDef", tier_filename_dict):
+    """Fails early (before any reading) if a needed spec names none of the tiers of the first file"""
+    if isinstance(tier_filename_dict, Sequence) and len(tier_filename_dict) > 0:
+        loop_def.reader.validate(tier_filename_dict[0].keys(), [short for short, _ in loop_def.graph.inputArraysDef])
+
+@dataclass
+class _LoopDef:
+    """Everything main_loop needs to process a file (handed as a whole to workers)"""
+    inputArraysDef: list[tuple[str, str]]
+    genArrayDef: list[tuple[list[str], str, Callable[[list[ak.Array]], ak.Array]]]
+    outDef: list[tuple[list[str], Any]]
+    pre_reducer: tuple[list[str], Callable[[list[ak.Array]], ak.Array]] | None = None
+    crop: bool = False
+    prefetch: int = 0
+    prefetch_max_bytes: int | None = None
+    selective_read: bool = False
+    chunk_size: int | None = None
+    cache: ArrayCache | None = None
+    gen_threads: int = 1
+    prune: bool = True # read / generate only what the outDef functions need
+    profiler: Profiler | None = None
+    on_error: Any = "raise"
+    skipped: list[dict[str, Any]] = field(default_factory=list) # the files skipped because of on_error
+    finished: set[int] = field(default_factory=set) # outDef functions which returned True
+    file_pool: FilePool | None = None # open files, shared with other loop definitions
+    join_on: str | None = None
+    graph: ArrayGraph = field(init=False)
+    reader: SpecReader = field(init=False)
+    def __post_init__(self):
+        self.reader = SpecReader(self.inputArraysDef, self.file_pool)
+        self._build_graph()
+        self.crop_inputs = list(self.graph.inputArraysDef) # the crop length stays the one of all needed arrays
+    def _build_graph(self):
+        consumers = [[] if i in self.finished else inputs for i, (inputs, _) in enumerate(self.outDef)]
+        reducer_inputs = list(self.pre_reducer[0]) if self.pre_reducer is not None else []
+        if self.join_on is not None: # always needed for reading the other tiers
+            reducer_inputs.append(self.join_on)
+        self.graph = ArrayGraph(self.inputArraysDef, self.genArrayDef, consumers if self.prune else None, reducer_inputs)
+    def finish(self, indices: Iterable[int]):
+        """The outDef functions at indices are done: prune what only they needed"""
+        self.finished.update(indices)
+        self._build_graph()
+    def restart(self):
+        if self.finished:
+            self.finished.clear()
+            self._build_graph()
+    @property
+    def two_phase(self) -> bool:
+        return self.selective_read and self.pre_reducer is not None
+    def __getstate__(self):
+        """For shipping to the workers of an executor: the definition only (no open files, profile or progress);
+        of the profiler only its hooks"""
+        state = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
+        state.update(profiler=self.profiler.hooks if self.profiler is not None else None, file_pool=None, 
+                     skipped=[], finished=set())
+        return state
+    def __setstate__(self, state: dict[str, Any]):
+        state["profiler"] = Profiler(hooks=state["profiler"]) if state["profiler"] is not None else None
+        self.__init__(**state)
+
+@dataclass
+class _FileArrays:
+    """The arrays of a file (or chunk), the file entries of their rows (None: all rows) 
+    and their cache keys (only with a cache)"""
+    filename_tiers: dict[str, str]
+    arrays: dict[str, ak.Array] = field(default_factory=dict)
+    entries: np.ndarray | None = None
+    keys: dict[str, str] = field(default_factory=dict)
+    @property
+    def name(self) -> str:
+        """Name of the file in the profiler report"""
+        return self.filename_tiers.get("raw") or next(iter(self.filename_tiers.values()))
+    def read(self, loop_def: _LoopDef, shorts: list[str], kwargs: dict[str, dict[str, Any]] | None = None):
+        """Reads the input arrays shorts (kwargs: read arguments per short); fields of the same table 
+        in one go, cached ones from the cache"""
+        kwargs = kwargs or {}
+        reader = loop_def.reader
+        if loop_def.cache is not None:
+            for short in shorts:
+                self.keys[short] = loop_def.cache.input_key(reader.refs[short].spec, 
+                                                            reader.filename(short, self.filename_tiers), 
+                                                            **kwargs.get(short, {}))
+            hits = {short: loop_def.cache.get(self.keys[short]) for short in shorts}
+            for short, array in hits.items():
+                if array is not None:
+                    self.arrays[short] = array
+            shorts = [short for short in shorts if hits[short] is None]
+        for batch in reader.plan(shorts, self.filename_tiers, kwargs):
+            with stage(loop_def.profiler, f"read:{batch.name}", self.name, self.arrays) as s:
+                arrays = reader.read_batch(batch)
+                for short, array in arrays.items():
+                    if loop_def.cache is not None:
+                        loop_def.cache.put(self.keys[short], array)
+                    self.arrays[short] = array
+                s.count(*arrays.values())
+    def transform_all(self, what: str, fcn, *key_parts):
+        """Replaces all arrays by fcn(array); key_parts describe the transformation for the cache keys"""
+        for short in self.arrays.keys():
+            self.arrays[short] = fcn(self.arrays[short])
+            if short in self.keys:
+                self.keys[short] = derived_key(what, self.keys[short], *key_parts)
+    def release(self, shorts: list[str]):
+        for short in shorts:
+            self.arrays.pop(short, None)
+            self.keys.pop(short, None)
+    def generate(self, loop_def: _LoopDef, inputs: list[str], output: str, fcn):
+        with stage(loop_def.profiler, f"gen:{output}", self.name, self.arrays) as s:
+            if loop_def.cache is None:
+                self.arrays[output] = fcn(_compile_input_arrays(inputs, self.arrays))
+            else:
+                self.keys[output] = derived_key("gen", fcn, *_compile_input_arrays(inputs, self.keys))
+                self.arrays[output] = loop_def.cache.get_or_compute(self.keys[output], 
+                                                                    lambda: fcn(_compile_input_arrays(inputs, self.arrays)))
+            s.count(self.arrays[output])
+
+class _Rows(NamedTuple):
+    """Row range [start, stop) of a file to read; nr_rows holds the rows of every spec in the file"""
+    start: int
+    stop: int
+    nr_rows: dict[str, int]
+    def read_kwargs(self, spec: str) -> dict[str, int]:
+        start = min(self.start, self.nr_rows[spec]) # arrays might be shorter (no crop)
+        return {"start_row": start, "n_rows": max(0, min(self.stop, self.nr_rows[spec]) - start)}
+
+def _iter_read_ranges(loop_def: _LoopDef, tier_filename_dict: Iterable[dict[str, str]]):
+    """Yields (filename_tiers, rows) of the units to read, rows being a _Rows range or None (whole file)"""
+    for filename_tiers in tier_filename_dict:
+        if loop_def.chunk_size is None:
+            yield filename_tiers, None
+            continue
+        try:
+            shorts = _row_shorts(loop_def, filename_tiers)
+            nr_rows = {spec: loop_def.reader.n_rows(short, filename_tiers) for short, spec in shorts}
+            total = _crop_length(loop_def, filename_tiers) if loop_def.crop else max(nr_rows.values())
+        except Exception as e:
+            _handle_read_error(loop_def, filename_tiers, None, e)
+            continue
+        for start in range(0, total, loop_def.chunk_size):
+            yield filename_tiers, _Rows(start, min(start + loop_def.chunk_size, total), nr_rows)
+
+def _read_file_arrays(loop_def: _LoopDef, filename_tiers: dict[str, str], rows: _Rows | None = None) -> _FileArrays:
+    """Reads the input arrays of a file (or of its rows range)"""
+    whole_file = rows is None
+    if loop_def.crop and whole_file: # read only the rows all arrays have
+        nr_rows = {spec: loop_def.reader.n_rows(short, filename_tiers) for short, spec in loop_def.graph.inputArraysDef}
+        rows = _Rows(0, _crop_length(loop_def, filename_tiers), nr_rows)
+    if loop_def.two_phase:
+        return _read_file_arrays_two_phase(loop_def, filename_tiers, rows)
+    if loop_def.join_on is not None:
+        return _read_file_arrays_joined(loop_def, filename_tiers, rows)
+    file_arrays = _FileArrays(filename_tiers)
+    file_arrays.read(loop_def, [short for short, _ in loop_def.graph.inputArraysDef], 
+                     None if rows is None else {short: rows.read_kwargs(spec) for short, spec in loop_def.graph.inputArraysDef})
+    if not whole_file:
+        file_arrays.entries = np.arange(rows.start, rows.start + max(map(len, file_arrays.arrays.values()), default=0))
+    return file_arrays
+
+def _read_file_arrays_two_phase(loop_def: _LoopDef, filename_tiers: dict[str, str], rows: _Rows | None) -> _FileArrays:
+    """Reads only the pre_reducer inputs in full, the other arrays only at the selected entries.
+    All arrays come out compacted (not None-masked)."""
+    reducer_inputs, reducer_fcn = loop_def.pre_reducer
+    specs = dict(loop_def.graph.inputArraysDef)
+    file_arrays = _FileArrays(filename_tiers)
+    file_arrays.read(loop_def, list(reducer_inputs), 
+                     None if rows is None else {short: rows.read_kwargs(specs[short]) for short in reducer_inputs})
+    with stage(loop_def.profiler, "pre_reducer", file_arrays.name, file_arrays.arrays) as s:
+        mask = reducer_fcn(_compile_input_arrays(reducer_inputs, file_arrays.arrays))
+        selected = np.flatnonzero(ak.to_numpy(ak.fill_none(mask, False)))
+        file_arrays.transform_all("take", lambda array: array[selected], selected)
+        s.count(mask)
+    file_arrays.entries = selected if rows is None else selected + rows.start
+    others = [short for short in specs if short not in file_arrays.arrays]
+    file_arrays.read(loop_def, others, {short: {"idx": file_arrays.entries} for short in others})
+    return file_arrays
+
+def _read_file_arrays_joined(loop_def: _LoopDef, filename_tiers: dict[str, str], rows: _Rows | None) -> _FileArrays:
+    """Reads the arrays of the tier of join_on (of the rows range), the arrays of the other tiers 
+    at the entries held by join_on"""
+    reader = loop_def.reader
+    join_tier = reader.tier(loop_def.join_on, filename_tiers)
+    specs = dict(loop_def.graph.inputArraysDef)
+    own = [short for short in specs if reader.tier(short, filename_tiers) == join_tier]
+    others = [short for short in specs if short not in own]
+    file_arrays = _FileArrays(filename_tiers)
+    file_arrays.read(loop_def, own, None if rows is None else {short: rows.read_kwargs(specs[short]) for short in own})
+    index = _join_index(file_arrays.arrays[loop_def.join_on], loop_def.join_on)
+    entries, inverse = np.unique(index, return_inverse=True) # lh5 reads need strictly increasing entries
+    file_arrays.read(loop_def, others, {short: {"idx": entries} for short in others})
+    for short in others:
+        file_arrays.arrays[short] = file_arrays.arrays[short][inverse]
+        if short in file_arrays.keys:
+            file_arrays.keys[short] = derived_key("take", file_arrays.keys[short], inverse)
+    if join_tier != "raw":
+        file_arrays.entries = index
+    elif rows is not None:
+        file_arrays.entries = np.arange(rows.start, rows.start + len(index))
+    return file_arrays
+
+def _join_index(array: ak.Array, name: str) -> np.ndarray:
+    if array.ndim != 1:
+        raise ValueError(f"join_on array {name} has to be 1-dim")
+    index = ak.to_numpy(array).astype(np.int64)
+    if len(index) > 0 and index.min() < 0:
+        raise ValueError(f"join_on array {name} has negative entries (rows without a partner?)")
+    return index
+
+def _check_join(inputArraysDef, join_on: str | None, crop: bool, two_phase: bool):
+    if join_on is None:
+        return
+    if join_on not in dict(inputArraysDef):
+        raise ValueError(f"join_on {join_on} is not in inputArraysDef")
+    if crop or two_phase:
+        raise ValueError("join_on is not possible together with crop or selective_read")
+
+def _row_shorts(loop_def: _LoopDef, filename_tiers: dict[str, str]) -> list[tuple[str, str]]:
+    """The input arrays whose rows are iterated (with join_on: the ones of its tier)"""
+    if loop_def.join_on is None:
+        return loop_def.graph.inputArraysDef
+    join_tier = loop_def.reader.tier(loop_def.join_on, filename_tiers)
+    return [(short, spec) for short, spec in loop_def.graph.inputArraysDef 
+            if loop_def.reader.tier(short, filename_tiers) == join_tier]
+
+def _crop_length(loop_def: _LoopDef, filename_tiers: dict[str, str]) -> int:
+    """Rows of the shortest input array of a file (from the metadata, nothing is read)"""
+    nr_rows = {short: loop_def.reader.n_rows(short, filename_tiers) for short, _ in loop_def.crop_inputs}
+    min_length = min(nr_rows.values(), default=0)
+    _crop_warnings(nr_rows, min_length)
+    return min_length
+
+def _crop_warnings(nr_rows: dict[str, int], min_length: int):
+    for short, length in nr_rows.items():
+        if length > min_length:
+            print(f"Warning: cropping {short} from {length} to {min_length}")
+
+def _handle_read_error(loop_def: _LoopDef, filename_tiers: dict[str, str], rows: _Rows | None, error: Exception):
+    """Raises, or records the file as skipped (with on_error)"""
+    if loop_def.on_error == "raise":
+        raise error
+    partial = rows is not None and rows.start > 0 # earlier chunks got processed already
+    loop_def.skipped.append({"files": filename_tiers, "error": repr(error), "partial": partial})
+    if callable(loop_def.on_error):
+        loop_def.on_error(filename_tiers, error)
+    else:
+        _logger.warning(f"Skipping {filename_tiers}{' (partially processed)' if partial else ''}: {error!r}")
+
+def _iter_file_arrays(loop_def: _LoopDef, tier_filename_dict: Iterable[dict[str, str]]) -> Iterator[_FileArrays]:
+    """Yields the read arrays for every file (or chunk), leaving out unreadable files with on_error.
+    With prefetch > 0, the next ones are read in a background thread while the current one gets processed."""
+    failed = [] # files skipped after an error; their remaining chunks are left out, too
+    def unit_ok(filename_tiers, rows, read) -> _FileArrays | None:
+        if any(filename_tiers is other for other in failed):
+            return None
+        try:
+            return read()
+        except Exception as e:
+            _handle_read_error(loop_def, filename_tiers, rows, e)
+            failed.append(filename_tiers)
+            return None
+    read_ranges = _iter_read_ranges(loop_def, tier_filename_dict)
+    if loop_def.prefetch <= 0:
+        for filename_tiers, rows in read_ranges:
+            file_arrays = unit_ok(filename_tiers, rows, lambda: _read_file_arrays(loop_def, filename_tiers, rows))
+            if file_arrays is not None:
+                yield file_arrays
+        return
+    pending = deque() # futures of files read ahead
+    def fill():
+        while len(pending) <= loop_def.prefetch: # the current file + prefetch files ahead
+            if pending and loop_def.prefetch_max_bytes is not None and \
+                    _prefetched_bytes(pending) >= loop_def.prefetch_max_bytes:
+                return
+            filename_tiers, rows = next(read_ranges, (None, None))
+            if filename_tiers is None:
+                return
+            pending.append((filename_tiers, rows, pool.submit(_read_file_arrays, loop_def, filename_tiers, rows)))
+    # HDF5 reads are serialized anyway, so a single reader thread is enough
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        try:
+            fill()
+            while pending:
+                filename_tiers, rows, future = pending.popleft()
+                file_arrays = unit_ok(filename_tiers, rows, future.result)
+                fill()
+                if file_arrays is not None:
+                    yield file_arrays
+        finally: # loop stopped early: do not read the rest
+            for _, _, future in pending:
+                future.cancel()
+
+def _prefetched_bytes(pending) -> int:
+    """Memory held by the finished reads (a running read is not accounted for)"""
+    return sum(sum(array.nbytes for array in future.result().arrays.values()) 
+               for _, _, future in pending if future.done() and future.exception() is None)
+
+def _reduce_and_generate(loop_def: _LoopDef, file_arrays: _FileArrays):
+    arrays = file_arrays.arrays
+    if loop_def.crop and not loop_def.two_phase:
+        with stage(loop_def.profiler, "crop", file_arrays.name, arrays) as s:
+            min_length = _do_crop(arrays)
+            file_arrays.transform_all("crop", lambda array: array, min_length)
+            s.count(*arrays.values())
+    if loop_def.pre_reducer is not None and not loop_def.two_phase:
+        with stage(loop_def.profiler, "pre_reducer", file_arrays.name, arrays) as s:
+            mask = loop_def.pre_reducer[1](_compile_input_arrays(loop_def.pre_reducer[0], arrays))
+            reducer_key = derived_key("reducer", loop_def.pre_reducer[1], 
+                                      *_compile_input_arrays(loop_def.pre_reducer[0], file_arrays.keys)) \
+                          if loop_def.cache is not None else None
+            file_arrays.transform_all("mask", lambda array: ak.mask(array, mask), reducer_key)
+            s.count(mask)
+    graph = loop_def.graph
+    file_arrays.release(graph.release_after_reducer)
+    if loop_def.gen_threads > 1 and graph.parallelizable:
+        with ThreadPoolExecutor(max_workers=loop_def.gen_threads) as pool:
+            for level, gen_indices in enumerate(graph.levels):
+                futures = [pool.submit(file_arrays.generate, loop_def, *graph.genArrayDef[i]) for i in gen_indices]
+                for future in futures:
+                    future.result()
+                file_arrays.release(graph.release_after_level(level))
+    else:
+        for (inputs, output, fcn), release in zip(graph.genArrayDef, graph.release_after_gen):
+            file_arrays.generate(loop_def, inputs, output, fcn)
+            file_arrays.release(release)
+
+def _process_arrays(loop_def: _LoopDef, file_arrays: _FileArrays) -> list:
+    """Reduces and generates all arrays of one file (or chunk) and feeds them to the outDef functions.
+    Returns the flags of the outDef functions."""
+    rows = max(map(len, file_arrays.arrays.values()), default=0)
+    _reduce_and_generate(loop_def, file_arrays)
+    flags = []  # output flags of functions. True -> I'm done now, False -> I'm not done yet, None -> I don't care
+    raw = FileRef(file_arrays.filename_tiers["raw"], file_arrays.entries)
+    for i, ((inputs, fcn), release) in enumerate(zip(loop_def.outDef, loop_def.graph.release_after_consumer)):
+        if i in loop_def.finished:
+            flags.append(True)
+            continue
+        with stage(loop_def.profiler, f"out[{i}]:{_task_name(fcn)}", file_arrays.name, file_arrays.arrays) as s:
+            ins = _compile_input_arrays(inputs, file_arrays.arrays)
+            flags.append(fcn(ins, raw))
+            s.count(*ins)
+        file_arrays.release(release)
+    if loop_def.profiler is not None:
+        loop_def.profiler.unit_done(file_arrays.name, rows)
+    newly_finished = [i for i, flag in enumerate(flags) if flag == True and i not in loop_def.finished]
+    if newly_finished and loop_def.prune:
+        loop_def.finish(newly_finished)
+    return flags
+
+def _task_name(fcn) -> str:
+    return getattr(fcn, "name", None) or getattr(fcn, "__name__", None) or type(fcn).__name__
+
+def _loop_done(flags) -> bool:
+    return any(flag == True for flag in flags) and all(flag != False for flag in flags)
+
+def _serial_loop(loop_def: _LoopDef, tier_filename_dict: Iterable[dict[str, str]],
+                 checkpoint: Checkpoint | None = None) -> list:
+    flags = []
+    if checkpoint is not None: # need to know which files got through (also the skipped ones)
+        tier_filename_dict = list(tier_filename_dict)
+        done_until = 0 # the files before are processed completely
+    file_arrays = _iter_file_arrays(loop_def, tier_filename_dict)
+    try:
+        for one_file_arrays in file_arrays:
+            if checkpoint is not None:
+                position = next(i for i in range(done_until, len(tier_filename_dict)) 
+                                if tier_filename_dict[i] is one_file_arrays.filename_tiers)
+                if position > done_until: # first unit of a new file
+                    _files_done(loop_def, checkpoint, tier_filename_dict[done_until:position])
+                    done_until = position
+            flags = _process_arrays(loop_def, one_file_arrays)
+            if _loop_done(flags):
+                if checkpoint is not None: # the results are final with this file: never process it again
+                    _files_done(loop_def, checkpoint, tier_filename_dict[done_until:position + 1])
+                break
+        else:
+            if checkpoint is not None:
+                _files_done(loop_def, checkpoint, tier_filename_dict[done_until:])
+    finally:
+        file_arrays.close()
+    return flags
+
+def _files_done(loop_def: _LoopDef, checkpoint: Checkpoint, files: list[dict[str, str]]):
+    checkpoint.files_done(files, loop_def.skipped)
+    loop_def.skipped.clear()
+
+def _run_group(loop_def: _LoopDef, file_group: list[dict[str, str]]):
+    """Runs in the worker processes of an executor"""
+    for _, fcn in loop_def.outDef:
+        if hasattr(fcn, "initialize"):
+            fcn.initialize()
+    if loop_def.profiler is not None: # the parent prints the progress
+        loop_def.profiler.reset()
+        loop_def.profiler.progress = False
+    loop_def.skipped.clear()
+    loop_def.restart() # the functions are fresh again
+    flags = _serial_loop(loop_def, file_group)
+    states = [fcn.get_state() if hasattr(fcn, "get_state") else None for _, fcn in loop_def.outDef]
+    profile = loop_def.profiler.get_state() if loop_def.profiler is not None else None
+    return states, flags, profile, loop_def.skipped
+
+def _compile_group(loop_def: _LoopDef, file_group: list[dict[str, str]]) -> dict[str, ak.Array]:
+    """compile_arrays() of a group of files; runs in the worker processes of an executor"""
+    chunks = []
+    file_arrays = _iter_file_arrays(loop_def, file_group)
+    try:
+        for one_file_arrays in file_arrays:
+            _reduce_and_generate(loop_def, one_file_arrays)
+            chunks.append(one_file_arrays.arrays)
+    finally:
+        file_arrays.close()
+        loop_def.reader.close()
+    return _concatenate_chunks(chunks)
+
+def _concatenate_chunks(chunks: list[dict[str, ak.Array]]) -> dict[str, ak.Array]:
+    """The arrays of consecutive chunks (files, groups of files) joined into one array per key"""
+    if len(chunks) == 0:
+        return {}
+    return {key: ak.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0].keys()}
+
+def _split_groups(files: list, nr_groups: int) -> list[list]:
+    """Splits into contiguous groups (so merging keeps the file order)"""
+    nr_groups = max(1, min(nr_groups, len(files)))
+    bounds = [len(files) * i // nr_groups for i in range(nr_groups + 1)]
+    return [files[bounds[i]:bounds[i+1]] for i in range(nr_groups)]
+
+def _merge_states(outDef, states, worker_flags) -> list:
+    flags = []
+    for (_, fcn), state, worker_flag in zip(outDef, states, worker_flags):
+        if state is not None:
+            flags.append(fcn.merge_state(state))
+        else:
+            flags.append(worker_flag) # stateless function: nothing to merge
+    return flags
+
+def _parallel_loop(loop_def: _LoopDef, tier_filename_dict: Iterable[dict[str, str]], executor: Executor,
+                   checkpoint: Checkpoint | None = None) -> list:
+    for _, fcn in loop_def.outDef:
+        if hasattr(fcn, "initialize") and not (hasattr(fcn, "get_state") and hasattr(fcn, "merge_state")):
+            raise TypeError(f"{type(fcn).__name__} has no get_state()/merge_state(); cannot run it in several processes")
+    # several groups per worker: balances the load and lets the loop stop early
+    groups = _split_groups(list(tier_filename_dict), 4 * executor.workers)
+    results = executor.map(_run_group, loop_def, groups)
+    flags = []
+    try:
+        for group, (states, worker_flags, profile, skipped) in zip(groups, results):
+            if profile is not None:
+                loop_def.profiler.merge_state(profile)
+            flags = _merge_states(loop_def.outDef, states, worker_flags)
+            loop_def.skipped.extend(skipped)
+            if checkpoint is not None:
+                _files_done(loop_def, checkpoint, group)
+            if _loop_done(flags):
+                break
+    finally:
+        results.close() # drops the remaining groups
+    return flags
 def _compile_input_arrays(input_labels: list[str], arrays):
         ins = []
         for input in input_labels:
             ins.append(arrays[input])
         return ins
-def _do_crop(arrays):
-    min_length = min(map(len, arrays.values()))
+def _do_crop(arrays, min_length: int | None = None):
+    if min_length is None:
+        min_length = min(map(len, arrays.values()))
     for key in arrays.keys():
         if len(arrays[key]) > min_length:
             print(f"Warning: cropping {key} from {len(arrays[key])} to {min_length}")
-            arrays[key] = arrays[key][:min_length]
\ No newline at end of file
+            arrays[key] = arrays[key][:min_length]
+    return min_length
\ No newline at end of file
@@ -2,9 +2,11 @@
 import awkward as ak
 
 class CountTask:
-    def __init__(self, fcn, *, name=None):
+    def __init__(self, fcn, *, name=None, min_entries_required: int | None = None):
+        """min_entries_required: done (-> loop can stop) once this many entries are counted"""
         self.fcn = fcn
         self.name = name
+        self.min_entries_required = min_entries_required
     def initialize(self):
         self.counter: int = 0
     def __call__(self, x, _):
@@ -12,7 +14,16 @@ class CountTask:
         if mask.ndim != 1: # remove in case multi-dim counting also makes sense
             raise RuntimeError(f"Counter requires 1-dim (I think), got {mask.ndim}")
         self.counter += ak.count_nonzero(mask)
-        return False # TODO: add also a min_entries threshold, so this task can break earlier if possible
+        return self._done()
+    def get_state(self):
+        return {"counter": self.counter}
+    def merge_state(self, state):
+        self.counter += state["counter"]
+        return self._done()
+    def result(self) -> dict[str, int]:
+        return {"counter": int(self.counter)}
+    def _done(self) -> bool:
+        return self.min_entries_required is not None and self.counter >= self.min_entries_required
     def finalize(self):
         if self.name:
             print(f"Counter {self.name}: {self.counter}")
\ No newline at end of file
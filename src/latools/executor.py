@@ -0,0 +1,234 @@
+"""Executors running the file groups of main_loop / compile_arrays in worker processes (see their executor
+parameter): ForkExecutor on this machine, SocketExecutor on any number of machines.
+
+A worker for a SocketExecutor on another node is started with
+
+    python -m latools.executor HOST:PORT --authkey KEY
+
+(HOST:PORT is executor.address, KEY is executor.authkey.hex()). It needs latools, the modules the analysis
+functions come from (unless serialized by value with cloudpickle) and the data files under the same paths."""
+from typing import Any
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable, Iterator
+from multiprocessing.connection import Client, Connection, Listener, wait
+import argparse
+import multiprocessing
+import os
+import pickle
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+try:
+    import cloudpickle as _serializer # also serializes lambdas and functions of __main__
+except ImportError: # then the functions have to be importable by the workers (no lambdas)
+    _serializer = pickle
+
+class Executor(ABC):
+    """Runs fcn(context, item) for a list of items in worker processes; context (e.g. the analysis definition)
+    goes to every worker only once. Usable as context manager (close() at the end)."""
+    @property
+    @abstractmethod
+    def workers(self) -> int:
+        """Number of workers (to split the work into enough items)"""
+    @abstractmethod
+    def map(self, fcn: Callable[[Any, Any], Any], context: Any, items: list) -> Iterator:
+        """Yields the results in the order of items. Closing the iterator early drops the remaining items."""
+    def close(self):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+class ForkExecutor(Executor):
+    """Pool of forked processes on this machine. The context is inherited instead of serialized
+    (so it may hold anything, e.g. lambdas, without cloudpickle)."""
+    def __init__(self, workers: int):
+        self._workers = workers
+    @property
+    def workers(self) -> int:
+        return self._workers
+    def map(self, fcn, context, items: list) -> Iterator:
+        global _fork_job
+        _fork_job = (fcn, context)
+        try:
+            with multiprocessing.get_context("fork").Pool(self._workers) as pool:
+                yield from pool.imap(_fork_call, items) # leaving the with-block terminates the workers
+        finally:
+            _fork_job = None
+
+class SocketExecutor(Executor):
+    """Scheduler handing the items one by one to worker processes connected over TCP (authenticated
+    multiprocessing connections), so a job spreads over several nodes. local_workers processes get started
+    on this machine; further workers can join at any time (see the module docstring), also during a map().
+    A lost worker's item is given to another one. The functions and the context are serialized with
+    cloudpickle if it is installed (else with pickle: no lambdas).
+
+    address: where to listen; ("0.0.0.0", port) for workers on other nodes. port 0: any free port."""
+    def __init__(self, local_workers: int = 2, *, address: tuple[str, int] = ("127.0.0.1", 0),
+                 authkey: bytes | None = None, connect_timeout: float = 60.):
+        self.authkey = authkey if authkey is not None else secrets.token_bytes(16)
+        self.local_workers = local_workers
+        self.connect_timeout = connect_timeout
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self._new: deque[Connection] = deque() # accepted, not yet used
+        self._connections: list[Connection] = []
+        self._contexts: dict[Connection, int] = {} # connection -> id of the context it got
+        self._busy: dict[Connection, tuple[int, int]] = {} # connection -> (map id, item index)
+        self._processes: list[subprocess.Popen] = []
+        self._map_id = 0
+        self._closed = False
+        threading.Thread(target=self._accept, daemon=True).start()
+    @property
+    def workers(self) -> int:
+        return max(1, self.local_workers, len(self._connections) + len(self._new))
+    def start(self):
+        """Starts the local workers (done by the first map())"""
+        if self._processes or self.local_workers <= 0:
+            return
+        host, port = self.address
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path),
+                   LATOOLS_HEADLESS="1") # workers only fill
+        for _ in range(self.local_workers):
+            self._processes.append(subprocess.Popen([sys.executable, "-m", "latools.executor", f"{host}:{port}",
+                                                     "--authkey", self.authkey.hex()], env=env))
+    def map(self, fcn, context, items: list) -> Iterator:
+        self.start()
+        self._map_id += 1
+        map_id = self._map_id
+        payload = _serializer.dumps((fcn, context))
+        todo = deque(range(len(items)))
+        results = {}
+        next_result = 0
+        waiting_since = time.monotonic()
+        while next_result < len(items):
+            while self._new:
+                self._connections.append(self._new.popleft())
+            for connection in self._connections:
+                if connection not in self._busy and todo:
+                    if not self._send(connection, map_id, payload, todo[0], items[todo[0]]):
+                        continue
+                    todo.popleft()
+            if not self._connections:
+                if time.monotonic() - waiting_since > self.connect_timeout:
+                    raise RuntimeError(f"No worker connected to {self.address} within {self.connect_timeout} s")
+                self._check_local_workers()
+                time.sleep(0.05)
+                continue
+            waiting_since = time.monotonic()
+            for connection in wait(self._connections, timeout=0.1):
+                busy = self._busy.pop(connection, None)
+                try:
+                    kind, result_map_id, index, result = _serializer.loads(connection.recv_bytes())
+                except (EOFError, OSError): # worker lost: its item goes to another one
+                    self._drop(connection)
+                    if busy is not None and busy[0] == map_id:
+                        todo.appendleft(busy[1])
+                    continue
+                if result_map_id != map_id: # of an earlier, stopped map()
+                    continue
+                if kind == "error":
+                    raise RuntimeError(f"Worker failed on item {index}:\n{result}")
+                results[index] = result
+            while next_result in results:
+                yield results.pop(next_result)
+                next_result += 1
+    def close(self):
+        """Stops the workers (also the remote ones)"""
+        if self._closed:
+            return
+        self._closed = True
+        for connection in self._connections + list(self._new):
+            try:
+                connection.send_bytes(_serializer.dumps(("stop",)))
+                connection.close()
+            except OSError:
+                pass
+        self._connections.clear()
+        self._listener.close()
+        for process in self._processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._processes.clear()
+    def _accept(self):
+        while not self._closed:
+            try:
+                self._new.append(self._listener.accept())
+            except (OSError, EOFError): # closed, or a client with a wrong authkey
+                if self._closed:
+                    return
+            except Exception: # multiprocessing.AuthenticationError
+                continue
+    def _send(self, connection: Connection, map_id: int, payload: bytes, index: int, item) -> bool:
+        try:
+            if self._contexts.get(connection) != map_id:
+                connection.send_bytes(_serializer.dumps(("context", map_id, payload)))
+                self._contexts[connection] = map_id
+            connection.send_bytes(_serializer.dumps(("item", map_id, index, item)))
+        except OSError:
+            self._drop(connection)
+            return False
+        self._busy[connection] = (map_id, index)
+        return True
+    def _drop(self, connection: Connection):
+        self._connections.remove(connection)
+        self._contexts.pop(connection, None)
+        self._busy.pop(connection, None)
+        connection.close()
+    def _check_local_workers(self):
+        if self._processes and all(process.poll() is not None for process in self._processes):
+            raise RuntimeError(f"All local workers exited (return codes {[p.returncode for p in self._processes]})")
+
+def worker(address: tuple[str, int], authkey: bytes):
+    """Worker process of a SocketExecutor: runs the items it gets until the executor stops it"""
+    connection = Client(address, authkey=authkey)
+    fcn = context = context_error = None
+    while True:
+        try:
+            message = _serializer.loads(connection.recv_bytes())
+        except (EOFError, OSError):
+            return
+        if message[0] == "stop":
+            return
+        if message[0] == "context":
+            _, map_id, payload = message
+            try:
+                fcn, context = _serializer.loads(payload)
+                context_error = None
+            except Exception:
+                context_error = traceback.format_exc()
+            continue
+        _, map_id, index, item = message
+        try:
+            if context_error is not None:
+                raise RuntimeError(f"Cannot deserialize the job:\n{context_error}")
+            reply = ("result", map_id, index, fcn(context, item))
+        except Exception:
+            reply = ("error", map_id, index, traceback.format_exc())
+        connection.send_bytes(_serializer.dumps(reply))
+
+# PRIVATE
+
+_fork_job: tuple[Callable, Any] | None = None # handed to the forked workers as a global: no pickling
+
+def _fork_call(item):
+    fcn, context = _fork_job
+    return fcn(context, item)
+
+def _main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="latools worker: connects to a SocketExecutor")
+    parser.add_argument("address", help="HOST:PORT of the executor")
+    parser.add_argument("--authkey", required=True, help="hex authkey of the executor")
+    args = parser.parse_args(argv)
+    host, port = args.address.rsplit(":", 1)
+    worker((host, int(port)), bytes.fromhex(args.authkey))
+
+if __name__ == "__main__":
+    _main()
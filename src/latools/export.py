@@ -0,0 +1,82 @@
+"""Batch export of finished tasks: their numeric results (result()) into one compact file, and their plots
+rendered to image files by worker processes (without a display, also if latools is headless)."""
+from typing import Any
+from collections.abc import Iterable
+import os
+import re
+import numpy as np
+from .executor import ForkExecutor
+from .utils import atomic_write
+
+def save_results(path: str, tasks: dict[str, Any]):
+    """Writes task.result() of all tasks (name -> task) into one compressed .npz file (no pickled objects:
+    category labels are stored as strings). See load_results()."""
+    arrays = {}
+    for name, task in tasks.items():
+        if "/" in name:
+            raise ValueError(f"Task name {name} must not contain '/'")
+        for field, value in task.result().items():
+            array = np.asarray(value)
+            arrays[f"{name}/{field}"] = array.astype(str) if array.dtype == object else array
+    with atomic_write(path) as f:
+        np.savez_compressed(f, **arrays)
+
+def load_results(path: str) -> dict[str, dict[str, Any]]:
+    """name -> field -> array (scalars as Python numbers) as written by save_results()"""
+    results: dict[str, dict[str, Any]] = {}
+    with np.load(path, allow_pickle=False) as content:
+        for key in content.files:
+            name, field = key.split("/", 1)
+            array = content[key]
+            results.setdefault(name, {})[field] = array.item() if array.ndim == 0 else array
+    return results
+
+def render(tasks: dict[str, Any], directory: str, *, formats: Iterable[str] = ("png",), workers: int = 4,
+           dpi: int = 100, figsize: tuple[float, float] | None = None) -> list[str]:
+    """Draws every task (name -> task with a draw() method) into its own figure and saves it as
+    directory/<name>.<format> for all formats (e.g. "png", "pdf"), spread over forked worker processes.
+    Tasks without draw() are skipped. Returns the written files."""
+    os.makedirs(directory, exist_ok=True)
+    names = [name for name, task in tasks.items() if hasattr(task, "draw")]
+    if not names:
+        return []
+    workers = max(1, min(workers, len(names)))
+    groups = [names[i::workers] for i in range(workers)]
+    context = (tasks, directory, tuple(formats), dpi, figsize)
+    written = []
+    with ForkExecutor(workers) as executor:
+        for paths in executor.map(_render_group, context, groups):
+            written.extend(paths)
+    return written
+
+# PRIVATE
+
+def _render_group(context, names: list[str]) -> list[str]:
+    tasks, directory, formats, dpi, figsize = context
+    import matplotlib
+    matplotlib.use("Agg", force=True) # no display in the workers
+    from .backends import set_headless, pyplot
+    set_headless(False)
+    plt = pyplot()
+    written = []
+    for name in names:
+        task = tasks[name]
+        fig, ax = plt.subplots(figsize=figsize)
+        if hasattr(task, "ax"):
+            task.fig, task.ax = fig, ax
+        task.draw()
+        browser = getattr(task, "browser", None) # a WaveformBrowser draws into its own figure
+        if browser is not None and getattr(browser, "fig", None) is not None and browser.fig is not fig:
+            plt.close(fig)
+            fig, ax = browser.fig, browser.ax
+        if not ax.get_title():
+            ax.set_title(name)
+        for fmt in formats:
+            path = os.path.join(directory, f"{_file_name(name)}.{fmt}")
+            fig.savefig(path, dpi=dpi)
+            written.append(path)
+        plt.close(fig)
+    return written
+
+def _file_name(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", name)
@@ -0,0 +1,195 @@
+from typing import Any
+from collections.abc import Iterable
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+import os
+import re
+import json
+import h5py
+from .utils import get_timestamp_from_filename, atomic_write
+from .reader import parse_spec
+
+@dataclass
+class IndexedFile:
+    """What the index knows about one file of one tier"""
+    path: str
+    mtime: int # ns
+    size: int
+    groups: dict[str, int | None] # LH5 groups of the first two levels ("ch1027201", "ch1027201/raw") -> rows (None: no table)
+
+@dataclass
+class IndexEntry:
+    """The files of all tiers of one data taking file (as one element of a tier_filename_dict)"""
+    key: str # file name with the tier part taken out
+    timestamp: str | None
+    period: str | None
+    run: str | None
+    datatype: str | None
+    tiers: dict[str, IndexedFile] = field(default_factory=dict)
+    @property
+    def filename_tiers(self) -> dict[str, str]:
+        return {tier: indexed.path for tier, indexed in self.tiers.items()}
+    def has(self, spec: str) -> bool:
+        """Whether the group of spec (e.g. "ch1027201/raw/energy") exists in the file of its tier"""
+        ref = parse_spec(spec)
+        try:
+            tier = ref.tier(self.tiers.keys())
+        except RuntimeError:
+            return False
+        return "/".join(ref.parts[:2]) in self.tiers[tier].groups
+    def rows(self, spec: str) -> int | None:
+        """Rows of the table holding spec (None if not there)"""
+        ref = parse_spec(spec)
+        try:
+            tier = ref.tier(self.tiers.keys())
+        except RuntimeError:
+            return None
+        return self.tiers[tier].groups.get("/".join(ref.parts[:2]))
+
+class FileIndex:
+    """Persistent index of the LH5 files below some directories: timestamp, period, run, tiers, the groups
+    (e.g. detectors) in every file and their row counts. scan() reads only new or changed files;
+    select() returns tier_filename_dicts for main_loop without touching the files.
+
+    Files of different tiers belong together if their names differ only in the tier part
+    ("...-tier_raw.lh5" / "...-tier_dsp.lh5"), wherever they are below the scanned directories."""
+    VERSION = 1
+    def __init__(self, path: str | None = None):
+        """path: index file (JSON), loaded if it exists; None: in memory only"""
+        self.path = path
+        self.entries: dict[str, IndexEntry] = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+    def __len__(self) -> int:
+        return len(self.entries)
+    def __iter__(self):
+        return iter(sorted(self.entries.values(), key=_sort_key))
+    def scan(self, *directories: str, pattern: str = r".*-tier_(\w+)\.lh5$", save: bool = True) -> int:
+        """Indexes the files below directories whose name matches pattern (its first group is the tier name).
+        Unchanged files are not opened again, files gone from these directories are dropped.
+        Returns the number of files (re)read."""
+        matcher = re.compile(pattern)
+        roots = [os.path.abspath(directory) for directory in directories]
+        found = {}
+        for root in roots:
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    if (match := matcher.match(filename)) is not None:
+                        found[os.path.join(dirpath, filename)] = (match.group(1),
+                                                                  filename[:match.start(1)] + filename[match.end(1):])
+        known = {indexed.path: (entry, tier) for entry in self.entries.values() for tier, indexed in entry.tiers.items()}
+        for path, (entry, tier) in known.items(): # drop vanished files
+            if path not in found and any(path.startswith(root + os.sep) for root in roots):
+                del entry.tiers[tier]
+        nr_read = 0
+        for path, (tier, key) in sorted(found.items()):
+            stat = os.stat(path)
+            entry = self.entries.get(key)
+            if entry is not None and tier in entry.tiers and entry.tiers[tier].path == path and \
+                    entry.tiers[tier].mtime == stat.st_mtime_ns and entry.tiers[tier].size == stat.st_size:
+                continue
+            if entry is None:
+                entry = self.entries[key] = IndexEntry(key, *_parse_name(os.path.basename(path)))
+            entry.tiers[tier] = IndexedFile(path, stat.st_mtime_ns, stat.st_size, _scan_groups(path))
+            nr_read += 1
+        self.entries = {key: entry for key, entry in self.entries.items() if entry.tiers}
+        if save and self.path is not None:
+            self.save()
+        return nr_read
+    def select(self, *, start: str | datetime | None = None, stop: str | datetime | None = None,
+               periods: Iterable[str] | None = None, runs: Iterable[str] | None = None,
+               datatypes: Iterable[str] | None = None, tiers: Iterable[str] | None = None,
+               specs: Iterable[str] | None = None, nonempty: bool = False) -> list[dict[str, str]]:
+        """tier_filename_dict of the matching files, sorted by timestamp.
+
+        start, stop
+            time range [start, stop) of the file timestamps (datetime or "YYYYmmddTHHMMSSZ")
+        periods, runs, datatypes
+            e.g. ["p03"], ["r000", "r001"], ["phy"]
+        tiers
+            tiers which have to exist (only these are put into the returned dicts)
+        specs
+            LH5 object names (e.g. the ones of an inputArraysDef) whose groups have to exist;
+            nonempty: and hold at least one row
+        """
+        return [entry.filename_tiers if tiers is None else {tier: entry.tiers[tier].path for tier in tiers}
+                for entry in self.query(start=start, stop=stop, periods=periods, runs=runs, datatypes=datatypes,
+                                        tiers=tiers, specs=specs, nonempty=nonempty)]
+    def query(self, *, start: str | datetime | None = None, stop: str | datetime | None = None,
+              periods: Iterable[str] | None = None, runs: Iterable[str] | None = None,
+              datatypes: Iterable[str] | None = None, tiers: Iterable[str] | None = None,
+              specs: Iterable[str] | None = None, nonempty: bool = False) -> list[IndexEntry]:
+        """The matching entries (see select())"""
+        start, stop = _timestamp(start), _timestamp(stop)
+        periods, runs, datatypes = [None if values is None else set(values) for values in (periods, runs, datatypes)]
+        tiers = None if tiers is None else list(tiers)
+        specs = None if specs is None else list(specs)
+        selected = []
+        for entry in self:
+            if (start is not None or stop is not None) and entry.timestamp is None:
+                continue
+            if (start is not None and entry.timestamp < start) or (stop is not None and entry.timestamp >= stop):
+                continue
+            if (periods is not None and entry.period not in periods) or (runs is not None and entry.run not in runs) \
+                    or (datatypes is not None and entry.datatype not in datatypes):
+                continue
+            if tiers is not None and any(tier not in entry.tiers for tier in tiers):
+                continue
+            if specs is not None and not all(entry.has(spec) and (not nonempty or entry.rows(spec)) for spec in specs):
+                continue
+            selected.append(entry)
+        return selected
+    def groups(self, tier: str) -> set[str]:
+        """All groups (of the first two levels) found in the files of tier"""
+        return {group for entry in self.entries.values() if tier in entry.tiers for group in entry.tiers[tier].groups}
+    def load(self):
+        with open(self.path) as f:
+            content = json.load(f)
+        if content.get("version") != self.VERSION:
+            raise RuntimeError(f"File index {self.path} has version {content.get('version')}, expected {self.VERSION}")
+        self.entries = {}
+        for entry in content["entries"]:
+            tiers = {tier: IndexedFile(**indexed) for tier, indexed in entry.pop("tiers").items()}
+            self.entries[entry["key"]] = IndexEntry(**entry, tiers=tiers)
+    def save(self):
+        content = {"version": self.VERSION, "entries": [asdict(entry) for entry in self]}
+        with atomic_write(self.path, "w") as f:
+            json.dump(content, f, separators=(",", ":"))
+
+# PRIVATE
+
+_NAME_PATTERN = re.compile(r"-(p\d+)-(r\d+)-([a-z]+)-\d{8}T\d{6}Z")
+
+def _parse_name(filename: str) -> tuple[str | None, str | None, str | None, str | None]:
+    """(timestamp, period, run, datatype) from a file name like l200-p03-r000-phy-20230101T000000Z-tier_raw.lh5"""
+    match = _NAME_PATTERN.search(filename)
+    return (get_timestamp_from_filename(filename), *(match.groups() if match else (None, None, None)))
+
+def _scan_groups(path: str) -> dict[str, int | None]:
+    groups = {}
+    with h5py.File(path, "r", locking=False) as h5file:
+        for name, obj in h5file.items():
+            groups[name] = _table_rows(name, obj, h5file)
+            if isinstance(obj, h5py.Group):
+                for sub_name, sub_obj in obj.items():
+                    groups[f"{name}/{sub_name}"] = _table_rows(f"{name}/{sub_name}", sub_obj, h5file)
+    return groups
+
+def _table_rows(name: str, obj: Any, h5file: h5py.File) -> int | None:
+    if not isinstance(obj, h5py.Group) or not str(obj.attrs.get("datatype", "")).startswith("table"):
+        return None
+    from lgdo.lh5 import read_n_rows # slow to import: only when scanning
+    try:
+        return int(read_n_rows(name, h5file))
+    except Exception: # not readable as LH5 table: just note the group
+        return None
+
+def _timestamp(value: str | datetime | None) -> str | None:
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime("%Y%m%dT%H%M%SZ")
+    return value
+
+def _sort_key(entry: IndexEntry):
+    return (entry.timestamp or "", entry.key)
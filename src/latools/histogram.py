@@ -1,14 +1,14 @@
+from __future__ import annotations
 from functools import partial
-from typing import Any
-import matplotlib
-import matplotlib.axes
-import matplotlib.figure
-import matplotlib.colors
+from typing import Any, TYPE_CHECKING
 from collections import defaultdict
-from matplotlib import pyplot as plt
 from abc import ABC
 import numpy as np
 import awkward as ak
+from .backends import pyplot, log_norm, is_headless
+if TYPE_CHECKING: # matplotlib is imported only when drawing
+    import matplotlib.axes
+    import matplotlib.figure
 
 class AxesHolder(ABC):
     def __init__(self, fig: matplotlib.figure.Figure | None = None, ax: matplotlib.axes.Axes | None = None):
@@ -25,7 +25,7 @@ class AxesHolder(ABC):
                 ax = self.ax
                 fig = self.fig
             else:
-                fig, ax = plt.subplots()
+                fig, ax = pyplot().subplots()
         return fig, ax
 class DrawablePlot(AxesHolder):
     def __init__(self, fig: matplotlib.figure.Figure | None = None, ax: matplotlib.axes.Axes | None = None):
@@ -33,10 +33,99 @@ class DrawablePlot(AxesHolder):
     # More utilities to come...
 
 
+def _as_numpy(array) -> np.ndarray:
+    """numpy view of a 1-dim (awkward or numpy) array; missing values (None) become NaN"""
+    values = ak.to_numpy(array, allow_missing=True) if isinstance(array, ak.Array) else np.asarray(array)
+    if isinstance(values, np.ma.MaskedArray):
+        values = np.ma.filled(values.astype(np.float64), np.nan)
+    return values
+
+def _as_mask(mask) -> np.ndarray:
+    """bool numpy array of a 1-dim (awkward or numpy) mask; missing values (None) are not selected"""
+    if isinstance(mask, ak.Array):
+        mask = ak.to_numpy(ak.fill_none(mask, False))
+    elif isinstance(mask, np.ma.MaskedArray):
+        mask = np.ma.filled(mask, False)
+    return np.asarray(mask).astype(bool, copy=False)
+
+_IMAGE_MIN_CELLS = 100000 # from this size on, 2-dim histograms are drawn as raster image
+
+def _draw_2d(ax, x_coords, y_coords, values: np.ndarray, norm):
+    """Draws values[x, y] over bin edges (one more than values) or bin centers (as many as values): as one
+    raster image if dense and uniformly binned, else as pcolormesh (not pcolor: one polygon per cell)"""
+    x_coords, y_coords = np.asarray(x_coords, dtype=np.float64), np.asarray(y_coords, dtype=np.float64)
+    centers = len(x_coords) == values.shape[0]
+    if values.size >= _IMAGE_MIN_CELLS and _uniform(x_coords) and _uniform(y_coords):
+        if centers: # cells reach half a bin beyond the centers
+            half_x = (x_coords[1] - x_coords[0]) / 2 if len(x_coords) > 1 else 0.5
+            half_y = (y_coords[1] - y_coords[0]) / 2 if len(y_coords) > 1 else 0.5
+            extent = (x_coords[0] - half_x, x_coords[-1] + half_x, y_coords[0] - half_y, y_coords[-1] + half_y)
+        else:
+            extent = (x_coords[0], x_coords[-1], y_coords[0], y_coords[-1])
+        return ax.imshow(values.T, origin="lower", extent=extent, aspect="auto", interpolation="nearest", norm=norm)
+    return ax.pcolormesh(x_coords, y_coords, values.T, norm=norm, shading="nearest" if centers else "flat")
+
+def _uniform(coords: np.ndarray) -> bool:
+    return len(coords) < 3 or bool(np.allclose(np.diff(coords), coords[1] - coords[0]))
+
+def _regular_bin_indices(values: np.ndarray, edges: np.ndarray) -> tuple[np.ndarray, np.ndarray | None]:
+    """Bin index of every value for the uniform binning edges: 0 is the underflow, len(edges) the overflow.
+    The values are assigned exactly as by np.histogram (also at the edges; the last bin includes the upper edge).
+    Also returns the mask of values to be ignored (NaN), or None if there are none."""
+    nbins = len(edges) - 1
+    lo, hi = edges[0], edges[-1]
+    with np.errstate(invalid="ignore"):
+        f_indices = (values - lo) * (nbins / (hi - lo))
+        f_indices += 1 # now truncation is floor for everything not in the underflow
+        np.clip(f_indices, 0, nbins + 1, out=f_indices) # also keeps inf out of the int conversion
+        nan_mask = np.isnan(f_indices)
+        if nan_mask.any():
+            f_indices[nan_mask] = 0
+        else:
+            nan_mask = None
+        indices = f_indices.astype(np.intp)
+    # correct the rounding of the multiplication, comparing with the edges (as np.histogram does)
+    ext_edges = np.concatenate([[-np.inf], edges, [np.inf]])
+    indices[values < ext_edges[indices]] -= 1
+    indices[(values >= ext_edges[indices + 1]) & (indices <= nbins)] += 1
+    indices[values == hi] = nbins
+    return indices, nan_mask
+
+# values are processed in blocks, so the temporaries stay in the cache
+_FILL_BLOCK_SIZE = 1 << 16
+
+def _fill_regular(flow_hist: np.ndarray, edges: list[np.ndarray], values: list[np.ndarray], 
+                  weights: np.ndarray | None = None):
+    """Fills values (one array per dimension) into flow_hist in place. flow_hist has an underflow and 
+    an overflow bin on each side of every dimension (shape nbins + 2)."""
+    flat_hist = flow_hist.reshape(-1) # a view
+    block_size = max(_FILL_BLOCK_SIZE, flat_hist.size) # bincount costs O(size of histogram) per block
+    for start in range(0, len(values[0]), block_size):
+        block = slice(start, start + block_size)
+        flat_indices = None
+        ignore = None
+        for dim_edges, dim_values in zip(edges, values):
+            indices, nan_mask = _regular_bin_indices(dim_values[block], dim_edges)
+            if flat_indices is None:
+                flat_indices = indices
+            else:
+                flat_indices *= len(dim_edges) + 1
+                flat_indices += indices
+            if nan_mask is not None:
+                ignore = nan_mask if ignore is None else ignore | nan_mask
+        block_weights = weights[block] if weights is not None else None
+        if ignore is not None:
+            flat_indices = flat_indices[~ignore]
+            block_weights = block_weights[~ignore] if block_weights is not None else None
+        flat_hist += np.bincount(flat_indices, weights=block_weights, minlength=flat_hist.size).astype(
+            flat_hist.dtype, copy=False)
+
 class HistogramTask:
+    """1-dim histogram with uniform binning. Values outside [min, max] are counted 
+    in underflow / overflow. weight_fcn (optional) returns the weight of every value."""
     def __init__(self, min: float, max: float, nbins: int = 1000, fcn = lambda x: x[0], 
                  min_entries_required: int | None = None, logy: bool = False, ax=None, 
-                 label: str | None = None):
+                 label: str | None = None, weight_fcn = None):
         self.min = min
         self.max = max
         self.nbins = nbins
@@ -45,29 +134,48 @@ class HistogramTask:
         self.logy = logy
         self.ax = ax
         self.label=label
+        self.weight_fcn = weight_fcn
     def initialize(self):
-        self.hist, self.edges = np.histogram([], bins=self.nbins, range=(self.min, self.max))
+        self.edges = np.linspace(self.min, self.max, self.nbins + 1)
+        # bins incl. underflow/overflow; filled in place. self.hist is a view without them
+        self.flow_hist = np.zeros(self.nbins + 2, dtype=np.int64 if self.weight_fcn is None else np.float64)
+        self.hist = self.flow_hist[1:-1]
         self.nr_entries = 0
+    @property
+    def underflow(self):
+        return self.flow_hist[0]
+    @property
+    def overflow(self):
+        return self.flow_hist[-1]
     def __call__(self, x, _):
         val = self.fcn(x)
         if val.ndim != 1:
             raise RuntimeError(f"array has to be 1-dim. Got {val.ndim}")
-        val = val.to_numpy()
-        hist, self.edges = np.histogram(val, bins=self.nbins, range=(self.min, self.max))
-        self.hist += hist
+        weights = _as_numpy(self.weight_fcn(x)) if self.weight_fcn is not None else None
+        _fill_regular(self.flow_hist, [self.edges], [_as_numpy(val)], weights)
         self.nr_entries += len(val)
         if self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required):
             return True
         return False
+    def get_state(self):
+        return {"flow_hist": self.flow_hist, "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        self.flow_hist += state["flow_hist"]
+        self.nr_entries += state["nr_entries"]
+        return self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required)
+    def result(self) -> dict[str, Any]:
+        """The numeric result (see export.save_results())"""
+        return {"edges": self.edges, "flow_hist": self.flow_hist, "nr_entries": self.nr_entries}
     def finalize(self):
-        self.draw()
+        if not is_headless():
+            self.draw()
     def draw(self, *, ax=None, **kwargs):
         newax = ax is None and self.ax is None
         if ax is None:
             if self.ax is not None:
                 ax = self.ax
             else:
-                _, ax = plt.subplots()
+                _, ax = pyplot().subplots()
         if self.logy:
             ax.set_yscale("log")
         #target = plt if ax is None else ax
@@ -76,9 +184,12 @@ class HistogramTask:
             ax.legend()
 
 class Histogram2DTask:    
+    """2-dim histogram with uniform binning. Values outside the ranges are counted in the 
+    underflow / overflow bins of flow_hist. weight_fcn (optional) returns the weight of every entry."""
     def __init__(self, x_min: float, x_max: float, x_nbins: int, y_min: float, y_max: float, y_nbins: int,
                  x_fcn = lambda x: x[0], y_fcn = lambda x: x[1],
-                 min_entries_required: int | None = None, fig=None, ax=None, logz:bool = False, autocrop_input_arrays:bool=False):
+                 min_entries_required: int | None = None, fig=None, ax=None, logz:bool = False, autocrop_input_arrays:bool=False,
+                 weight_fcn = None):
         self.x_min = x_min
         self.x_max = x_max
         self.x_nbins = x_nbins
@@ -92,15 +203,21 @@ class Histogram2DTask:
         self.ax = ax
         self.logz = logz
         self.autocrop_input_arrays = autocrop_input_arrays
+        self.weight_fcn = weight_fcn
     def initialize(self):
-        self.hist, self.x_edges, self.y_edges = np.histogram2d([], [], bins=[self.x_nbins, self.y_nbins], 
-                                                               range=([[self.x_min, self.x_max],[self.y_min, self.y_max]]))
+        self.x_edges = np.linspace(self.x_min, self.x_max, self.x_nbins + 1)
+        self.y_edges = np.linspace(self.y_min, self.y_max, self.y_nbins + 1)
+        # bins incl. underflow/overflow; filled in place. self.hist is a view without them
+        self.flow_hist = np.zeros((self.x_nbins + 2, self.y_nbins + 2), 
+                                  dtype=np.int64 if self.weight_fcn is None else np.float64)
+        self.hist = self.flow_hist[1:-1, 1:-1]
         self.nr_entries = 0
     def __call__(self, x, _):
         x_val = self.x_fcn(x)
         y_val = self.y_fcn(x)
         if x_val.ndim != 1 or y_val.ndim != 1:
             raise RuntimeError(f"array has to be 1-dim. Got {x_val.ndim} / {y_val.ndim}")
+        weights = _as_numpy(self.weight_fcn(x)) if self.weight_fcn is not None else None
         if len(x_val) != len(y_val):
             if not self.autocrop_input_arrays:
                 raise RuntimeError(f"x and y must have same length! have: {len(x_val)}, {len(y_val)}")
@@ -109,28 +226,214 @@ class Histogram2DTask:
                 x_val = x_val[:len(y_val)]
             else:
                 y_val = y_val[:len(x_val)]
-        hist, self.x_edges, self.y_edges = np.histogram2d(x_val.to_numpy(), y_val.to_numpy(), bins=[self.x_nbins, self.y_nbins], 
-                                                            range=([[self.x_min, self.x_max],[self.y_min, self.y_max]]))
-        self.hist += hist
+            weights = weights[:len(x_val)] if weights is not None else None
+        _fill_regular(self.flow_hist, [self.x_edges, self.y_edges], [_as_numpy(x_val), _as_numpy(y_val)], weights)
         self.nr_entries += len(x_val)
         if self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required):
             return True
         return False
+    def get_state(self):
+        return {"flow_hist": self.flow_hist, "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        self.flow_hist += state["flow_hist"]
+        self.nr_entries += state["nr_entries"]
+        return self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required)
+    def result(self) -> dict[str, Any]:
+        return {"x_edges": self.x_edges, "y_edges": self.y_edges, "flow_hist": self.flow_hist, 
+                "nr_entries": self.nr_entries}
     def finalize(self):
-        self.draw()
+        if not is_headless():
+            self.draw()
     def draw(self):
         if self.ax is not None:
             ax = self.ax
             fig = self.fig
         else:
-            fig, ax = plt.subplots()
-        norm = matplotlib.colors.LogNorm() if self.logz else None
-        ret = ax.pcolor(self.x_edges, self.y_edges, self.hist.T, norm=norm)
+            fig, ax = pyplot().subplots()
+        norm = log_norm() if self.logz else None
+        ret = _draw_2d(ax, self.x_edges, self.y_edges, self.hist, norm)
         if np.sum(self.hist) == 0:
             print("WARNING: Histogram is empty! :(")
         elif fig is not None:
             fig.colorbar(ret, ax=ax)
 
+class HistogramBankTask:
+    """Many 1-dim histograms with the same uniform binning, filled in one pass into one (nr_hists, nbins + 2)
+    buffer (incl. underflow / overflow). fcn (and weight_fcn) is evaluated and converted once for all of them;
+    the histograms are defined either by
+    selectors: dict name -> function returning a bool mask (which values go into the histogram), or
+    key_fcn & keys: one histogram per key (e.g. rawid), key_fcn returns the key of every value.
+    Masks / keys of coarser structure (e.g. per event for per-hit values) are broadcast to the values."""
+    def __init__(self, min: float, max: float, nbins: int = 1000, *, fcn = lambda x: x[0],
+                 selectors: dict[str, Any] | None = None, key_fcn = None, keys: list | None = None,
+                 weight_fcn = None, min_entries_required: int | None = None, logy: bool = False, ax=None,
+                 autodraw: bool = True):
+        """min_entries_required: done once every histogram has that many entries"""
+        if (selectors is None) == (key_fcn is None):
+            raise ValueError("Give either selectors or key_fcn & keys")
+        if key_fcn is not None and keys is None:
+            raise ValueError("key_fcn needs keys")
+        self.min = min
+        self.max = max
+        self.nbins = nbins
+        self.fcn = fcn
+        self.selectors = selectors
+        self.key_fcn = key_fcn
+        self.keys = list(keys) if keys is not None else None
+        self.names = list(selectors.keys()) if selectors is not None else [str(key) for key in self.keys]
+        self.weight_fcn = weight_fcn
+        self.min_entries_required = min_entries_required
+        self.logy = logy
+        self.ax = ax
+        self.autodraw = autodraw
+    def initialize(self):
+        self.edges = np.linspace(self.min, self.max, self.nbins + 1)
+        self.flow_hists = np.zeros((len(self.names), self.nbins + 2), 
+                                   dtype=np.int64 if self.weight_fcn is None else np.float64)
+        self.hists = self.flow_hists[:, 1:-1]
+        self.nr_entries = np.zeros(len(self.names), dtype=np.int64)
+        if self.keys is not None:
+            self._key_order = np.argsort(np.asarray(self.keys), kind="stable")
+            self._sorted_keys = np.asarray(self.keys)[self._key_order]
+    def __call__(self, x, _):
+        val = self.fcn(x)
+        weights = self.weight_fcn(x) if self.weight_fcn is not None else None
+        if self.selectors is not None:
+            masks = [self._flat(selector(x), val) for selector in self.selectors.values()]
+            hist_ids = None
+        else:
+            masks = None
+            hist_ids = self._hist_ids(self._flat(self.key_fcn(x), val))
+        values = _as_numpy(ak.flatten(val, axis=None) if val.ndim > 1 else val)
+        weights = _as_numpy(self._flat(weights, val)) if weights is not None else None
+        _fill_bank(self.flow_hists, self.nr_entries, self.edges, values, weights, masks, hist_ids)
+        return self._done()
+    def __getitem__(self, name) -> np.ndarray:
+        """The histogram (without underflow / overflow) of name"""
+        return self.hists[self.names.index(name)]
+    def histogram(self, name) -> HistogramTask:
+        """The histogram of name as HistogramTask (sharing the bins), e.g. for drawing"""
+        i = self.names.index(name)
+        hist = HistogramTask(self.min, self.max, self.nbins, logy=self.logy, label=name)
+        hist.edges = self.edges
+        hist.flow_hist = self.flow_hists[i]
+        hist.hist = self.hists[i]
+        hist.nr_entries = int(self.nr_entries[i])
+        return hist
+    def get_state(self):
+        return {"flow_hists": self.flow_hists, "nr_entries": self.nr_entries}
+    def result(self) -> dict[str, Any]:
+        return {"edges": self.edges, "names": self.names, "flow_hists": self.flow_hists, "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        self.flow_hists += state["flow_hists"]
+        self.nr_entries += state["nr_entries"]
+        return self._done()
+    def finalize(self):
+        if self.autodraw and not is_headless():
+            self.draw()
+    def draw(self, names: list | None = None, *, ax=None, **kwargs):
+        """Draws the histograms of names (default: all) into one axes"""
+        if ax is None:
+            ax = self.ax if self.ax is not None else pyplot().subplots()[1]
+        if self.logy:
+            ax.set_yscale("log")
+        for name in (names if names is not None else self.names):
+            ax.stairs(self[name], self.edges, label=name, **kwargs)
+        if len(names if names is not None else self.names) <= 10:
+            ax.legend()
+    def _done(self) -> bool:
+        return self.min_entries_required is not None and bool(np.all(self.nr_entries >= self.min_entries_required))
+    @staticmethod
+    def _flat(array, values) -> np.ndarray:
+        """array broadcast to the structure of values, flattened"""
+        if values.ndim > 1:
+            array = ak.broadcast_arrays(array, values)[0]
+            array = ak.flatten(array, axis=None)
+        return array
+    def _hist_ids(self, keys) -> np.ndarray:
+        """Histogram of every key; -1 for keys without histogram"""
+        keys = _as_numpy(keys)
+        positions = np.searchsorted(self._sorted_keys, keys)
+        positions = np.minimum(positions, len(self._sorted_keys) - 1)
+        return np.where(self._sorted_keys[positions] == keys, self._key_order[positions], -1)
+
+def _fill_bank(flow_hists: np.ndarray, nr_entries: np.ndarray, edges: np.ndarray, values: np.ndarray, 
+               weights: np.ndarray | None, masks: list | None, hist_ids: np.ndarray | None):
+    """Fills values into the rows of flow_hists: row i gets the values of masks[i] (or the ones with 
+    hist_ids == i); the bin indices are computed once for all rows, and one bincount fills all of them."""
+    nr_hists, row_size = flow_hists.shape
+    flat_hists = flow_hists.reshape(-1) # a view
+    block_size = max(_FILL_BLOCK_SIZE, flat_hists.size) # bincount costs O(size of histograms) per block
+    masks = [_as_mask(mask) for mask in masks] if masks is not None else None
+    for start in range(0, len(values), block_size):
+        block = slice(start, start + block_size)
+        bins, nan_mask = _regular_bin_indices(values[block], edges)
+        valid = ~nan_mask if nan_mask is not None else None
+        if masks is not None:
+            selections = [np.flatnonzero(mask[block] if valid is None else mask[block] & valid) for mask in masks]
+            ids = np.repeat(np.arange(nr_hists), [len(selection) for selection in selections])
+            selection = np.concatenate(selections) if selections else np.zeros(0, dtype=np.intp)
+        else:
+            block_ids = hist_ids[block]
+            selection = np.flatnonzero(block_ids >= 0 if valid is None else (block_ids >= 0) & valid)
+            ids = block_ids[selection]
+        flat_indices = ids * row_size + bins[selection]
+        block_weights = weights[block][selection] if weights is not None else None
+        flat_hists += np.bincount(flat_indices, weights=block_weights, minlength=flat_hists.size).astype(
+            flat_hists.dtype, copy=False)
+        nr_entries += np.bincount(ids, minlength=nr_hists)
+
+def _drop_missing(*arrays: ak.Array) -> list[ak.Array]:
+    """The arrays without the rows missing (None) in any of them, and without the missing values in their lists;
+    missing values are no category (and not counted)"""
+    missing = np.zeros(len(arrays[0]), dtype=bool)
+    for array in arrays:
+        missing |= ak.to_numpy(ak.is_none(array, axis=0))
+    if missing.any():
+        arrays = [ak.to_packed(array[~missing]) for array in arrays]
+    return [ak.drop_none(array, axis=-1) if array.ndim > 1 else ak.drop_none(array) for array in arrays]
+
+class CategoryIndex:
+    """Growing lookup table category -> integer code (in order of appearance)"""
+    def __init__(self):
+        self.categories = [] # code -> category
+        self._codes = {}     # category -> code
+    def __len__(self):
+        return len(self.categories)
+    def codes(self, values) -> np.ndarray:
+        """Codes of all values (adding the new categories); the dict is only touched once per distinct value"""
+        if np.ma.is_masked(values):
+            raise ValueError("Missing values (None) cannot be categories")
+        uniques, inverse = np.unique(np.asarray(values), return_inverse=True)
+        unique_codes = np.empty(len(uniques), dtype=np.int64)
+        for i, cat in enumerate(uniques.tolist()):
+            code = self._codes.get(cat)
+            if code is None:
+                code = self._codes[cat] = len(self.categories)
+                self.categories.append(cat)
+            unique_codes[i] = code
+        return unique_codes[inverse.reshape(-1)]
+    def labels(self, keymap_fcn=None, sort: bool = False) -> tuple[list, np.ndarray]:
+        """(labels, position of the label of each code): the categories mapped by keymap_fcn (categories 
+        mapped to the same label get merged) and optionally sorted"""
+        mapped = self.categories if keymap_fcn is None else [keymap_fcn(cat) for cat in self.categories]
+        positions = {}
+        for label in mapped:
+            positions.setdefault(label, len(positions))
+        labels = list(positions.keys())
+        if sort:
+            labels = sorted(labels)
+            positions = {label: i for i, label in enumerate(labels)}
+        return labels, np.array([positions[label] for label in mapped], dtype=np.int64)
+
+def _grow(counts: np.ndarray, shape: tuple[int, ...]) -> np.ndarray:
+    """counts, zero-padded to at least shape (with some headroom, so growing is amortized)"""
+    if all(have >= want for have, want in zip(counts.shape, shape)):
+        return counts
+    new_counts = np.zeros([max(want, 2 * have) for have, want in zip(counts.shape, shape)], dtype=counts.dtype)
+    new_counts[tuple(slice(0, have) for have in counts.shape)] = counts
+    return new_counts
+
 class CategoricalHistogramTask(DrawablePlot):
     """Usable for e.g. event-level arrays"""
     def __init__(self, fcn, *, keymap_fcn = None, sort=True, 
@@ -143,32 +446,47 @@ class CategoricalHistogramTask(DrawablePlot):
         self.min_entries_required = min_entries_required
         self.logy = logy
     def initialize(self):
-        self.cats_dict = defaultdict(int) # categories found and their frequencies
+        self.index = CategoryIndex()
+        self.counts = np.zeros(0, dtype=np.int64) # frequency per category code
         self.nr_entries = 0
     def __call__(self, x, _):
         cats_arr = self.fcn(x)
         if cats_arr.ndim != 1:
             raise RuntimeError(f"array has to be 1-dim. Got {cats_arr.ndim}")
-        cats, counts = np.unique(cats_arr.to_numpy(), return_counts=True)
-        for cat, count in zip(cats, counts):
-            self.cats_dict[cat] += count
-        self.nr_entries += np.sum(counts)
+        cats_arr, = _drop_missing(cats_arr)
+        codes = self.index.codes(cats_arr.to_numpy())
+        self._add(np.bincount(codes, minlength=len(self.index)))
+        self.nr_entries += len(codes)
         if self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required):
             return True
         return False
+    def _add(self, counts_per_code: np.ndarray):
+        self.counts = _grow(self.counts, (len(self.index),))
+        self.counts[:len(counts_per_code)] += counts_per_code
+    @property
+    def cats_dict(self) -> dict:
+        """categories found and their frequencies (keys mapped by keymap_fcn and sorted if requested)"""
+        labels, positions = self.index.labels(self.keymap_fcn, self.sort)
+        counts = np.zeros(len(labels), dtype=np.int64)
+        np.add.at(counts, positions, self.counts[:len(self.index)])
+        return dict(zip(labels, counts.tolist()))
+    def get_state(self):
+        return {"categories": self.index.categories, "counts": self.counts[:len(self.index)], 
+                "nr_entries": self.nr_entries}
+    def result(self) -> dict[str, Any]:
+        cats_dict = self.cats_dict
+        return {"categories": list(cats_dict.keys()), "counts": np.array(list(cats_dict.values()), dtype=np.int64),
+                "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        if len(state["categories"]) > 0:
+            codes = self.index.codes(state["categories"])
+            self.counts = _grow(self.counts, (len(self.index),))
+            self.counts[codes] += state["counts"] # categories (so codes) are unique
+        self.nr_entries += state["nr_entries"]
+        return self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required)
     def finalize(self):
-        if self.keymap_fcn:
-            self._map_keys()
-        #print(self.cats_dict)
-        if self.sort:
-            self.cats_dict = dict(sorted(self.cats_dict.items()))
-        self.draw()
-    def _map_keys(self):
-        assert self.keymap_fcn is not None
-        newdict = {}
-        for k, v in self.cats_dict.items():
-            newdict[self.keymap_fcn(k)] = v
-        self.cats_dict = newdict
+        if not is_headless():
+            self.draw()
     def draw(self):
         _, ax = self._touch_fig_ax()
         if self.logy:
@@ -184,12 +502,15 @@ class MultiarrayCategoricalHistogramTask(CategoricalHistogramTask):
         super().__init__(fcn, **kwargs)
         self.in_shortnames = in_shortnames
     def __call__(self, x, _):
+        counts = []
         for short, array in zip(self.in_shortnames, x):
             mask = self.fcn([array])
             if mask.ndim != 1:
                 raise RuntimeError(f"mask has to be 1-dim. Got {mask.ndim}")
-            self.cats_dict[short] += np.sum(mask.to_numpy())
+            counts.append(np.sum(mask.to_numpy()))
             self.nr_entries += len(mask)
+        codes = self.index.codes(self.in_shortnames)
+        self._add(np.bincount(codes, weights=counts, minlength=len(self.index)).astype(np.int64))
         if self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required):
             return True
         return False
@@ -209,8 +530,9 @@ class CategoricalHistogram2DTask(DrawablePlot):
         self.ax = ax
         self.logz = logz
     def initialize(self):
-        # outer map: x axis, innter map: y axis
-        self.cats_dict = defaultdict(partial(defaultdict, int)) # arg has to be factory, not object
+        self.x_index = CategoryIndex()
+        self.y_index = CategoryIndex()
+        self.counts = np.zeros((0, 0), dtype=np.int64) # frequency per (x code, y code)
         self.nr_entries = 0
     def __call__(self, x, _):
         req_dimensions = 1 if self.mode == "normal" else 2
@@ -225,54 +547,69 @@ class CategoricalHistogram2DTask(DrawablePlot):
                 cats_x_arr = cats_x_arr[:len(cats_y_arr)]
             else:
                 cats_y_arr = cats_y_arr[:len(cats_x_arr)]
+        cats_x_arr, cats_y_arr = _drop_missing(cats_x_arr, cats_y_arr)
 
         match(self.mode):
             case "normal":
-                zipped_array = ak.zip([cats_x_arr, cats_y_arr])
+                x_codes = self.x_index.codes(cats_x_arr.to_numpy())
+                y_codes = self.y_index.codes(cats_y_arr.to_numpy())
             case "cartesian":
-                zipped_array = ak.flatten(ak.cartesian([cats_x_arr, cats_y_arr], axis=-1), axis=-1)
+                # encode the flat contents, then pair the codes per event
+                x_codes = ak.unflatten(self.x_index.codes(ak.flatten(cats_x_arr).to_numpy()), ak.num(cats_x_arr))
+                y_codes = ak.unflatten(self.y_index.codes(ak.flatten(cats_y_arr).to_numpy()), ak.num(cats_y_arr))
+                pairs = ak.flatten(ak.cartesian([x_codes, y_codes], axis=-1), axis=-1)
+                x_codes = ak.to_numpy(pairs["0"])
+                y_codes = ak.to_numpy(pairs["1"])
             case _:
                 raise RuntimeError("Unknown mode "+self.mode)
-        
-        cats, counts = np.unique(zipped_array, return_counts=True)
-        for cat, count in zip(cats, counts):
-            #print(cat.__repr__(), count.__repr__())
-            self.cats_dict[cat[0]][cat[1]] += count
-            self.nr_entries += count
+        nx, ny = len(self.x_index), len(self.y_index)
+        self._add(np.bincount(x_codes * ny + y_codes, minlength=nx * ny).reshape(nx, ny))
+        self.nr_entries += len(x_codes)
         if self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required):
             return True
         return False
+    def _add(self, counts_per_codes: np.ndarray):
+        self.counts = _grow(self.counts, (len(self.x_index), len(self.y_index)))
+        self.counts[:counts_per_codes.shape[0], :counts_per_codes.shape[1]] += counts_per_codes
+    def matrix(self) -> tuple[list, list, np.ndarray]:
+        """(x labels, y labels, counts[x, y]) with labels mapped by keymap_fcn and sorted if requested"""
+        x_labels, x_positions = self.x_index.labels(self.keymap_fcn, self.sort)
+        y_labels, y_positions = self.y_index.labels(self.keymap_fcn, self.sort)
+        matrix = np.zeros((len(x_labels), len(y_labels)), dtype=np.int64)
+        np.add.at(matrix, (x_positions[:, None], y_positions[None, :]), 
+                  self.counts[:len(self.x_index), :len(self.y_index)])
+        return x_labels, y_labels, matrix
+    @property
+    def cats_dict(self) -> dict:
+        """outer map: x axis, inner map: y axis -> frequency (only the pairs found)"""
+        x_labels, y_labels, matrix = self.matrix()
+        cats_dict = defaultdict(partial(defaultdict, int)) # arg has to be factory, not object
+        for x, y in zip(*np.nonzero(matrix)):
+            cats_dict[x_labels[x]][y_labels[y]] = int(matrix[x, y])
+        return cats_dict
+    def get_state(self):
+        return {"x_categories": self.x_index.categories, "y_categories": self.y_index.categories,
+                "counts": self.counts[:len(self.x_index), :len(self.y_index)], "nr_entries": self.nr_entries}
+    def result(self) -> dict[str, Any]:
+        x_labels, y_labels, matrix = self.matrix()
+        return {"x_categories": x_labels, "y_categories": y_labels, "counts": matrix, "nr_entries": self.nr_entries}
+    def merge_state(self, state):
+        if len(state["x_categories"]) > 0 and len(state["y_categories"]) > 0:
+            x_codes = self.x_index.codes(state["x_categories"])
+            y_codes = self.y_index.codes(state["y_categories"])
+            self.counts = _grow(self.counts, (len(self.x_index), len(self.y_index)))
+            self.counts[np.ix_(x_codes, y_codes)] += state["counts"] # categories (so codes) are unique
+        self.nr_entries += state["nr_entries"]
+        return self.min_entries_required is not None and (self.nr_entries >= self.min_entries_required)
     def finalize(self):
-        if self.keymap_fcn:
-            self._map_keys()
-        #print(self.cats_dict)
-        self.draw()
-    def _map_keys(self):
-        assert self.keymap_fcn is not None
-        newdict = defaultdict(partial(defaultdict, int))
-        for x_key, old_y_dict in self.cats_dict.items():
-            y_dict = newdict[self.keymap_fcn(x_key)] # defaultdict creates new inner dict here
-            for y_key, count in old_y_dict.items():
-                y_dict[self.keymap_fcn(y_key)] = count
-            #newdict[self.keymap_fcn(x_key)] = y_dict
-        self.cats_dict = newdict
+        if not is_headless():
+            self.draw()
     def draw(self):
-        with plt.rc_context({"figure.figsize": (14, 10)}):
+        with pyplot().rc_context({"figure.figsize": (14, 10)}):
             fig, ax = self._touch_fig_ax()
-        x_labels = list(self.cats_dict.keys())
-        y_labels = set()
-        for y_dict in self.cats_dict.values():
-            y_labels = y_labels.union(y_dict.keys())
-        y_labels = list(y_labels) # cannot subscript or sort a set
-        if self.sort:
-            x_labels = sorted(x_labels)
-            y_labels = sorted(y_labels)
-        draw_array = np.ndarray((len(x_labels), len(y_labels))) # need to transpose when doing pcolor()
-        for x in range(len(x_labels)):
-            for y in range(len(y_labels)):
-                draw_array[x][y] = self.cats_dict[x_labels[x]][y_labels[y]]
-        norm = matplotlib.colors.LogNorm() if self.logz else None
-        ret = ax.pcolor(range(len(x_labels)), range(len(y_labels)), draw_array.T, norm=norm)
+        x_labels, y_labels, draw_array = self.matrix()
+        norm = log_norm() if self.logz else None
+        ret = _draw_2d(ax, range(len(x_labels)), range(len(y_labels)), draw_array, norm)
         ax.set_xticks(range(len(x_labels)), x_labels)
         ax.tick_params(axis='x', labelrotation=90)
         ax.set_yticks(range(len(y_labels)), y_labels)    
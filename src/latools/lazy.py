@@ -0,0 +1,94 @@
+from typing import Any
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+import numpy as np
+import awkward as ak
+
+class ChunkStore:
+    """In-memory LRU cache of array chunks, bounded by their total bytes"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._chunks: OrderedDict[Any, ak.Array] = OrderedDict()
+    def get_or_compute(self, key, compute: Callable[[], ak.Array]) -> ak.Array:
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            return self._chunks[key]
+        chunk = compute()
+        self._chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        while self.nbytes > self.max_bytes and len(self._chunks) > 1:
+            _, evicted = self._chunks.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return chunk
+    def clear(self):
+        self._chunks.clear()
+        self.nbytes = 0
+
+class LazyArray:
+    """Array over the rows of many files, which reads (or generates) only the chunks of rows that
+    get accessed. Supports len(), indexing by int, slice, integer array and 1-dim boolean mask
+    (further indices in a tuple are applied to the result), iteration over chunks and to_ak()."""
+    def __init__(self, name: str, file_lengths: list[int], chunk_size: int,
+                 compute: Callable[[int, int, int], ak.Array], store: ChunkStore):
+        """compute(file_index, start, stop) returns the rows [start, stop) of file file_index"""
+        self.name = name
+        self.chunk_size = chunk_size
+        self.file_lengths = np.asarray(file_lengths, dtype=np.int64)
+        self._file_starts = np.concatenate([[0], np.cumsum(self.file_lengths)])
+        self._compute = compute
+        self._store = store
+    def __len__(self) -> int:
+        return int(self._file_starts[-1])
+    def __repr__(self) -> str:
+        return f"<LazyArray {self.name}: {len(self)} rows in {len(self.file_lengths)} files>"
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows = self[key[0]]
+            if len(key) == 1:
+                return rows
+            return rows[key[1:]] if isinstance(key[0], (int, np.integer)) else rows[(slice(None),) + key[1:]]
+        if isinstance(key, (int, np.integer)):
+            if not -len(self) <= key < len(self):
+                raise IndexError(f"Row {key} out of range for {len(self)} rows")
+            return self.take(np.array([key]))[0]
+        if isinstance(key, slice):
+            return self.take(np.arange(*key.indices(len(self))))
+        if isinstance(key, str):
+            raise TypeError("LazyArray only supports selecting rows; select fields after that")
+        key = ak.to_numpy(key) if isinstance(key, ak.Array) else np.asarray(key)
+        if key.dtype == bool:
+            if key.shape != (len(self),):
+                raise IndexError(f"Boolean mask of shape {key.shape} for {len(self)} rows")
+            key = np.flatnonzero(key)
+        return self.take(key)
+    def take(self, rows: np.ndarray) -> ak.Array:
+        """The given rows (in the given order), reading only the chunks they are in"""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = np.where(rows < 0, rows + len(self), rows)
+        if len(rows) > 0 and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"Rows out of range for {len(self)} rows")
+        file_indices = np.searchsorted(self._file_starts, rows, side="right") - 1
+        local_rows = rows - self._file_starts[file_indices]
+        chunk_indices = local_rows // self.chunk_size
+        max_chunks = int(self.file_lengths.max(initial=0)) // self.chunk_size + 1
+        chunk_ids, inverse = np.unique(file_indices * max_chunks + chunk_indices, return_inverse=True)
+        chunks = [self._chunk(int(chunk_id // max_chunks), int(chunk_id % max_chunks)) for chunk_id in chunk_ids]
+        if len(chunks) == 0:
+            return self._chunk(0, 0)[:0] if len(self.file_lengths) > 0 else ak.Array([])
+        chunk_starts = np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks])])
+        positions = chunk_starts[inverse.reshape(-1)] + local_rows - chunk_indices * self.chunk_size
+        return ak.concatenate(chunks)[positions]
+    def iter_chunks(self) -> Iterator[ak.Array]:
+        for file_index, length in enumerate(self.file_lengths):
+            for chunk_index in range((int(length) + self.chunk_size - 1) // self.chunk_size):
+                yield self._chunk(file_index, chunk_index)
+    def to_ak(self) -> ak.Array:
+        """All rows (reads everything!)"""
+        chunks = list(self.iter_chunks())
+        return ak.concatenate(chunks) if chunks else ak.Array([])
+    def _chunk(self, file_index: int, chunk_index: int) -> ak.Array:
+        start = chunk_index * self.chunk_size
+        stop = min(start + self.chunk_size, int(self.file_lengths[file_index]))
+        return self._store.get_or_compute((self.name, file_index, chunk_index),
+                                          lambda: self._compute(file_index, start, stop))
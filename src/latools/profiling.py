@@ -0,0 +1,205 @@
+from typing import Any, NamedTuple, TextIO
+from collections.abc import Callable
+from collections import defaultdict
+import sys
+import json
+import threading
+import time
+
+class StageRecord(NamedTuple):
+    """One timed step of main_loop on one file (or chunk)"""
+    stage: str # read:<short>, crop, pre_reducer, gen:<output>, out[<i>]:<name>
+    file: str
+    seconds: float
+    rows: int
+    nbytes: int # bytes of the resulting array(s); for outDef functions of their inputs
+
+class Profiler:
+    """Instrumentation of main_loop: wall time, rows and bytes per stage and per file, and the peak
+    memory held by the arrays of a file. Pass it as profiler= to main_loop and look at report() afterwards.
+    progress: print a live progress line (files, events/s, ETA) to stream.
+    hooks: callables getting every StageRecord (with workers > 1 they run in the worker processes; with a
+    SocketExecutor, copies of them serialized like the analysis functions)."""
+    def __init__(self, *, progress: bool = False, hooks: list[Callable[[StageRecord], Any]] | None = None,
+                 stream: TextIO | None = None, progress_interval: float = 0.5):
+        self.progress = progress
+        self.hooks = list(hooks or [])
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        self.stages: dict[str, dict[str, float]] = defaultdict(_new_counts)
+        self.files: dict[str, dict[str, Any]] = {}
+        self.nr_files: int | None = None
+        self.wall_seconds = 0.
+        self._start = None
+        self._last_print = 0.
+    def add_hook(self, hook: Callable[[StageRecord], Any]):
+        self.hooks.append(hook)
+    def stage(self, name: str, file: str, arrays: dict | None = None) -> "_Stage":
+        """Context manager timing a stage; arrays: the arrays of the file, to track the peak memory"""
+        return _Stage(self, name, file, arrays)
+    def record(self, record: StageRecord):
+        with self._lock:
+            counts = self.stages[record.stage]
+            counts["calls"] += 1
+            counts["seconds"] += record.seconds
+            counts["rows"] += record.rows
+            counts["bytes"] += record.nbytes
+            file = self._file(record.file)
+            file["seconds"] += record.seconds
+            file["stages"][record.stage] = file["stages"].get(record.stage, 0.) + record.seconds
+            if record.stage.startswith("read:"):
+                file["bytes_read"] += record.nbytes
+        for hook in self.hooks:
+            hook(record)
+    def update_peak(self, file: str, nbytes: int):
+        with self._lock:
+            file = self._file(file)
+            file["peak_bytes"] = max(file["peak_bytes"], nbytes)
+    def start(self, nr_files: int | None = None):
+        self._start = time.perf_counter()
+        self.nr_files = nr_files
+    def unit_done(self, file: str, rows: int):
+        """A file (or chunk) with rows events got processed"""
+        with self._lock:
+            file = self._file(file)
+            file["rows"] += rows
+            file["chunks"] += 1
+        self._print_progress()
+    def finish(self):
+        if self._start is not None:
+            self.wall_seconds += time.perf_counter() - self._start
+            self._start = None
+        self._print_progress(final=True)
+    def get_state(self):
+        return {"stages": dict(self.stages), "files": self.files}
+    def merge_state(self, state):
+        with self._lock:
+            for name, counts in state["stages"].items():
+                for key, value in counts.items():
+                    self.stages[name][key] += value
+            for filename, other in state["files"].items():
+                file = self._file(filename)
+                for key in ("seconds", "rows", "chunks", "bytes_read"):
+                    file[key] += other[key]
+                file["peak_bytes"] = max(file["peak_bytes"], other["peak_bytes"])
+                for name, seconds in other["stages"].items():
+                    file["stages"][name] = file["stages"].get(name, 0.) + seconds
+        self._print_progress()
+    @property
+    def total_rows(self) -> int:
+        return sum(file["rows"] for file in self.files.values())
+    def report(self) -> dict[str, Any]:
+        """Structured report: totals, per-stage and per-file numbers (stage seconds are summed over
+        threads / workers, so they can exceed the wall time)"""
+        wall = self._elapsed()
+        return {
+            "total": {"wall_seconds": wall, "files": sum(1 for file in self.files.values() if file["chunks"] > 0), "rows": self.total_rows,
+                      "bytes_read": sum(file["bytes_read"] for file in self.files.values()),
+                      "peak_bytes": max((file["peak_bytes"] for file in self.files.values()), default=0),
+                      "events_per_second": self.total_rows / wall if wall > 0 else None},
+            "stages": {name: {**counts, "calls": int(counts["calls"]), "rows": int(counts["rows"]),
+                              "bytes": int(counts["bytes"])} for name, counts in self.stages.items()},
+            "files": {filename: {**file, "stages": dict(file["stages"])} for filename, file in self.files.items()},
+        }
+    def to_dataframe(self, by: str = "stage"):
+        """pandas DataFrame of the report, one row per stage (by="stage") or per file (by="file")"""
+        import pandas as pd
+        report = self.report()
+        if by == "stage":
+            df = pd.DataFrame.from_dict(report["stages"], orient="index")
+            df["fraction"] = df["seconds"] / df["seconds"].sum() if len(df) > 0 else []
+            return df.sort_values("seconds", ascending=False)
+        if by == "file":
+            files = {filename: {key: value for key, value in file.items() if key != "stages"}
+                     for filename, file in report["files"].items()}
+            return pd.DataFrame.from_dict(files, orient="index")
+        raise ValueError(f"Unknown by {by}")
+    def dump_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+    def summary(self) -> str:
+        """Human-readable table of the stages, slowest first"""
+        report = self.report()
+        total = sum(counts["seconds"] for counts in report["stages"].values()) or 1.
+        lines = [f"{'stage':<36} {'calls':>7} {'seconds':>10} {'%':>6} {'rows':>12} {'MB':>10}"]
+        for name, counts in sorted(report["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{name[:36]:<36} {counts['calls']:>7} {counts['seconds']:>10.3f} "
+                         f"{100 * counts['seconds'] / total:>6.1f} {counts['rows']:>12} {counts['bytes'] / 1e6:>10.1f}")
+        t = report["total"]
+        rate = f"{t['events_per_second']:.0f}" if t["events_per_second"] is not None else "-"
+        lines.append(f"{t['files']} files, {t['rows']} events in {t['wall_seconds']:.2f} s ({rate} ev/s), "
+                     f"{t['bytes_read'] / 1e6:.1f} MB read, peak {t['peak_bytes'] / 1e6:.1f} MB per file")
+        return "\n".join(lines)
+    def _file(self, filename: str) -> dict[str, Any]:
+        if filename not in self.files:
+            self.files[filename] = {"seconds": 0., "rows": 0, "chunks": 0, "bytes_read": 0, "peak_bytes": 0, "stages": {}}
+        return self.files[filename]
+    def _elapsed(self) -> float:
+        return self.wall_seconds + (time.perf_counter() - self._start if self._start is not None else 0.)
+    def _print_progress(self, final: bool = False):
+        if not self.progress:
+            return
+        now = time.perf_counter()
+        if not final and now - self._last_print < self.progress_interval:
+            return
+        self._last_print = now
+        elapsed = self._elapsed()
+        done = sum(1 for file in self.files.values() if file["chunks"] > 0)
+        line = f"files {done}" + (f"/{self.nr_files}" if self.nr_files else "")
+        line += f" | {self.total_rows} events"
+        if elapsed > 0:
+            line += f" | {self.total_rows / elapsed:.0f} ev/s"
+        if self.nr_files and 0 < done < self.nr_files and not final:
+            line += f" | ETA {_format_seconds(elapsed / done * (self.nr_files - done))}"
+        else:
+            line += f" | {_format_seconds(elapsed)}"
+        stream = self.stream or sys.stderr
+        stream.write("\r" + line.ljust(70) + ("\n" if final else ""))
+        stream.flush()
+
+def stage(profiler: Profiler | None, name: str, file: str, arrays: dict | None = None) -> "_Stage":
+    """profiler.stage(), or a stage doing nothing if there is no profiler"""
+    if profiler is None:
+        return _NO_STAGE
+    return profiler.stage(name, file, arrays)
+
+# PRIVATE
+
+def _new_counts() -> dict[str, float]:
+    return {"calls": 0, "seconds": 0., "rows": 0, "bytes": 0}
+
+def _format_seconds(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+class _Stage:
+    def __init__(self, profiler: Profiler | None, name: str, file: str, arrays: dict | None):
+        self.profiler = profiler
+        self.name = name
+        self.file = file
+        self.arrays = arrays
+        self.rows = 0
+        self.nbytes = 0
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def count(self, *arrays):
+        """Accounts the resulting arrays of the stage (rows: the longest one)"""
+        if self.profiler is None:
+            return
+        for array in arrays:
+            self.rows = max(self.rows, len(array))
+            self.nbytes += array.nbytes
+    def __exit__(self, *exc):
+        if self.profiler is None:
+            return False
+        self.profiler.record(StageRecord(self.name, self.file, time.perf_counter() - self.start, self.rows, self.nbytes))
+        if self.arrays is not None:
+            self.profiler.update_peak(self.file, sum(array.nbytes for array in list(self.arrays.values())))
+        return False
+
+_NO_STAGE = _Stage(None, "", "", None)
@@ -0,0 +1,154 @@
+from typing import Any, NamedTuple
+from collections import OrderedDict
+from collections.abc import Iterable
+import os
+import threading
+import h5py
+import awkward as ak
+
+class SpecRef(NamedTuple):
+    """An inputArraysDef spec, parsed once: the object name and the two candidates for the tier name
+    (first or second path component, as in "evt/geds/energy" or "ch1027201/dsp/cuspEmax")"""
+    spec: str
+    parts: tuple[str, ...]
+    @property
+    def group(self) -> str:
+        return "/".join(self.parts[:-1])
+    @property
+    def field(self) -> str:
+        return self.parts[-1]
+    def tier(self, tiers: Iterable[str]) -> str:
+        if self.parts[0] in tiers:
+            return self.parts[0]
+        if len(self.parts) > 1 and self.parts[1] in tiers:
+            return self.parts[1]
+        raise RuntimeError(f"Cannot identify tier name in spec {self.spec}")
+
+def parse_spec(spec: str) -> SpecRef:
+    parts = tuple(part for part in spec.strip("/").split("/") if part)
+    if len(parts) < 2:
+        raise ValueError(f"Spec {spec} needs at least a group and a name")
+    return SpecRef(spec, parts)
+
+class FilePool:
+    """Open (read-only) HDF5 files, so reading many objects of a file (also over several reads) opens it once.
+    At most max_open files are kept open (least recently used are closed). A file changed on disk is re-opened.
+    Handles are not shared with forked processes."""
+    def __init__(self, max_open: int = 16):
+        self.max_open = max_open
+        self._files: OrderedDict[str, tuple[h5py.File, int]] = OrderedDict() # path -> (file, mtime)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+    def get(self, path: str) -> h5py.File:
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            if os.getpid() != self._pid: # forked: the handles belong to the parent
+                self._files = OrderedDict()
+                self._pid = os.getpid()
+            if path in self._files:
+                h5file, opened_mtime = self._files[path]
+                if opened_mtime == mtime and h5file.id.valid:
+                    self._files.move_to_end(path)
+                    return h5file
+                self._close(path)
+            # lgdo opens files without locking; the flags of all handles of a file have to match
+            h5file = h5py.File(path, "r", locking=False)
+            self._files[path] = (h5file, mtime)
+            while len(self._files) > self.max_open:
+                self._close(next(iter(self._files)))
+            return h5file
+    def close(self):
+        with self._lock:
+            if os.getpid() == self._pid:
+                for path in list(self._files):
+                    self._close(path)
+            self._files = OrderedDict()
+    def _close(self, path: str):
+        h5file, _ = self._files.pop(path)
+        try:
+            h5file.close()
+        except Exception: # already invalid
+            pass
+
+class ReadBatch(NamedTuple):
+    filename: str
+    group: str
+    shorts: list[str]
+    kwargs: dict[str, Any]
+    @property
+    def name(self) -> str:
+        return self.shorts[0] if len(self.shorts) == 1 else f"{self.group}[{len(self.shorts)}]"
+
+class SpecReader:
+    """Reads the specs of an inputArraysDef from the files of a tier dict: specs are parsed (and validated) once,
+    files are taken from a FilePool, and several fields of the same table are read in one call."""
+    def __init__(self, inputArraysDef: list[tuple[str, str]], pool: FilePool | None = None):
+        self.refs = {short: parse_spec(spec) for short, spec in inputArraysDef}
+        self.pool = pool if pool is not None else FilePool()
+        self._tiers = {} # frozenset of tier names -> {short: tier}
+    def validate(self, tiers: Iterable[str], shorts: Iterable[str] | None = None):
+        """Raises if a spec (of shorts, default: all) does not name one of the tiers"""
+        for short in (shorts if shorts is not None else self.refs):
+            self.refs[short].tier(tiers)
+    def tier(self, short: str, filename_tiers: dict[str, str]) -> str:
+        tier = self._tiers_of(filename_tiers.keys())[short]
+        if tier is None:
+            self.refs[short].tier(filename_tiers.keys()) # raises
+        return tier
+    def filename(self, short: str, filename_tiers: dict[str, str]) -> str:
+        return filename_tiers[self.tier(short, filename_tiers)]
+    def n_rows(self, short: str, filename_tiers: dict[str, str]) -> int:
+        return _lh5().read_n_rows(self.refs[short].spec, self.pool.get(self.filename(short, filename_tiers)))
+    def read(self, shorts: list[str], filename_tiers: dict[str, str],
+             kwargs: dict[str, dict[str, Any]] | None = None) -> dict[str, ak.Array]:
+        """Reads the arrays of shorts; kwargs: read arguments (start_row, n_rows, idx) per short"""
+        arrays = {}
+        for batch in self.plan(shorts, filename_tiers, kwargs):
+            arrays.update(self.read_batch(batch))
+        return {short: arrays[short] for short in shorts}
+    def plan(self, shorts: list[str], filename_tiers: dict[str, str],
+             kwargs: dict[str, dict[str, Any]] | None = None) -> list["ReadBatch"]:
+        """Groups the shorts into batches: fields of the same table (with the same read arguments)"""
+        kwargs = kwargs or {}
+        batches = {}
+        for short in shorts:
+            read_kwargs = kwargs.get(short, {})
+            key = (self.filename(short, filename_tiers), self.refs[short].group, _kwargs_key(read_kwargs))
+            if key not in batches:
+                batches[key] = ReadBatch(key[0], key[1], [], read_kwargs)
+            batches[key].shorts.append(short)
+        return list(batches.values())
+    def read_batch(self, batch: "ReadBatch") -> dict[str, ak.Array]:
+        h5file = self.pool.get(batch.filename)
+        if len(batch.shorts) > 1:
+            try:
+                table = _lh5().read(batch.group, h5file, field_mask=[self.refs[short].field for short in batch.shorts], 
+                             **batch.kwargs)
+                return {short: table[self.refs[short].field].view_as("ak") for short in batch.shorts}
+            except Exception: # not a table after all: read one by one (and report errors from there)
+                pass
+        arrays = {}
+        for short in batch.shorts:
+            try:
+                arrays[short] = _lh5().read(self.refs[short].spec, h5file, **batch.kwargs).view_as("ak")
+            except KeyError as e:
+                raise KeyError(f"Cannot find {self.refs[short].spec} in file.") from e
+        return arrays
+    def close(self):
+        self.pool.close()
+    def _tiers_of(self, tiers: Iterable[str]) -> dict[str, str]:
+        key = frozenset(tiers)
+        if key not in self._tiers:
+            self._tiers[key] = {short: ref.tier(key) if ref.parts[0] in key or ref.parts[1] in key else None
+                                for short, ref in self.refs.items()}
+        return self._tiers[key]
+
+# PRIVATE
+
+def _lh5():
+    """lgdo.lh5, imported at the first read (it is slow to import)"""
+    from lgdo import lh5
+    return lh5
+
+def _kwargs_key(kwargs: dict[str, Any]) -> tuple:
+    return tuple((name, id(value) if hasattr(value, "__len__") else value) for name, value in sorted(kwargs.items()))
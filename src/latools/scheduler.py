@@ -0,0 +1,76 @@
+from collections.abc import Callable
+import awkward as ak
+
+class ArrayGraph:
+    """Dependency graph of the arrays of main_loop / compile_arrays, built from the shortnames.
+    Knows which input arrays have to be read and which generators have to run for the given consumers
+    (outDef inputs), after which step an array is not needed any more, and which generators are
+    independent of each other (levels)."""
+    def __init__(self, inputArraysDef: list[tuple[str, str]],
+                 genArrayDef: list[tuple[list[str], str, Callable[[list[ak.Array]], ak.Array]]],
+                 consumers: list[list[str]] | None, reducer_inputs: list[str] | None = None):
+        """consumers: input shortnames of each consumer (outDef task); None -> every array is a result
+        (as in compile_arrays), so nothing gets pruned or released.
+        reducer_inputs: input shortnames of the pre_reducer step (pre_reducer and crop)"""
+        reducer_inputs = reducer_inputs or []
+        input_names = [short for short, _ in inputArraysDef]
+        for short in reducer_inputs:
+            if short not in input_names:
+                raise KeyError(f"pre_reducer input {short} is not in inputArraysDef")
+        if consumers is None:
+            kept_gens = list(range(len(genArrayDef)))
+            needed = set(input_names)
+        else: # walk backwards from the consumers
+            needed = set().union(*consumers)
+            kept_gens = []
+            for i in reversed(range(len(genArrayDef))):
+                inputs, output, _ = genArrayDef[i]
+                if output in needed:
+                    kept_gens.insert(0, i)
+                    needed.discard(output)
+                    needed.update(inputs)
+            needed.update(reducer_inputs)
+            unknown = needed.difference(input_names)
+            if unknown:
+                raise KeyError(f"Arrays {sorted(unknown)} are neither in inputArraysDef nor generated before use")
+        self.inputArraysDef = [(short, spec) for short, spec in inputArraysDef if short in needed]
+        self.genArrayDef = [genArrayDef[i] for i in kept_gens]
+        self._build_levels(input_names)
+        self._build_releases(consumers, reducer_inputs)
+    def _build_levels(self, input_names: list[str]):
+        """Groups the generators into levels; generators of a level only depend on earlier levels"""
+        outputs = [output for _, output, _ in self.genArrayDef]
+        # redefined shortnames make the order matter beyond the data flow
+        self.parallelizable = len(set(outputs)) == len(outputs) and not set(outputs).intersection(input_names)
+        level_of = {} # output shortname -> level
+        self.levels: list[list[int]] = []
+        for i, (inputs, output, _) in enumerate(self.genArrayDef):
+            level = max((level_of[short] + 1 for short in inputs if short in level_of), default=0)
+            level_of[output] = level
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].append(i)
+    def _build_releases(self, consumers: list[list[str]] | None, reducer_inputs: list[str]):
+        """After which step (pre_reducer, generator i, consumer i) each array is not used any more"""
+        self.release_after_reducer: list[str] = []
+        self.release_after_gen: list[list[str]] = [[] for _ in self.genArrayDef]
+        self.release_after_consumer: list[list[str]] = [[] for _ in (consumers or [])]
+        if consumers is None:
+            return
+        last_use = {short: ("reducer", 0) for short, _ in self.inputArraysDef}
+        for i, (inputs, output, _) in enumerate(self.genArrayDef):
+            last_use.setdefault(output, ("gen", i))
+            for short in inputs:
+                last_use[short] = ("gen", i)
+        for i, inputs in enumerate(consumers):
+            for short in inputs:
+                last_use[short] = ("consumer", i)
+        for short, (step, i) in last_use.items():
+            if step == "reducer":
+                self.release_after_reducer.append(short)
+            elif step == "gen":
+                self.release_after_gen[i].append(short)
+            else:
+                self.release_after_consumer[i].append(short)
+    def release_after_level(self, level: int) -> list[str]:
+        return [short for i in self.levels[level] for short in self.release_after_gen[i]]
@@ -1,8 +1,27 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 from dataclasses import dataclass
+import os
 import re
+import logging
 
-from lgdo.types.vectorofvectors import VectorOfVectors
+if TYPE_CHECKING: # lgdo is slow to import
+    from lgdo.types.vectorofvectors import VectorOfVectors
+
+_logger = logging.getLogger(__name__)
+
+class FileRef(str):
+    """Filename as passed to the outDef functions of main_loop. If the arrays do not hold all rows of the
+    file (e.g. reduced or chunked reading), entries holds the file entry of every row."""
+    def __new__(cls, filename: str, entries: np.ndarray | None = None):
+        self = super().__new__(cls, filename)
+        self.entries = entries
+        return self
+    def to_file_entries(self, rows: np.ndarray) -> np.ndarray:
+        return rows if self.entries is None else self.entries[rows]
 
 @dataclass
 class DetectorSystem:
@@ -16,27 +35,154 @@ def get_detector_system_for_channelname(channelname: str) -> DetectorSystem:
         return DetectorSystem("geds", "waveform_presummed")
     return DetectorSystem("useless", "NO_WAVEFORM")
 
+class ChannelIndex:
+    """Lookup tables between rawids, channel names and detector systems of a channelmap
+    (from LegendMetadata.channelmap), built once (later changes of the channelmap are not reflected).
+    The *_of methods work on whole arrays."""
+    def __init__(self, channelmap):
+        self.names = list(channelmap.keys())
+        self.rawids = np.array([channelmap[key].daq.rawid for key in self.names], dtype=np.int64)
+        self.systems = [get_detector_system_for_channelname(key) for key in self.names]
+        self.name_to_rawid = dict(zip(self.names, self.rawids.tolist()))
+        self.rawid_to_name = {}
+        for rawid, key in zip(self.rawids.tolist(), self.names):
+            self.rawid_to_name.setdefault(rawid, key) # first one wins (as the channelmap scan did)
+        self._position_of_name = {key: i for i, key in enumerate(self.names)}
+        self._names = np.array(self.names, dtype=object)
+        self._system_names = np.array([system.name for system in self.systems], dtype=object)
+        self._order = np.argsort(self.rawids, kind="stable")
+        self._sorted_rawids = self.rawids[self._order]
+    def __len__(self):
+        return len(self.names)
+    def name(self, rawid: int) -> str:
+        try:
+            return self.rawid_to_name[int(rawid)]
+        except KeyError:
+            raise RuntimeError(f"Could not find rawid {rawid}") from None
+    def rawid(self, name: str) -> int:
+        return self.name_to_rawid[name]
+    def system(self, name: str) -> DetectorSystem:
+        return self.systems[self._position_of_name[name]]
+    def positions_of(self, rawids) -> np.ndarray:
+        """Position (in self.names) of every rawid; -1 for unknown rawids"""
+        rawids = np.asarray(rawids, dtype=np.int64)
+        if len(self._sorted_rawids) == 0:
+            return np.full(rawids.shape, -1, dtype=np.int64)
+        idx = np.clip(np.searchsorted(self._sorted_rawids, rawids), 0, len(self._sorted_rawids) - 1)
+        return np.where(self._sorted_rawids[idx] == rawids, self._order[idx], -1)
+    def names_of(self, rawids) -> np.ndarray:
+        """Channel name of every rawid (None for unknown rawids)"""
+        positions = self.positions_of(rawids)
+        return np.where(positions >= 0, self._names[positions], None)
+    def rawids_of(self, names) -> np.ndarray:
+        return np.array([self.name_to_rawid[name] for name in names], dtype=np.int64)
+    def system_names_of(self, rawids) -> np.ndarray:
+        """Detector system name of every rawid (None for unknown rawids)"""
+        positions = self.positions_of(rawids)
+        return np.where(positions >= 0, self._system_names[positions], None)
+    def keys_in_system(self, detector_system: str) -> list[str]:
+        return [key for key, system in zip(self.names, self._system_names) if system == detector_system]
+    def filtered_keys_in_system(self, detector_system: str, rawids_to_use) -> list[str]:
+        use = np.isin(self.rawids, np.asarray(rawids_to_use, dtype=np.int64))
+        return [key for key, system, ok in zip(self.names, self._system_names, use) if ok and system == detector_system]
+
+_channel_indices: OrderedDict[int, tuple] = OrderedDict() # id(channelmap) -> (channelmap, index), least recently used first
+_CHANNEL_INDICES_KEPT = 8 # keeping the channelmap keeps its id unique; only the last few are kept
+
+def get_channel_index(channelmap) -> ChannelIndex:
+    """The ChannelIndex of channelmap (built at the first call; the indices of the last few channelmaps are kept).
+    Passing a ChannelIndex returns it. A channelmap must not be changed after it got indexed: the index
+    would not notice."""
+    if isinstance(channelmap, ChannelIndex):
+        return channelmap
+    cached = _channel_indices.get(id(channelmap))
+    if cached is None:
+        cached = _channel_indices[id(channelmap)] = (channelmap, ChannelIndex(channelmap))
+        while len(_channel_indices) > _CHANNEL_INDICES_KEPT:
+            _channel_indices.popitem(last=False)
+    else:
+        _channel_indices.move_to_end(id(channelmap))
+    return cached[1]
+
 def get_keys_in_detectorsystem(channelmap, detector_system: str) -> list[str]:
-    return [key for key in channelmap if get_detector_system_for_channelname(key).name == detector_system]
+    return get_channel_index(channelmap).keys_in_system(detector_system)
 
 def get_filtered_keys_in_detectorsystem(channelmap, detector_system: str, rawids_to_use: list[int]) -> list[str]:
-    return [key for key in channelmap if (get_detector_system_for_channelname(key).name == detector_system and channelmap[key].daq.rawid in rawids_to_use)]
+    return get_channel_index(channelmap).filtered_keys_in_system(detector_system, rawids_to_use)
 
 def get_key_for_rawid(channelmap, rawid: int) -> str:
-    for key in channelmap.keys():
-        if channelmap[key].daq.rawid == rawid:
-            return key
-    raise RuntimeError(f"Could not find rawid {rawid}")
+    return get_channel_index(channelmap).name(rawid)
 
 # deprecated; use LegendMetadata now!
-def map_detector_name_to_rawid(detector_names: VectorOfVectors, rawids: VectorOfVectors, prev_map: dict[bytes, np.uint32] = {}) -> dict[bytes, np.uint32]:
-    this_map = prev_map.copy()
-    for det_row, raw_row in zip(detector_names, rawids):
-        for det, raw in zip(det_row, raw_row):
-            this_map[det] = raw
-            #print(det, raw)
+def map_detector_name_to_rawid(detector_names: VectorOfVectors, rawids: VectorOfVectors,
+                               prev_map: dict[bytes, np.uint32] | None = None, *,
+                               on_conflict: str = "warn") -> dict[bytes, np.uint32]:
+    """Adds the (detector name, rawid) pairs of two parallel VectorOfVectors (e.g. of an evt file) to prev_map
+    (updated in place, so it accumulates over files; None: a new dict) and returns it.
+    A name seen with another rawid than before is a conflict: on_conflict "warn" (log it; the last rawid wins),
+    "raise" (ValueError) or "ignore" (the last rawid wins)."""
+    if on_conflict not in ("warn", "raise", "ignore"):
+        raise ValueError(f"on_conflict must be 'warn', 'raise' or 'ignore', not {on_conflict!r}")
+    this_map = prev_map if prev_map is not None else {}
+    names, raws = _paired_flat(detector_names, rawids)
+    if len(names) == 0:
+        return this_map
+    # unique (name, rawid) pairs, sorted by name code and rawid; per name the pair occurring last wins
+    unique_names, codes = np.unique(names, return_inverse=True)
+    order = np.lexsort((raws, codes))
+    codes, sorted_raws = codes[order], raws[order]
+    pair_starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (sorted_raws[1:] != sorted_raws[:-1])])
+    pair_names, pair_raws = unique_names[codes[pair_starts]], sorted_raws[pair_starts]
+    last = np.maximum.reduceat(order, pair_starts)
+    conflicts = {}
+    starts = np.flatnonzero(np.r_[True, pair_names[1:] != pair_names[:-1]])
+    for start, stop in zip(starts, np.r_[starts[1:], len(pair_starts)]):
+        name = pair_names[start]
+        winner = start + np.argmax(last[start:stop])
+        rawid = pair_raws[winner]
+        previous = this_map.get(name)
+        if stop - start > 1 or (previous is not None and previous != rawid):
+            seen = {int(raw) for raw in pair_raws[start:stop]} | ({int(previous)} if previous is not None else set())
+            conflicts[name] = sorted(seen)
+        this_map[name] = rawid
+    if conflicts and on_conflict != "ignore":
+        message = "Conflicting rawids for detector names: " + ", ".join(
+            f"{name.decode(errors='replace')}: {raws}" for name, raws in conflicts.items())
+        if on_conflict == "raise":
+            raise ValueError(message)
+        _logger.warning(message)
     return this_map
 
 def get_timestamp_from_filename(filename: str) -> str | None:
     match = re.search(r"\d{8}T\d{6}Z", filename)
-    return match.group(0) if match else None
\ No newline at end of file
+    return match.group(0) if match else None
+
+@contextmanager
+def atomic_write(path: str, mode: str = "wb"):
+    """File object to write path with: written to a temporary file, which replaces path at the end. Readers 
+    (also other processes) never see half a file, and a crash while writing keeps the previous one."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _paired_flat(detector_names: VectorOfVectors, rawids: VectorOfVectors) -> tuple[np.ndarray, np.ndarray]:
+    """The flattened names and rawids, element i of row j paired with element i of row j
+    (rows of different lengths: the extra elements are dropped)"""
+    names = np.asarray(detector_names.flattened_data.nda)
+    raws = np.asarray(rawids.flattened_data.nda)
+    name_ends = np.asarray(detector_names.cumulative_length.nda, dtype=np.int64)
+    raw_ends = np.asarray(rawids.cumulative_length.nda, dtype=np.int64)
+    if len(name_ends) != len(raw_ends):
+        raise ValueError(f"detector_names has {len(name_ends)} rows, rawids {len(raw_ends)}")
+    names, raws = names[:name_ends[-1] if len(name_ends) else 0], raws[:raw_ends[-1] if len(raw_ends) else 0]
+    if np.array_equal(name_ends, raw_ends):
+        return names, raws
+    name_starts, raw_starts = np.r_[0, name_ends[:-1]], np.r_[0, raw_ends[:-1]]
+    lengths = np.minimum(name_ends - name_starts, raw_ends - raw_starts)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return names[np.repeat(name_starts, lengths) + offsets], raws[np.repeat(raw_starts, lengths) + offsets]
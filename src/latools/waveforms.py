@@ -0,0 +1,124 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import os
+import threading
+import numpy as np
+if TYPE_CHECKING: # lgdo is imported only when reading
+    from lgdo import Table
+
+@dataclass
+class _Waveforms:
+    """Waveforms of some (sorted, unique) entries of one waveform table in a file"""
+    entries: np.ndarray
+    t0: np.ndarray
+    dt: np.ndarray
+    values: np.ndarray # (entries, samples)
+    units: dict[str, str | None]
+    @property
+    def nbytes(self) -> int:
+        return self.entries.nbytes + self.t0.nbytes + self.dt.nbytes + self.values.nbytes
+    def positions(self, entries: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.entries, entries)
+    def merged(self, other: "_Waveforms") -> "_Waveforms":
+        order = np.argsort(np.concatenate([self.entries, other.entries]), kind="stable")
+        return _Waveforms(*(np.concatenate([mine, theirs])[order] for mine, theirs in
+                            [(self.entries, other.entries), (self.t0, other.t0), (self.dt, other.dt),
+                             (self.values, other.values)]), self.units)
+
+class WaveformCache:
+    """Bounded (LRU, by bytes) cache of raw waveforms per (file, lh5 group, waveform name), filled by
+    background threads: prefetch() queues the reading of entries (grouped per file, sorted), get() / table()
+    return them, reading only what is not cached (yet). A block larger than max_bytes is returned but not kept.
+    Prefetching only happens in the process which created the cache (so not in forked main_loop workers)."""
+    def __init__(self, max_bytes: int = 256 << 20, threads: int = 1):
+        self.max_bytes = max_bytes
+        self.threads = threads
+        self.nbytes = 0
+        self._blocks: OrderedDict[tuple, _Waveforms] = OrderedDict()
+        self._pending: dict[tuple, list[Future]] = {}
+        self._lock = threading.RLock()
+        self._pool = None
+        self._pid = os.getpid()
+    def prefetch(self, filename: str, group: str, wf_name: str, entries):
+        if os.getpid() != self._pid or len(entries) == 0:
+            return
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        key = (filename, group, wf_name)
+        future = self._pool.submit(self._load, key, np.asarray(entries))
+        with self._lock:
+            self._pending.setdefault(key, []).append(future)
+    def get(self, filename: str, group: str, wf_name: str, entries) -> _Waveforms:
+        """Waveforms of entries (in the given order)"""
+        key = (filename, group, wf_name)
+        entries = np.asarray(entries, dtype=np.int64)
+        with self._lock:
+            pending = self._pending.pop(key, [])
+        for future in pending: # wait; a failed prefetch is retried (and raises) below
+            future.exception()
+        block = self._load(key, entries)
+        positions = block.positions(entries)
+        return _Waveforms(entries, block.t0[positions], block.dt[positions], block.values[positions], block.units)
+    def table(self, files: list[str], entries: list, group: str, wf_name: str) -> Table:
+        """lgdo Table with the waveforms of entries[i] of files[i], concatenated (e.g. for a WaveformBrowser)"""
+        from lgdo import Table, WaveformTable # only needed when drawing
+        parts = [self.get(filename, group, wf_name, file_entries) for filename, file_entries in zip(files, entries)]
+        units = parts[0].units if parts else {}
+        values = np.concatenate([part.values for part in parts]) if parts else np.zeros((0, 0))
+        waveforms = WaveformTable(t0=np.concatenate([part.t0 for part in parts]) if parts else np.zeros(0),
+                                  t0_units=units.get("t0"),
+                                  dt=np.concatenate([part.dt for part in parts]) if parts else np.zeros(0),
+                                  dt_units=units.get("dt"), values=values, values_units=units.get("values"))
+        return Table(col_dict={wf_name: waveforms})
+    def __getstate__(self):
+        """Copies (e.g. shipped to the workers of an executor) start empty and do not prefetch"""
+        return {"max_bytes": self.max_bytes, "threads": self.threads}
+    def __setstate__(self, state):
+        self.__init__(**state)
+        self._pid = None
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+    def _load(self, key: tuple, entries: np.ndarray) -> _Waveforms:
+        """Makes sure all entries of key are cached; returns the block holding them (not kept if too large)"""
+        with self._lock:
+            block = self._blocks.get(key)
+        missing = np.unique(entries)
+        if block is not None:
+            missing = missing[~np.isin(missing, block.entries)]
+        if len(missing) > 0:
+            filename, group, wf_name = key
+            new = _read_waveforms(filename, f"{group}/{wf_name}", missing)
+            with self._lock:
+                cached = self._blocks.get(key) # might have changed meanwhile
+                if cached is not None:
+                    new = _Waveforms(*(part[~np.isin(new.entries, cached.entries)] for part in
+                                       (new.entries, new.t0, new.dt, new.values)), new.units)
+                    block = cached.merged(new)
+                else:
+                    block = new
+                if block.nbytes <= self.max_bytes: # else the cache would not be bounded
+                    if cached is not None:
+                        self.nbytes -= cached.nbytes
+                    self._blocks[key] = block
+                    self.nbytes += block.nbytes
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+            while self.nbytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return block
+
+def _read_waveforms(filename: str, name: str, entries: np.ndarray) -> _Waveforms:
+    from lgdo import WaveformTable
+    from lgdo.lh5 import read
+    wf = read(name, filename, idx=entries)
+    if not isinstance(wf, WaveformTable):
+        raise TypeError(f"{name} in {filename} is no waveform table")
+    return _Waveforms(entries, wf.t0.nda, wf.dt.nda, np.asarray(wf.values.nda),
+                      {"t0": wf.t0_units, "dt": wf.dt_units, "values": wf.values.attrs.get("units")})
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="session")
+def lh5_files(tmp_path_factory) -> list[dict[str, str]]:
+    """tier_filename_dicts of four small raw files (table ch1027201/raw: energy, baseline)"""
+    from lgdo import Array, Table, lh5
+    directory = tmp_path_factory.mktemp("data")
+    rng = np.random.default_rng(0)
+    files = []
+    for i in range(4):
+        n = 1000 + 100 * i
+        filename = str(directory / f"l200-p03-r000-phy-20230101T0{i}0000Z-tier_raw.lh5")
+        table = Table(col_dict={"energy": Array(rng.integers(0, 1000, n).astype(np.float64)),
+                                "baseline": Array(rng.normal(100, 5, n))})
+        lh5.write(table, "ch1027201/raw", filename, wo_mode="of")
+        files.append({"raw": filename})
+    return files
@@ -0,0 +1,19 @@
+"""main_loop runs shared by the tests"""
+from latools.core import main_loop
+from latools.counter import CountTask
+from latools.histogram import HistogramTask
+
+INPUTS = [("e", "ch1027201/raw/energy")]
+
+def count_and_hist(min_entries_required=None):
+    return CountTask(lambda x: x[0] > 500, min_entries_required=min_entries_required), HistogramTask(0, 1000, 50)
+
+def run(files, count, hist, **kwargs):
+    outDef = [(["e"], count)] if hist is None else [(["e"], count), (["e"], hist)]
+    main_loop(INPUTS, [], outDef, tier_filename_dict=files, **kwargs)
+
+def full_result(files):
+    """(counter, flow_hist) of a plain run over files"""
+    count, hist = count_and_hist()
+    run(files, count, hist)
+    return count.counter, hist.flow_hist.copy()
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+import awkward as ak
+import pytest
+from latools.browse import BrowseAnydetTask, BrowseTask
+from latools.cache import function_hash
+
+def _channelmap(rawids: dict[str, int]) -> dict:
+    return {name: SimpleNamespace(daq=SimpleNamespace(rawid=rawid)) for name, rawid in rawids.items()}
+
+def _anydet_task(**kwargs) -> BrowseAnydetTask:
+    task = BrowseAnydetTask(lambda x: x[0], channelmap=_channelmap({"V01": 1, "V02": 2, "V03": 3}), max_entries=2,
+                            prefetch=False, **kwargs)
+    task.initialize()
+    task([ak.Array([[1, 2], [], [2], [3, 2]])], "file-tier_raw.lh5")
+    return task
+
+def test_anydet_draw_keeps_the_definition(monkeypatch):
+    shown = []
+    monkeypatch.setattr(BrowseTask, "_draw", lambda self, files, entries, nr_entries, *args: shown.append(args[1]))
+    task = _anydet_task(blacklist=["V01"], order="frequency")
+    before = function_hash(task)
+    task.draw()
+    task.draw()
+    assert shown == ["V02", "V03"]
+    assert task.blacklist == ["V01"]
+    assert function_hash(task) == before
+
+@pytest.mark.parametrize("order, cycle, blacklist, expected", [("frequency", 1, [], {"V02": [0, 2]}),
+                                                               ("first", 2, [], {"V01": [0], "V02": [0, 2]}),
+                                                               ("first", 1, ["V01"], {"V02": [0, 2]})])
+def test_anydet_prefetches_only_the_next_detectors(monkeypatch, order, cycle, blacklist, expected):
+    monkeypatch.setattr("latools.browse.is_headless", lambda: False)
+    prefetched = {}
+    cache = SimpleNamespace(prefetch=lambda filename, group, wf_name, entries:
+                            prefetched.setdefault(group.split("/")[1], []).extend(entries))
+    task = BrowseAnydetTask(lambda x: x[0], channelmap=_channelmap({"V01": 1, "V02": 2, "V03": 3}), max_entries=2,
+                            order=order, cycle=cycle, blacklist=blacklist, waveform_cache=cache)
+    task.initialize()
+    task([ak.Array([[1, 2], [], [2], [3, 2]])], "file-tier_raw.lh5")
+    assert prefetched == expected
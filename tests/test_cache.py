@@ -0,0 +1,50 @@
+import numpy as np
+import awkward as ak
+from latools.cache import function_hash
+
+CALIBRATION = {"a": 1.0}
+MASK = np.array([1, 2, 3])
+
+def _calibrate(x):
+    return x * CALIBRATION["a"] + MASK
+
+def test_function_hash_covers_container_globals():
+    before = function_hash(_calibrate)
+    CALIBRATION["a"] = 2.0
+    after_dict = function_hash(_calibrate)
+    MASK[0] = 5
+    after_array = function_hash(_calibrate)
+    CALIBRATION["a"], MASK[0] = 1.0, 1
+    assert len({before, after_dict, after_array}) == 3
+    assert function_hash(_calibrate) == before
+
+def test_cached_selective_read_with_different_cuts(tmp_path):
+    from lgdo import Array, Table, lh5
+    from latools.cache import ArrayCache
+    from latools.core import main_loop
+    filename = str(tmp_path / "l200-p03-r000-phy-20230101T000000Z-tier_raw.lh5")
+    b = np.arange(5000, dtype=np.float64)
+    lh5.write(Table(col_dict={"b": Array(b), "c": Array(10 * b)}), "ch1027201/raw", filename, wo_mode="of")
+    cuts = [lambda x: x[0] % 2 == 0, # 2500 rows; the other cut has the same number, first and last row
+            lambda x: ((x[0] % 2 == 0) & (x[0] != 2000)) | (x[0] == 2001)]
+    cache = ArrayCache(str(tmp_path / "cache"))
+    for cut in cuts:
+        rows = []
+        main_loop([("b", "ch1027201/raw/b"), ("c", "ch1027201/raw/c")], [(["c"], "c2", lambda x: x[0] + 1), (["b"], "b2", lambda x: x[0] * 2)],
+                  [(["b", "c", "c2", "b2"], lambda x, _: rows.append([np.asarray(array) for array in x]))],
+                  tier_filename_dict=[{"raw": filename}], pre_reducer=(["b"], cut), selective_read=True, cache=cache)
+        selected_b, c, c2, b2 = rows[0]
+        np.testing.assert_array_equal(selected_b, b[np.asarray(cut([b]))])
+        np.testing.assert_array_equal(c, 10 * selected_b)
+        np.testing.assert_array_equal(c2, 10 * selected_b + 1)
+        np.testing.assert_array_equal(b2, 2 * selected_b) # generated from the pre_reducer input after the cut
+
+def test_derived_key_hashes_arrays_by_content():
+    from latools.cache import derived_key
+    values = np.arange(5000)
+    changed = values.copy()
+    changed[2500] = -1 # same repr (abbreviated)
+    assert repr(values) == repr(changed)
+    assert derived_key("take", values) != derived_key("take", changed)
+    assert derived_key("take", ak.Array(values)) != derived_key("take", ak.Array(changed))
+    assert derived_key("take", values) == derived_key("take", values.copy())
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from latools.checkpoint import Checkpoint, file_key
+from latools.histogram import HistogramTask
+from helpers import count_and_hist, run, full_result
+
+def test_resume_after_crash(lh5_files, tmp_path):
+    path = str(tmp_path / "checkpoint.pkl")
+    broken = lh5_files[:2] + [{"raw": str(tmp_path / "missing-tier_raw.lh5")}] + lh5_files[2:]
+    count, hist = count_and_hist()
+    with pytest.raises(Exception):
+        run(broken, count, hist, checkpoint=Checkpoint(path, every=1))
+    done = Checkpoint(path).load()["done"] # states and files saved together: the last file may be redone
+    assert 0 < len(done) and set(done) <= set(map(file_key, lh5_files[:2]))
+    count, hist = count_and_hist()
+    run(lh5_files, count, hist, checkpoint=path, resume=True)
+    expected_count, expected_hist = full_result(lh5_files)
+    assert count.counter == expected_count
+    np.testing.assert_array_equal(hist.flow_hist, expected_hist)
+
+def test_restore_rejects_other_definition(lh5_files, tmp_path):
+    path = str(tmp_path / "checkpoint.pkl")
+    count, hist = count_and_hist()
+    run(lh5_files[:1], count, hist, checkpoint=path)
+    count, _ = count_and_hist()
+    with pytest.raises(RuntimeError):
+        run(lh5_files, count, HistogramTask(0, 500, 50), checkpoint=path, resume=True)
@@ -0,0 +1,37 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.core import main_loop, compile_arrays, iter_compiled_arrays
+
+INPUTS = [("e", "ch1027201/raw/energy"), ("b", "ch1027201/raw/baseline")]
+GEN = [(["e", "b"], "d", lambda x: x[0] - x[1])]
+
+class _Chunks:
+    """Collects the file, file entries and energies of every call"""
+    def __init__(self):
+        self.calls = []
+    def __call__(self, x, raw):
+        self.calls.append((str(raw), raw.to_file_entries(np.arange(len(x[0]))), ak.to_numpy(x[0])))
+
+@pytest.mark.parametrize("chunk_size", [300, 1000, 5000])
+def test_chunks_map_to_file_entries(lh5_files, chunk_size):
+    from lgdo import lh5
+    collector = _Chunks()
+    main_loop(INPUTS, [], [(["e"], collector)], tier_filename_dict=lh5_files, chunk_size=chunk_size)
+    assert all(len(energy) <= chunk_size for _, _, energy in collector.calls)
+    for filename_tiers in lh5_files:
+        energy = lh5.read("ch1027201/raw/energy", filename_tiers["raw"]).nda
+        calls = [call for call in collector.calls if call[0] == filename_tiers["raw"]]
+        assert len(calls) == -(-len(energy) // chunk_size)
+        np.testing.assert_array_equal(np.concatenate([call[1] for call in calls]), np.arange(len(energy)))
+        np.testing.assert_array_equal(np.concatenate([call[2] for call in calls]), energy)
+
+def test_streamed_arrays_match_compiled(lh5_files):
+    expected = compile_arrays(INPUTS, GEN, tier_filename_dict=lh5_files)
+    chunks = list(iter_compiled_arrays(INPUTS, GEN, tier_filename_dict=lh5_files, chunk_size=300))
+    assert len(chunks) == sum(-(-(1000 + 100 * i) // 300) for i in range(len(lh5_files)))
+    for short in ["e", "b", "d"]:
+        np.testing.assert_array_equal(ak.to_numpy(ak.concatenate([chunk[short] for chunk in chunks])),
+                                      ak.to_numpy(expected[short]))
+    chunked = compile_arrays(INPUTS, GEN, tier_filename_dict=lh5_files, chunk_size=300)
+    np.testing.assert_array_equal(ak.to_numpy(chunked["d"]), ak.to_numpy(expected["d"]))
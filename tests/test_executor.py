@@ -0,0 +1,41 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.core import compile_arrays
+from latools.executor import ForkExecutor, SocketExecutor
+from helpers import INPUTS, count_and_hist, run, full_result
+
+def _scaled(context, item):
+    if item < 0:
+        raise ValueError("negative item")
+    return context * item
+
+@pytest.fixture(scope="module")
+def socket_executor():
+    with SocketExecutor(2) as executor:
+        yield executor
+
+def test_fork_executor_map():
+    with ForkExecutor(3) as executor:
+        assert list(executor.map(_scaled, 3, list(range(20)))) == [3 * i for i in range(20)]
+        assert list(executor.map(lambda context, item: context[item], {1: "a", 2: "b"}, [2, 1])) == ["b", "a"]
+
+def test_socket_executor_map(socket_executor):
+    assert list(socket_executor.map(_scaled, 3, list(range(20)))) == [3 * i for i in range(20)]
+    offset = 5 # lambdas and their captures are serialized by value
+    assert list(socket_executor.map(lambda context, item: context + item + offset, 1, [1, 2])) == [7, 8]
+    with pytest.raises(RuntimeError, match="negative item"):
+        list(socket_executor.map(_scaled, 3, [1, -1, 2]))
+    assert list(socket_executor.map(_scaled, 2, [4])) == [8] # still usable after an error
+
+@pytest.mark.parametrize("kind", ["fork", "socket"])
+def test_main_loop_with_executor_matches_serial(lh5_files, socket_executor, kind):
+    executor = ForkExecutor(2) if kind == "fork" else socket_executor
+    count, hist = count_and_hist()
+    run(lh5_files, count, hist, executor=executor)
+    expected_count, expected_hist = full_result(lh5_files)
+    assert count.counter == expected_count
+    np.testing.assert_array_equal(hist.flow_hist, expected_hist)
+    expected = compile_arrays(INPUTS, [], tier_filename_dict=lh5_files)
+    arrays = compile_arrays(INPUTS, [], tier_filename_dict=lh5_files, executor=executor)
+    np.testing.assert_array_equal(ak.to_numpy(arrays["e"]), ak.to_numpy(expected["e"]))
@@ -0,0 +1,25 @@
+import numpy as np
+import awkward as ak
+from latools.counter import CountTask
+from latools.export import load_results, save_results
+from latools.histogram import CategoricalHistogramTask, Histogram2DTask, HistogramTask
+
+def test_results_round_trip(tmp_path):
+    hist = HistogramTask(0, 10, 5)
+    hist2d = Histogram2DTask(0, 10, 4, 0, 1, 2)
+    categories = CategoricalHistogramTask(lambda x: x[0])
+    count = CountTask(lambda x: x[0] > 2)
+    values = ak.Array([1.0, 3.0, 3.5, 11.0])
+    for task, inputs in [(hist, [values]), (hist2d, [values, values / 10]), (categories, [ak.Array(["a", "b", "a"])]),
+                         (count, [values])]:
+        task.initialize()
+        task(inputs, None)
+    path = str(tmp_path / "results.npz")
+    save_results(path, {"hist": hist, "hist2d": hist2d, "categories": categories, "count": count})
+    results = load_results(path)
+    np.testing.assert_array_equal(results["hist"]["flow_hist"], hist.flow_hist)
+    np.testing.assert_array_equal(results["hist"]["edges"], hist.edges)
+    np.testing.assert_array_equal(results["hist2d"]["flow_hist"], hist2d.flow_hist)
+    assert results["hist"]["nr_entries"] == 4
+    assert dict(zip(results["categories"]["categories"], results["categories"]["counts"])) == {"a": 2, "b": 1}
+    assert results["count"] == {"counter": 3}
@@ -0,0 +1,62 @@
+import os
+import numpy as np
+from latools.fileindex import FileIndex
+
+def _write(directory, name: str, tier: str, n: int, group: str = "ch1027201") -> str:
+    from lgdo import Array, Table, lh5
+    os.makedirs(directory, exist_ok=True)
+    filename = str(directory / f"{name}-tier_{tier}.lh5")
+    lh5.write(Table(col_dict={"energy": Array(np.arange(n, dtype=np.float64))}), f"{group}/{tier}", filename,
+              wo_mode="of")
+    return filename
+
+def _files(tmp_path) -> dict[str, str]:
+    return {"raw0": _write(tmp_path / "raw", "l200-p03-r000-phy-20230101T000000Z", "raw", 10),
+            "dsp0": _write(tmp_path / "dsp", "l200-p03-r000-phy-20230101T000000Z", "dsp", 10),
+            "raw1": _write(tmp_path / "raw", "l200-p03-r001-cal-20230102T000000Z", "raw", 0),
+            "raw2": _write(tmp_path / "raw", "l200-p04-r000-phy-20230103T000000Z", "raw", 5, "ch1027202")}
+
+def test_scan_and_select(tmp_path):
+    files = _files(tmp_path)
+    index = FileIndex()
+    assert index.scan(str(tmp_path)) == 4
+    assert len(index) == 3
+    assert index.select() == [{"raw": files["raw0"], "dsp": files["dsp0"]}, {"raw": files["raw1"]},
+                              {"raw": files["raw2"]}]
+    assert index.select(tiers=["dsp"]) == [{"dsp": files["dsp0"]}]
+    assert index.select(tiers=["raw"], datatypes=["phy"]) == [{"raw": files["raw0"]}, {"raw": files["raw2"]}]
+    assert index.select(periods=["p03"], runs=["r001"]) == [{"raw": files["raw1"]}]
+    assert index.select(start="20230102T000000Z", stop="20230103T000000Z") == [{"raw": files["raw1"]}]
+    assert index.select(specs=["ch1027201/raw/energy"]) == [{"raw": files["raw0"], "dsp": files["dsp0"]},
+                                                             {"raw": files["raw1"]}]
+    assert index.select(specs=["ch1027201/raw/energy"], nonempty=True, tiers=["raw"]) == [{"raw": files["raw0"]}]
+    assert index.groups("raw") == {"ch1027201", "ch1027201/raw", "ch1027202", "ch1027202/raw"}
+
+def test_incremental_rescan(tmp_path):
+    files = _files(tmp_path)
+    path = str(tmp_path / "index.json")
+    assert FileIndex(path).scan(str(tmp_path)) == 4
+    index = FileIndex(path) # loaded from the file
+    assert len(index) == 3 and index.query(tiers=["dsp"])[0].rows("ch1027201/dsp/energy") == 10
+    assert index.scan(str(tmp_path)) == 0 # nothing changed
+    _write(tmp_path / "raw", "l200-p03-r000-phy-20230101T000000Z", "raw", 20) # changed
+    _write(tmp_path / "raw", "l200-p04-r001-phy-20230104T000000Z", "raw", 3) # new
+    assert index.scan(str(tmp_path)) == 2
+    assert index.query(tiers=["raw"])[0].rows("ch1027201/raw/energy") == 20
+    assert len(FileIndex(path)) == 4
+
+def test_drops_vanished_files(tmp_path):
+    files = _files(tmp_path)
+    index = FileIndex()
+    index.scan(str(tmp_path))
+    os.remove(files["dsp0"])
+    os.remove(files["raw1"])
+    assert index.scan(str(tmp_path)) == 0
+    assert index.select() == [{"raw": files["raw0"]}, {"raw": files["raw2"]}]
+    index.scan(str(tmp_path / "raw")) # files below other directories are kept
+    assert index.select() == [{"raw": files["raw0"]}, {"raw": files["raw2"]}]
+    os.remove(files["raw2"])
+    index.scan(str(tmp_path / "dsp"))
+    assert len(index) == 2
+    index.scan(str(tmp_path / "raw"))
+    assert index.select() == [{"raw": files["raw0"]}]
@@ -0,0 +1,112 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.histogram import (HistogramTask, Histogram2DTask, HistogramBankTask, CategoricalHistogramTask,
+                               CategoricalHistogram2DTask)
+
+def _tricky_values(lo: float, hi: float, nbins: int, rng) -> np.ndarray:
+    """Random values around [lo, hi], every edge and its neighbouring floats, inf and NaN"""
+    edges = np.linspace(lo, hi, nbins + 1)
+    return np.concatenate([rng.uniform(lo - 1, hi + 1, 5000), edges, np.nextafter(edges, -np.inf),
+                           np.nextafter(edges, np.inf), [-np.inf, np.inf, np.nan]])
+
+def _flow_indices(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Bin of every value as np.histogram assigns it, 0 / len(edges) for underflow / overflow, -1 for NaN"""
+    indices = np.searchsorted(edges, values, side="right")
+    indices[values == edges[-1]] = len(edges) - 1 # the last bin includes the upper edge
+    indices[np.isnan(values)] = -1
+    return indices
+
+@pytest.mark.parametrize("lo, hi, nbins", [(0, 1000, 1000), (-3.3, 7.1, 37), (0.1, 0.7, 3)])
+def test_histogram_1d_matches_np_histogram(lo, hi, nbins):
+    values = _tricky_values(lo, hi, nbins, np.random.default_rng(1))
+    task = HistogramTask(lo, hi, nbins)
+    task.initialize()
+    task([ak.Array(values)], None)
+    expected, _ = np.histogram(values[~np.isnan(values)], bins=nbins, range=(lo, hi))
+    np.testing.assert_array_equal(task.hist, expected)
+    assert task.underflow == np.count_nonzero(values < lo)
+    assert task.overflow == np.count_nonzero(values > hi)
+    assert task.flow_hist.dtype == np.int64
+
+def test_histogram_1d_weights_and_missing_values():
+    values = ak.Array([0.5, None, 1.5, -1.0, 2.0, 7.0])
+    weights = ak.Array([1.0, 10.0, 2.0, 3.0, 4.0, 5.0])
+    task = HistogramTask(0, 2, 2, fcn=lambda x: x[0], weight_fcn=lambda x: x[1])
+    task.initialize()
+    task([values, weights], None)
+    np.testing.assert_array_equal(task.flow_hist, [3.0, 1.0, 6.0, 5.0])
+
+@pytest.mark.parametrize("x_bins, y_bins", [((0, 1000, 100), (-5, 5, 7)), ((0.1, 0.7, 3), (0, 1, 1))])
+def test_histogram_2d_matches_np_histogram(x_bins, y_bins):
+    rng = np.random.default_rng(2)
+    x = _tricky_values(*x_bins, rng)
+    y = rng.permutation(np.resize(_tricky_values(*y_bins, rng), len(x)))
+    task = Histogram2DTask(*x_bins, *y_bins)
+    task.initialize()
+    task([ak.Array(x), ak.Array(y)], None)
+    x_indices, y_indices = _flow_indices(x, task.x_edges), _flow_indices(y, task.y_edges)
+    valid = (x_indices >= 0) & (y_indices >= 0)
+    expected = np.zeros(task.flow_hist.shape, dtype=np.int64)
+    np.add.at(expected, (x_indices[valid], y_indices[valid]), 1)
+    np.testing.assert_array_equal(task.flow_hist, expected)
+    inside = (x >= x_bins[0]) & (x <= x_bins[1]) & (y >= y_bins[0]) & (y <= y_bins[1])
+    hist2d, _, _ = np.histogram2d(x[inside], y[inside], bins=[x_bins[2], y_bins[2]], 
+                                  range=[x_bins[:2], y_bins[:2]])
+    np.testing.assert_array_equal(task.hist, hist2d)
+    assert task.flow_hist.dtype == np.int64
+    assert task.nr_entries == len(x)
+
+def test_histogram_bank_none_selector_not_selected():
+    values = ak.Array([0.5, 1.5, 0.5, 1.5])
+    selector = ak.Array([True, None, False, None])
+    bank = HistogramBankTask(0, 2, 2, selectors={"sel": lambda x: x[1], "all": lambda x: ak.ones_like(x[0], dtype=bool)})
+    bank.initialize()
+    bank([values, selector], None)
+    single = HistogramTask(0, 2, 2, fcn=lambda x: x[0][ak.fill_none(x[1], False)])
+    single.initialize()
+    single([values, selector], None)
+    np.testing.assert_array_equal(bank["sel"], single.hist)
+    np.testing.assert_array_equal(bank["sel"], [1, 0])
+    np.testing.assert_array_equal(bank["all"], [2, 2])
+    np.testing.assert_array_equal(bank.nr_entries, [1, 4])
+
+def test_histogram_bank_matches_single_histograms():
+    rng = np.random.default_rng(3)
+    values = rng.uniform(-1, 11, 10000)
+    keys = rng.integers(0, 4, len(values))
+    bank = HistogramBankTask(0, 10, 25, key_fcn=lambda x: x[1], keys=[2, 0, 1])
+    bank.initialize()
+    bank([ak.Array(values), ak.Array(keys)], None)
+    for name, key in zip(bank.names, [2, 0, 1]):
+        expected, _ = np.histogram(values[keys == key], bins=25, range=(0, 10))
+        np.testing.assert_array_equal(bank[name], expected)
+
+def test_categorical_tasks_skip_missing_values():
+    values = ak.mask(ak.Array([1, 2, 2, 3]), ak.Array([True, False, True, True]))
+    single = CategoricalHistogramTask(lambda x: x[0])
+    single.initialize()
+    single([values], None)
+    assert single.cats_dict == {1: 1, 2: 1, 3: 1}
+    assert single.nr_entries == 3
+    pairs = CategoricalHistogram2DTask(lambda x: x[0], lambda x: x[1])
+    pairs.initialize()
+    pairs([ak.Array([1, None, 2, 3]), ak.Array([5, 6, None, 5])], None)
+    assert {x: dict(y) for x, y in pairs.cats_dict.items()} == {1: {5: 1}, 3: {5: 1}}
+    assert pairs.nr_entries == 2
+    cartesian = CategoricalHistogram2DTask(lambda x: x[0], lambda x: x[1], mode="cartesian")
+    cartesian.initialize()
+    cartesian([ak.Array([[1, None], None, [2]]), ak.Array([[5], [6], [None, 7]])], None)
+    assert {x: dict(y) for x, y in cartesian.cats_dict.items()} == {1: {5: 1}, 2: {7: 1}}
+    assert cartesian.nr_entries == 2
+
+def test_categorical_with_pre_reducer(lh5_files):
+    from lgdo import lh5
+    from latools.core import main_loop
+    task = CategoricalHistogramTask(lambda x: x[0] // 100)
+    main_loop([("e", "ch1027201/raw/energy")], [], [(["e"], task)], tier_filename_dict=lh5_files,
+              pre_reducer=(["e"], lambda x: x[0] > 500)) # masks the other rows with None
+    energies = np.concatenate([lh5.read("ch1027201/raw/energy", f["raw"]).nda for f in lh5_files])
+    selected = energies[energies > 500] // 100
+    assert task.cats_dict == {key: int(np.count_nonzero(selected == key)) for key in np.unique(selected)}
+    assert task.nr_entries == len(selected)
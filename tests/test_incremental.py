@@ -0,0 +1,65 @@
+import logging
+import awkward as ak
+import numpy as np
+import pytest
+from latools.cache import function_hash
+from latools.checkpoint import Checkpoint, file_key
+from latools.histogram import HistogramTask
+from helpers import count_and_hist, run, full_result
+
+def test_incremental_adds_new_files_only(lh5_files, tmp_path):
+    path = str(tmp_path / "results.pkl")
+    count, hist = count_and_hist()
+    run(lh5_files[:2], count, hist, incremental=path)
+    assert (count.counter, hist.nr_entries) == (full_result(lh5_files[:2])[0], 2100)
+    run(lh5_files, count, hist, incremental=path) # the same objects again, two more files
+    expected_count, expected_hist = full_result(lh5_files)
+    assert count.counter == expected_count
+    np.testing.assert_array_equal(hist.flow_hist, expected_hist)
+    assert Checkpoint(path).load()["done"] == sorted(map(file_key, lh5_files))
+
+def test_incremental_rerun_keeps_results(lh5_files, tmp_path, caplog):
+    path = str(tmp_path / "results.pkl")
+    count, hist = count_and_hist()
+    for _ in range(3): # the filled objects must not look like a changed definition
+        with caplog.at_level(logging.WARNING):
+            run(lh5_files, count, hist, incremental=path)
+    assert "changed" not in caplog.text
+    expected_count, expected_hist = full_result(lh5_files)
+    assert count.counter == expected_count
+    np.testing.assert_array_equal(hist.flow_hist, expected_hist)
+    fresh_count, fresh_hist = count_and_hist() # new objects of the same definition
+    run(lh5_files, fresh_count, fresh_hist, incremental=path)
+    assert fresh_count.counter == expected_count
+
+def test_incremental_changed_definition_reprocesses(lh5_files, tmp_path, caplog):
+    path = str(tmp_path / "results.pkl")
+    count, hist = count_and_hist()
+    run(lh5_files, count, hist, incremental=path)
+    other_hist = HistogramTask(0, 1000, 20)
+    with caplog.at_level(logging.WARNING):
+        run(lh5_files, count, other_hist, incremental=path)
+    assert "changed" in caplog.text
+    assert count.counter == full_result(lh5_files)[0]
+    assert other_hist.nr_entries == sum(1000 + 100 * i for i in range(4))
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_incremental_early_stop_does_not_double_count(lh5_files, tmp_path, workers):
+    path = str(tmp_path / "results.pkl")
+    count, _ = count_and_hist(min_entries_required=700)
+    results = []
+    for _ in range(3):
+        run(lh5_files, count, None, incremental=path, workers=workers)
+        results.append(count.counter)
+    assert results[0] >= 700
+    assert results[0] < full_result(lh5_files)[0] # stopped early
+    assert results == [results[0]] * 3
+    assert Checkpoint(path).load()["stopped"]
+
+def test_function_hash_of_task_ignores_filled_state():
+    task = HistogramTask(0, 10, 5)
+    before = function_hash(task)
+    task.initialize()
+    task([ak.Array([1.0, 2.0])], None)
+    assert function_hash(task) == before
+    assert function_hash(HistogramTask(0, 10, 6)) != before
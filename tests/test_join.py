@@ -0,0 +1,58 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.core import main_loop, compile_arrays
+
+def _write(filename: str, group: str, **columns):
+    from lgdo import Array, Table, lh5
+    lh5.write(Table(col_dict={name: Array(values) for name, values in columns.items()}), group, filename, wo_mode="of")
+
+def _energy(filename: str) -> np.ndarray:
+    from lgdo import lh5
+    return lh5.read("ch1027201/raw/energy", filename).nda
+
+class _Calls:
+    def __init__(self):
+        self.calls = []
+    def __call__(self, x, raw):
+        self.calls.append((getattr(raw, "entries", None), *map(ak.to_numpy, x)))
+
+@pytest.mark.parametrize("chunk_size", [None, 70])
+def test_join_on_reads_the_joined_entries(lh5_files, tmp_path, chunk_size):
+    raw = lh5_files[0]["raw"]
+    index = np.random.default_rng(3).integers(0, len(_energy(raw)), 200) # unsorted, with repeated entries
+    evt = str(tmp_path / "l200-p03-r000-phy-20230101T000000Z-tier_evt.lh5")
+    _write(evt, "evt", raw_entry=index, number=np.arange(len(index)))
+    collector = _Calls()
+    main_loop([("i", "evt/raw_entry"), ("n", "evt/number"), ("e", "ch1027201/raw/energy")], [],
+              [(["n", "e"], collector)], tier_filename_dict=[{"raw": raw, "evt": evt}], join_on="i",
+              chunk_size=chunk_size)
+    entries, numbers, energies = (np.concatenate(column) for column in zip(*collector.calls))
+    np.testing.assert_array_equal(numbers, np.arange(len(index)))
+    np.testing.assert_array_equal(entries, index) # FileRef entries: the joined raw entries
+    np.testing.assert_array_equal(energies, _energy(raw)[index])
+
+def test_join_on_rejects_crop_and_selective_read(lh5_files):
+    inputs = [("i", "evt/raw_entry"), ("e", "ch1027201/raw/energy")]
+    with pytest.raises(ValueError):
+        main_loop(inputs, [], [], tier_filename_dict=lh5_files, join_on="i", crop=True)
+    with pytest.raises(ValueError):
+        main_loop(inputs, [], [], tier_filename_dict=lh5_files, join_on="i", selective_read=True,
+                  pre_reducer=(["e"], lambda x: x[0] > 0))
+    with pytest.raises(ValueError):
+        main_loop(inputs, [], [], tier_filename_dict=lh5_files, join_on="x")
+
+@pytest.mark.parametrize("chunk_size", [None, 70])
+def test_crop_to_the_shortest_table(lh5_files, tmp_path, chunk_size):
+    raw = lh5_files[1]["raw"]
+    dsp = str(tmp_path / "l200-p03-r000-phy-20230101T010000Z-tier_dsp.lh5")
+    _write(dsp, "ch1027201/dsp", cuspEmax=np.arange(250, dtype=np.float64))
+    inputs = [("e", "ch1027201/raw/energy"), ("c", "ch1027201/dsp/cuspEmax")]
+    collector = _Calls()
+    main_loop(inputs, [], [(["e", "c"], collector)], tier_filename_dict=[{"raw": raw, "dsp": dsp}], crop=True,
+              chunk_size=chunk_size)
+    energies, cusps = (np.concatenate(column) for column in list(zip(*collector.calls))[1:])
+    np.testing.assert_array_equal(energies, _energy(raw)[:250])
+    np.testing.assert_array_equal(cusps, np.arange(250))
+    arrays = compile_arrays(inputs, [], tier_filename_dict=[{"raw": raw, "dsp": dsp}], crop=True)
+    assert len(arrays["e"]) == len(arrays["c"]) == 250
@@ -0,0 +1,56 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.core import compile_arrays
+from latools.lazy import ChunkStore, LazyArray
+
+def _lazy(file_lengths: list[int], chunk_size: int, computed: list) -> tuple[LazyArray, np.ndarray]:
+    """LazyArray over rows numbered through all files; computed collects the (file, start, stop) computed"""
+    starts = np.concatenate([[0], np.cumsum(file_lengths)])
+    def compute(file_index: int, start: int, stop: int) -> ak.Array:
+        computed.append((file_index, start, stop))
+        return ak.Array(np.arange(starts[file_index] + start, starts[file_index] + stop))
+    return LazyArray("x", file_lengths, chunk_size, compute, ChunkStore(1 << 20)), np.arange(starts[-1])
+
+@pytest.mark.parametrize("key", [5, -1, slice(None), slice(3, 40, 7), slice(None, None, -3), [0, 33, 12, 12, -2],
+                                 np.array([], dtype=np.int64)])
+def test_indexing_matches_numpy(key):
+    lazy, expected = _lazy([25, 0, 17, 30], 10, [])
+    np.testing.assert_array_equal(ak.to_numpy(lazy[key]) if not isinstance(key, int) else lazy[key], expected[key])
+
+def test_mask_and_tuple_indexing():
+    lazy, expected = _lazy([25, 17], 10, [])
+    mask = expected % 3 == 0
+    np.testing.assert_array_equal(ak.to_numpy(lazy[mask]), expected[mask])
+    np.testing.assert_array_equal(ak.to_numpy(lazy[ak.Array(mask)]), expected[mask])
+    with pytest.raises(IndexError):
+        lazy[mask[:-1]]
+    with pytest.raises(IndexError):
+        lazy[len(expected)]
+    with pytest.raises(TypeError):
+        lazy["field"]
+    nested = LazyArray("y", [4], 2, lambda f, start, stop: ak.Array([[i, i + 1] for i in range(start, stop)]),
+                       ChunkStore(1 << 20))
+    assert ak.to_list(nested[1:3, 1]) == [2, 3]
+    assert nested[2, 0] == 2
+
+def test_reads_only_accessed_chunks():
+    computed = []
+    lazy, expected = _lazy([25, 17], 10, computed)
+    assert len(lazy) == 42 and computed == []
+    np.testing.assert_array_equal(ak.to_numpy(lazy[[27, 3, 28]]), expected[[27, 3, 28]])
+    assert sorted(computed) == [(0, 0, 10), (1, 0, 10)]
+    lazy[5]
+    assert len(computed) == 2 # from the store
+    np.testing.assert_array_equal(ak.to_numpy(lazy.to_ak()), expected)
+    assert sorted(computed) == [(0, 0, 10), (0, 10, 20), (0, 20, 25), (1, 0, 10), (1, 10, 17)]
+
+def test_lazy_compile_matches_eager(lh5_files):
+    inputs = [("e", "ch1027201/raw/energy"), ("b", "ch1027201/raw/baseline")]
+    gen = [(["e", "b"], "d", lambda x: x[0] - x[1])]
+    expected = compile_arrays(inputs, gen, tier_filename_dict=lh5_files)
+    lazy = compile_arrays(inputs, gen, tier_filename_dict=lh5_files, lazy=True, chunk_size=300)
+    rows = np.random.default_rng(2).integers(0, len(expected["d"]), 50)
+    assert len(lazy["d"]) == len(expected["d"])
+    np.testing.assert_array_equal(ak.to_numpy(lazy["d"][rows]), ak.to_numpy(expected["d"])[rows])
+    np.testing.assert_array_equal(ak.to_numpy(lazy["e"].to_ak()), ak.to_numpy(expected["e"]))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from latools.backends import is_headless, set_headless
+from latools.browse import BrowseTask
+from latools.core import main_loop
+from latools.counter import CountTask
+from latools.histogram import HistogramTask, Histogram2DTask, CategoricalHistogramTask, CategoricalHistogram2DTask
+
+INPUTS = [("e", "ch1027201/raw/energy"), ("b", "ch1027201/raw/baseline")]
+
+@pytest.fixture(autouse=True)
+def headless():
+    previous = is_headless()
+    set_headless()
+    yield
+    set_headless(previous)
+
+def _tasks() -> dict:
+    return {"count": (["e"], CountTask(lambda x: x[0] > 500)),
+            "hist": (["e"], HistogramTask(0, 1000, 50)),
+            "hist2d": (["e", "b"], Histogram2DTask(0, 1000, 20, 80, 120, 20)),
+            "categorical": (["e"], CategoricalHistogramTask(lambda x: x[0] // 100)),
+            "categorical2d": (["e", "b"], CategoricalHistogram2DTask(lambda x: x[0] // 250, lambda x: x[1] > 100)),
+            "browse": (["e"], BrowseTask(lambda x: x[0] > 990, "V01", max_entries=10**9, autodraw=False,
+                                         prefetch=False))}
+
+def _run(files, **kwargs) -> dict:
+    tasks = _tasks()
+    main_loop(INPUTS, [], list(tasks.values()), tier_filename_dict=files, **kwargs)
+    return {name: task for name, (_, task) in tasks.items()}
+
+@pytest.mark.parametrize("kwargs", [{}, {"chunk_size": 300}])
+def test_workers_match_serial(lh5_files, kwargs):
+    serial = _run(lh5_files, **kwargs)
+    parallel = _run(lh5_files, workers=2, **kwargs)
+    for name in ["count", "hist", "hist2d", "categorical", "categorical2d"]:
+        expected, result = serial[name].result(), parallel[name].result()
+        assert expected.keys() == result.keys()
+        for field in expected:
+            np.testing.assert_array_equal(result[field], expected[field], err_msg=f"{name}/{field}")
+    assert serial["count"].counter > 0 and serial["categorical"].nr_entries > 0
+    browse, parallel_browse = serial["browse"], parallel["browse"]
+    assert parallel_browse.files == browse.files and parallel_browse.nr_entries == browse.nr_entries > 0
+    for expected, result in zip(browse.entries, parallel_browse.entries, strict=True):
+        np.testing.assert_array_equal(result, expected)
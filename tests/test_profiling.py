@@ -0,0 +1,22 @@
+from latools.executor import SocketExecutor
+from latools.profiling import Profiler
+from helpers import count_and_hist, run
+
+class _StageLog:
+    """Hook appending the stage names to a file (visible also from the worker processes)"""
+    def __init__(self, path: str):
+        self.path = path
+    def __call__(self, record):
+        with open(self.path, "a") as f:
+            f.write(f"{record.stage}\n")
+
+def test_hooks_run_in_socket_workers(lh5_files, tmp_path):
+    path = str(tmp_path / "stages.txt")
+    profiler = Profiler(hooks=[_StageLog(path)])
+    count, hist = count_and_hist()
+    with SocketExecutor(2) as executor:
+        run(lh5_files, count, hist, profiler=profiler, executor=executor)
+    with open(path) as f:
+        stages = f.read().split()
+    assert stages.count("read:e") == len(lh5_files) # one per file, all in the workers
+    assert profiler.stages["read:e"]["calls"] == len(lh5_files) # the profiles of the workers got merged
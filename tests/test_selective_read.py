@@ -0,0 +1,46 @@
+import numpy as np
+import awkward as ak
+import pytest
+from latools.core import main_loop
+from latools.histogram import HistogramTask
+
+INPUTS = [("e", "ch1027201/raw/energy"), ("b", "ch1027201/raw/baseline")]
+CUT = (["e"], lambda x: x[0] > 700)
+
+def _file_arrays(filename: str) -> tuple[np.ndarray, np.ndarray]:
+    from lgdo import lh5
+    table = lh5.read("ch1027201/raw", filename)
+    return table["energy"].nda, table["baseline"].nda
+
+class _Rows:
+    """Collects the file entries, energies and baselines of the rows it gets"""
+    def __init__(self):
+        self.rows = []
+    def __call__(self, x, raw):
+        entries = raw.to_file_entries(np.arange(len(x[0]))) if getattr(raw, "entries", None) is not None else None
+        self.rows.append((str(raw), entries, ak.to_numpy(x[0]), ak.to_numpy(x[1])))
+
+@pytest.mark.parametrize("chunk_size", [None, 300])
+def test_selective_read_maps_rows_to_file_entries(lh5_files, chunk_size):
+    collector = _Rows()
+    main_loop(INPUTS, [], [(["e", "b"], collector)], tier_filename_dict=lh5_files, pre_reducer=CUT,
+              selective_read=True, chunk_size=chunk_size)
+    for filename_tiers in lh5_files:
+        energy, baseline = _file_arrays(filename_tiers["raw"])
+        parts = [row for row in collector.rows if row[0] == filename_tiers["raw"]]
+        entries = np.concatenate([part[1] for part in parts])
+        assert isinstance(parts[0][1], np.ndarray)
+        np.testing.assert_array_equal(entries, np.flatnonzero(energy > 700)) # compacted: only the selected rows
+        np.testing.assert_array_equal(np.concatenate([part[2] for part in parts]), energy[entries])
+        np.testing.assert_array_equal(np.concatenate([part[3] for part in parts]), baseline[entries])
+
+@pytest.mark.parametrize("chunk_size", [None, 300])
+def test_selective_read_matches_masked_read(lh5_files, chunk_size):
+    hists = []
+    for selective_read in (False, True):
+        hist = HistogramTask(80, 120, 40, fcn=lambda x: ak.drop_none(x[0]))
+        main_loop(INPUTS, [], [(["b"], hist)], tier_filename_dict=lh5_files, pre_reducer=CUT,
+                  selective_read=selective_read, chunk_size=chunk_size)
+        hists.append(hist)
+    np.testing.assert_array_equal(hists[0].flow_hist, hists[1].flow_hist)
+    assert hists[1].nr_entries == sum(np.count_nonzero(_file_arrays(f["raw"])[0] > 700) for f in lh5_files)
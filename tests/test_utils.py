@@ -0,0 +1,65 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from lgdo.types import VectorOfVectors
+from latools.utils import ChannelIndex, get_channel_index, map_detector_name_to_rawid, atomic_write
+
+def _reference_map(detector_names, rawids, prev_map):
+    """The former element-wise implementation"""
+    this_map = dict(prev_map)
+    for det_row, raw_row in zip(detector_names, rawids):
+        for det, raw in zip(det_row, raw_row):
+            this_map[det] = raw
+    return this_map
+
+def test_map_detector_name_to_rawid_matches_loop():
+    rng = np.random.default_rng(4)
+    names = np.array([f"V{i:02d}".encode() for i in range(30)])
+    lengths = rng.integers(0, 4, 2000)
+    positions = rng.integers(0, 30, lengths.sum())
+    detector_names = VectorOfVectors(flattened_data=names[positions], cumulative_length=np.cumsum(lengths))
+    rawids = VectorOfVectors(flattened_data=(1000 + positions).astype(np.uint32), cumulative_length=np.cumsum(lengths))
+    assert map_detector_name_to_rawid(detector_names, rawids) == _reference_map(detector_names, rawids, {})
+
+def test_map_detector_name_to_rawid_conflicts_and_accumulation():
+    detector_names = VectorOfVectors([[b"A", b"B"], [b"A"], [b"C", b"D"]])
+    rawids = VectorOfVectors([[1, 2], [3, 9], [5]]) # rows of different lengths: D has no rawid
+    accumulated = {b"C": 7}
+    result = map_detector_name_to_rawid(detector_names, rawids, accumulated, on_conflict="ignore")
+    assert result is accumulated
+    assert result == _reference_map(detector_names, rawids, {b"C": 7}) == {b"A": 3, b"B": 2, b"C": 5}
+    with pytest.raises(ValueError, match="A: \\[1, 3\\]"):
+        map_detector_name_to_rawid(detector_names, rawids, on_conflict="raise")
+    assert map_detector_name_to_rawid(VectorOfVectors([[b"A"]]), VectorOfVectors([[4]]), {b"A": 4},
+                                      on_conflict="raise") == {b"A": 4}
+
+def _channelmap(rawids: dict[str, int]) -> dict:
+    return {name: SimpleNamespace(daq=SimpleNamespace(rawid=rawid)) for name, rawid in rawids.items()}
+
+def test_channel_index_lookups():
+    index = ChannelIndex(_channelmap({"V01": 10, "S02": 5, "B03": 7}))
+    np.testing.assert_array_equal(index.positions_of([7, 10, 99]), [2, 0, -1])
+    assert list(index.names_of([5, 99])) == ["S02", None]
+    assert index.keys_in_system("geds") == ["V01", "B03"]
+    assert index.filtered_keys_in_system("geds", [7]) == ["B03"]
+
+def test_channel_index_cache_is_bounded():
+    import latools.utils as utils
+    channelmaps = [_channelmap({"V01": i}) for i in range(3 * utils._CHANNEL_INDICES_KEPT)]
+    for channelmap in channelmaps:
+        assert get_channel_index(channelmap).rawid("V01") == channelmap["V01"].daq.rawid
+    assert len(utils._channel_indices) <= utils._CHANNEL_INDICES_KEPT
+    assert get_channel_index(channelmaps[0]).rawid("V01") == 0
+
+def test_atomic_write_keeps_the_old_file_on_errors(tmp_path):
+    path = str(tmp_path / "file.txt")
+    with atomic_write(path, "w") as f:
+        f.write("old")
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, "w") as f:
+            f.write("half")
+            raise RuntimeError("crash")
+    with open(path) as f:
+        assert f.read() == "old"
+    assert os.listdir(tmp_path) == ["file.txt"]